@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''Compare random-row sampling strategies on a large local .npy file.
+
+Strategies:
+
+``per_row``
+    The pattern from ``examples/mux/mux_files_example.py``: one
+    ``np.random.randint`` and one row read per item.
+
+``npy_random``
+    `pescador.io.NPYStreamer` in `random` mode: indices drawn in blocks,
+    and each block read in file order.
+
+``chunked``
+    `pescador.io.chunked_mux`: contiguous chunks shuffled internally and
+    interleaved by a `StochasticMux`.
+
+To measure disk rather than page-cache throughput, the file is evicted
+from the page cache before each run (via ``posix_fadvise``, where
+available).  Results are only meaningful for files on the storage device
+of interest, and larger than any on-device cache.  When the file is
+served from memory (e.g. on tmpfs), per-item mux overhead dominates and
+``chunked`` will be the slowest strategy.
+
+Usage::
+
+    python benchmarks/chunk_sampling.py --path /data/bench.npy --rows 4000000
+'''
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+import pescador
+
+
+def make_file(path, n_rows, n_cols):
+    '''Write an (n_rows, n_cols) float32 array to `path`, in pieces.'''
+    data = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                     shape=(n_rows, n_cols))
+    step = max(1, 2**26 // (4 * n_cols))
+    for start in range(0, n_rows, step):
+        stop = min(n_rows, start + step)
+        data[start:stop] = np.arange(start, stop)[:, np.newaxis]
+    data.flush()
+    del data
+
+
+def evict(path):
+    '''Drop `path` from the page cache, if the platform allows it.'''
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+
+    fdesc = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fdesc, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fdesc)
+    return True
+
+
+def per_row(path):
+    X = np.load(path, mmap_mode='r')
+    n = len(X)
+    while True:
+        i = np.random.randint(0, n)
+        yield {'X': np.array(X[i])}
+
+
+STRATEGIES = {
+    'per_row': lambda args: pescador.Streamer(per_row, args.path),
+    'npy_random': lambda args: pescador.io.NPYStreamer(
+        args.path, mode='random', block_size=args.block_size),
+    'chunked': lambda args: pescador.io.chunked_mux(
+        args.path, args.chunk_size, args.n_active),
+}
+
+
+def run(streamer, n_items):
+    '''Time drawing `n_items` from `streamer`.'''
+    start = time.time()
+    first = None
+    for i, _ in enumerate(streamer.iterate(max_iter=n_items)):
+        if first is None:
+            first = time.time() - start
+    total = time.time() - start
+
+    return dict(items=n_items, seconds=total, first_item=first,
+                items_per_second=n_items / total)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--path', default='/tmp/pescador_chunk_bench.npy')
+    parser.add_argument('--rows', type=int, default=2**21)
+    parser.add_argument('--cols', type=int, default=128)
+    parser.add_argument('--items', type=int, default=2**16)
+    parser.add_argument('--chunk-size', type=int, default=1024)
+    parser.add_argument('--n-active', type=int, default=16)
+    parser.add_argument('--block-size', type=int, default=1024)
+    parser.add_argument('--output', default=None,
+                        help='Optional path to save results as JSON')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print('Writing {} x {} rows to {}'.format(args.rows, args.cols,
+                                                  args.path))
+        make_file(args.path, args.rows, args.cols)
+
+    results = dict()
+    for name in sorted(STRATEGIES):
+        cold = evict(args.path)
+        results[name] = run(STRATEGIES[name](args), args.items)
+        results[name]['cold_cache'] = cold
+        print('{:>12s}: {:12.1f} items/s  ({:.3f}s to first item)'.format(
+            name, results[name]['items_per_second'],
+            results[name]['first_item']))
+
+    if args.output:
+        with open(args.output, 'w') as fdesc:
+            json.dump(dict(params=vars(args), results=results), fdesc,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    main()
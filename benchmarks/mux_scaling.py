@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''Measure how muxes scale with the number of sources.
+
+For each mux and each number of sources (on a log scale), a fresh
+process records:
+
+``sources``
+    Seconds to construct the source streamers
+
+``construct``
+    Seconds to construct the mux
+
+``enter``
+    Seconds for ``mux.__enter__``, which copies and activates the mux
+
+``first_item``
+    Seconds from ``mux.iterate()`` to the first item, including activation
+
+``items_per_second``
+    Steady-state throughput, after the first item
+
+``peak_rss``
+    Peak resident memory of the process, in bytes, and ``base_rss``,
+    the resident memory before building anything
+
+Once a mux fails or exceeds ``--timeout`` at some size, larger sizes are
+skipped for it.  Sources are distinct streamers, each yielding a
+preallocated item, so that copying and activating them is not
+short-circuited.
+
+Usage::
+
+    python benchmarks/mux_scaling.py --max-sources 1000000 \
+        --output scaling.json
+'''
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import multiprocessing as mp
+import resource
+import sys
+import traceback
+
+import numpy as np
+
+import pescador
+
+from suite import _constant, _item, _timer, environment
+
+MUXES = {
+    'StochasticMux': lambda streamers: pescador.StochasticMux(
+        streamers, min(64, len(streamers)), rate=16, random_state=0),
+    'ShuffledMux': lambda streamers: pescador.ShuffledMux(
+        streamers, random_state=0),
+    'RoundRobinMux': lambda streamers: pescador.RoundRobinMux(
+        streamers, mode='cycle', random_state=0),
+    'ChainMux': lambda streamers: pescador.ChainMux(
+        streamers, mode='cycle'),
+}
+
+# ShuffledMux stops at the first exhausted source
+INFINITE = {'ShuffledMux'}
+
+
+def _rss():
+    '''Peak resident memory of this process, in bytes.'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def profile(name, n_sources, n_items):
+    '''Profile one mux over `n_sources` sources, in this process.'''
+    result = dict(mux=name, n_sources=n_sources, base_rss=_rss())
+
+    start = _timer()
+    item = _item()
+    n = None if name in INFINITE else 64
+    streamers = [pescador.Streamer(_constant, item, n)
+                 for _ in range(n_sources)]
+    result['sources'] = _timer() - start
+
+    start = _timer()
+    mux = MUXES[name](streamers)
+    result['construct'] = _timer() - start
+
+    start = _timer()
+    with mux:
+        result['enter'] = _timer() - start
+
+    start = _timer()
+    stream = mux.iterate()
+    next(stream)
+    result['first_item'] = _timer() - start
+
+    start = _timer()
+    count = 0
+    for _ in itertools.islice(stream, n_items):
+        count += 1
+    seconds = _timer() - start
+    stream.close()
+
+    result['items'] = count
+    result['items_per_second'] = count / seconds if seconds > 0 else None
+    result['peak_rss'] = _rss()
+    return result
+
+
+def _worker(queue, name, n_sources, n_items):
+    try:
+        queue.put(profile(name, n_sources, n_items))
+    except BaseException:
+        queue.put(dict(mux=name, n_sources=n_sources,
+                       error=traceback.format_exc()))
+
+
+def run(name, n_sources, n_items, timeout):
+    '''Profile a mux in a fresh process, so that peak memory is isolated.'''
+    queue = mp.Queue()
+    proc = mp.Process(target=_worker, args=(queue, name, n_sources, n_items))
+    proc.start()
+    try:
+        result = queue.get(timeout=timeout)
+    except Exception:
+        result = dict(mux=name, n_sources=n_sources,
+                      error='timed out after {}s'.format(timeout))
+    finally:
+        proc.join(1)
+        if proc.is_alive():
+            proc.terminate()
+            proc.join()
+    return result
+
+
+def sizes(min_sources, max_sources, steps_per_decade):
+    '''Source counts on a log scale.'''
+    n = int(round(steps_per_decade * np.log10(max_sources / min_sources)))
+    grid = np.logspace(np.log10(min_sources), np.log10(max_sources), n + 1)
+    return sorted(set(int(round(x)) for x in grid))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--min-sources', type=int, default=10)
+    parser.add_argument('--max-sources', type=int, default=10**7)
+    parser.add_argument('--steps-per-decade', type=int, default=1)
+    parser.add_argument('--items', type=int, default=10000,
+                        help='Items to draw after the first one')
+    parser.add_argument('--timeout', type=float, default=600,
+                        help='Seconds to allow for each measurement')
+    parser.add_argument('--mux', action='append', choices=sorted(MUXES),
+                        help='Muxes to profile; may be repeated '
+                             '(default: all)')
+    parser.add_argument('--output', default=None,
+                        help='Optional path to save results as JSON')
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+
+    results = []
+    for name in args.mux or sorted(MUXES):
+        for n_sources in sizes(args.min_sources, args.max_sources,
+                               args.steps_per_decade):
+            result = run(name, n_sources, args.items, args.timeout)
+            results.append(result)
+
+            if 'error' in result:
+                print('{:>14s} {:>9d}: {}'.format(
+                    name, n_sources, result['error'].strip().split('\n')[-1]))
+                break
+
+            print('{:>14s} {:>9d}: construct {:8.3f}s  enter {:8.3f}s  '
+                  'first {:8.3f}s  {:10.1f} items/s  {:8.1f} MB'.format(
+                      name, n_sources, result['construct'], result['enter'],
+                      result['first_item'], result['items_per_second'],
+                      result['peak_rss'] / 2.0**20))
+
+    if args.output:
+        params = {key: value for key, value in vars(args).items()
+                  if key != 'output'}
+        with open(args.output, 'w') as fdesc:
+            json.dump(dict(environment=environment(), params=params,
+                           results=results), fdesc, indent=2)
+
+
+if __name__ == '__main__':
+    main()
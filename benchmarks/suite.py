@@ -0,0 +1,309 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''Measure the throughput of pescador's hot paths.
+
+Benchmarks, by group:
+
+``streamer``
+    `Streamer.iterate` and `Streamer.cycle` over a trivial generator,
+    against the bare generator as a baseline.
+
+``mux``
+    `iterate` of each `BaseMux` subclass, over a grid of `n_streams`
+    (and `n_active`, for `StochasticMux`).
+
+``maps``
+    `maps.buffer_stream` across item shapes.
+
+``zmq``
+    `ZMQStreamer` throughput by payload size, including serialization
+    and `zmq_recv_data`.
+
+Every benchmark draws a fixed number of items, and reports the median
+items per second over several repeats, and the per-item time.
+Timing starts after the first item, so activation and process start-up
+are excluded.  Sources yield preallocated arrays, so the results measure
+pescador's own overhead.  For disk-bound sampling, see
+``chunk_sampling.py``.
+
+Usage::
+
+    python benchmarks/suite.py --output results.json
+    python benchmarks/suite.py --quick --filter mux.StochasticMux
+'''
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+import pescador
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+def _constant(item, n=None):
+    '''Yield the same item, `n` times or forever.'''
+    if n is None:
+        while True:
+            yield item
+    else:
+        for _ in range(n):
+            yield item
+
+
+def _item(shape=(8,)):
+    return {'X': np.ones(shape, dtype=np.float32)}
+
+
+def measure(make_stream, n_items, repeats, items_per_step=1):
+    '''Time drawing `n_items` from fresh streams.
+
+    Parameters
+    ----------
+    make_stream : callable
+        Returns an iterable of at least `n_items` items.
+
+    n_items : int > 1
+        The number of items to draw per repeat.
+
+    repeats : int > 0
+        The number of times to repeat the measurement.
+
+    items_per_step : int > 0
+        The number of input items in each item of the stream, e.g., the
+        batch size of a buffered stream.
+
+    Returns
+    -------
+    result : dict
+        Items timed per repeat, the median, minimum and maximum items per
+        second, and the median microseconds per item.
+    '''
+    n_steps = max(2, n_items // items_per_step)
+
+    rates = []
+    timed = 0
+    for _ in range(repeats):
+        stream = iter(make_stream())
+
+        # Exclude activation and start-up from the timing
+        next(stream)
+        timed = 0
+        start = _timer()
+        for _ in itertools.islice(stream, n_steps - 1):
+            timed += items_per_step
+        seconds = _timer() - start
+
+        if hasattr(stream, 'close'):
+            stream.close()
+
+        rates.append(timed / seconds if seconds > 0 else float('inf'))
+
+    rates = np.asarray(rates)
+    median = float(np.median(rates))
+    return dict(items=timed, repeats=repeats,
+                items_per_second=median,
+                min_items_per_second=float(rates.min()),
+                max_items_per_second=float(rates.max()),
+                rates=rates.tolist(),
+                us_per_item=1e6 / median)
+
+
+def bench_streamer(args):
+    item = _item()
+
+    def __bare():
+        return _constant(item)
+
+    def __iterate():
+        return pescador.Streamer(_constant, item).iterate()
+
+    def __cycle():
+        # Restart the generator every 100 items
+        return pescador.Streamer(_constant, item, 100).cycle()
+
+    yield 'streamer.generator', dict(), __bare
+    yield 'streamer.iterate', dict(), __iterate
+    yield 'streamer.cycle', dict(items_per_activation=100), __cycle
+
+
+def _sources(n_streams, n_items=None):
+    item = _item()
+    return [pescador.Streamer(_constant, item, n_items)
+            for _ in range(n_streams)]
+
+
+def bench_mux(args):
+    for n_streams in args.n_streams:
+        for n_active in args.n_active:
+            if n_active > n_streams:
+                continue
+            for mode in ['with_replacement', 'single_active']:
+                params = dict(n_streams=n_streams, n_active=n_active,
+                              mode=mode)
+                yield ('mux.StochasticMux', params,
+                       lambda n_streams=n_streams, n_active=n_active,
+                       mode=mode: pescador.StochasticMux(
+                           _sources(n_streams, 64), n_active, rate=16,
+                           mode=mode, random_state=0).iterate())
+
+        params = dict(n_streams=n_streams)
+        yield ('mux.ShuffledMux', params,
+               lambda n_streams=n_streams: pescador.ShuffledMux(
+                   _sources(n_streams), random_state=0).iterate())
+
+        yield ('mux.RoundRobinMux', params,
+               lambda n_streams=n_streams: pescador.RoundRobinMux(
+                   _sources(n_streams, 64), mode='cycle',
+                   random_state=0).iterate())
+
+        yield ('mux.ChainMux', params,
+               lambda n_streams=n_streams: pescador.ChainMux(
+                   _sources(n_streams, 64), mode='cycle').iterate())
+
+
+def bench_maps(args):
+    for shape in args.shapes:
+        item = _item(shape)
+        params = dict(shape=list(shape), batch_size=args.batch_size)
+        yield ('maps.buffer_stream', params,
+               lambda item=item: pescador.maps.buffer_stream(
+                   _constant(item), args.batch_size))
+
+
+def bench_zmq(args):
+    for nbytes in args.payloads:
+        item = {'X': np.ones(nbytes // 4, dtype=np.float32)}
+        params = dict(payload_bytes=nbytes)
+        yield ('zmq.ZMQStreamer', params,
+               lambda item=item: pescador.ZMQStreamer(
+                   pescador.Streamer(_constant, item)).iterate())
+
+
+BENCHMARKS = [bench_streamer, bench_mux, bench_maps, bench_zmq]
+
+
+def benchmark_id(name, params):
+    '''A stable identifier for a benchmark and its parameters.'''
+    if not params:
+        return name
+    return '{}[{}]'.format(name, ','.join(
+        '{}={}'.format(key, params[key]) for key in sorted(params)))
+
+
+def _n_items(name, params, args):
+    '''Scale the number of items down for large payloads.'''
+    if name == 'zmq.ZMQStreamer':
+        return int(np.clip(args.zmq_bytes // params['payload_bytes'],
+                           16, args.items // 10))
+
+    if name == 'maps.buffer_stream':
+        nbytes = 4 * int(np.prod(params['shape']))
+        return int(np.clip(args.maps_bytes // nbytes, 4 * args.batch_size,
+                           args.items))
+
+    return args.items
+
+
+def run_suite(args):
+    '''Run all benchmarks whose identifiers contain `args.filter`.
+
+    Returns
+    -------
+    results : dict
+        Results of `measure`, with the benchmark name and parameters,
+        keyed by `benchmark_id`.
+    '''
+    results = dict()
+    for bench in BENCHMARKS:
+        for name, params, make_stream in bench(args):
+            key = benchmark_id(name, params)
+            if args.filter and not any(f in key for f in args.filter):
+                continue
+
+            result = measure(make_stream, _n_items(name, params, args),
+                             args.repeats,
+                             items_per_step=params.get('batch_size', 1))
+
+            result.update(name=name, params=params)
+            if name == 'zmq.ZMQStreamer':
+                result['mb_per_second'] = (result['items_per_second'] *
+                                           params['payload_bytes'] / 2**20)
+
+            results[key] = result
+            if args.verbose:
+                print('{:<72s} {:14.1f} items/s {:10.2f} us/item'.format(
+                    key, result['items_per_second'], result['us_per_item']))
+    return results
+
+
+def environment():
+    '''Describe the software and hardware the suite ran on.'''
+    return dict(python=sys.version.split()[0],
+                numpy=np.__version__,
+                pescador=pescador.__version__,
+                platform=platform.platform(),
+                machine=platform.machine(),
+                processor=platform.processor(),
+                timestamp=time.time())
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--items', type=int, default=200000,
+                        help='Items to draw per repeat')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--quick', action='store_true',
+                        help='Use fewer items and a smaller grid')
+    parser.add_argument('--filter', action='append', default=[],
+                        help='Only run benchmarks whose id contains this; '
+                             'may be repeated')
+    parser.add_argument('--output', default=None,
+                        help='Optional path to save results as JSON')
+    parser.add_argument('--quiet', dest='verbose', action='store_false')
+    return parser
+
+
+def configure(args):
+    '''Fill in the benchmark grid, which depends on `--quick`.'''
+    if args.quick:
+        args.items = min(args.items, 20000)
+        args.repeats = min(args.repeats, 3)
+        args.n_streams = [10, 1000]
+        args.n_active = [4, 64]
+        args.shapes = [(128,), (3, 64, 64)]
+        args.payloads = [2**10, 2**20]
+        args.maps_bytes = 2**26
+        args.zmq_bytes = 2**26
+    else:
+        args.n_streams = [10, 100, 1000, 10000]
+        args.n_active = [1, 16, 256]
+        args.shapes = [(1,), (128,), (64, 64), (3, 128, 128)]
+        args.payloads = [2**10, 2**16, 2**20, 2**24]
+        args.maps_bytes = 2**28
+        args.zmq_bytes = 2**28
+    args.batch_size = 32
+    return args
+
+
+def main():
+    args = configure(get_parser().parse_args())
+
+    results = run_suite(args)
+
+    if args.output:
+        params = {key: value for key, value in vars(args).items()
+                  if key not in ('output', 'verbose')}
+        with open(args.output, 'w') as fdesc:
+            json.dump(dict(environment=environment(), params=params,
+                           results=results), fdesc, indent=2)
+
+
+if __name__ == '__main__':
+    main()
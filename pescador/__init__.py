@@ -3,8 +3,12 @@
 
 from .exceptions import *
 from .core import *
+from .cache import *
+from .io import *
 from .maps import *
 from .mux import *
+from .memory import *
+from .tracing import *
 from .zmq_stream import *
 
 from .version import version as __version__
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''Run the benchmark suite, and compare results between revisions.
+
+Usage, from a git checkout of pescador::
+
+    # Run benchmarks/suite.py, and store the results under
+    # benchmarks/results/<machine fingerprint>/<git revision>.json
+    python -m pescador.bench run --quick
+
+    # Compare two results, by file or by git revision.
+    # Exits with status 1 if anything is significantly slower.
+    python -m pescador.bench compare master HEAD --threshold 0.1
+
+A benchmark is significantly slower if its median throughput drops by
+more than the threshold, and the throughputs of all repeats are below
+those of the baseline, so that changes within the noise between repeats
+are not reported.  Results from different machines are compared with a
+warning.
+'''
+from __future__ import print_function
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+
+import numpy as np
+
+__all__ = ['run', 'compare', 'main']
+
+
+def _git(*args, **kwargs):
+    cwd = kwargs.pop('cwd', None)
+    output = subprocess.check_output(('git',) + args, cwd=cwd)
+    return output.decode('utf-8').strip()
+
+
+def toplevel(path=None):
+    '''The root of the git checkout containing `path`.'''
+    return _git('rev-parse', '--show-toplevel', cwd=path)
+
+
+def revision(path=None, rev='HEAD'):
+    '''The full hash of a git revision.
+
+    For `HEAD`, ``-dirty`` is appended if tracked files have been modified.
+    '''
+    commit = _git('rev-parse', '--verify', rev + '^{commit}', cwd=path)
+    if rev == 'HEAD' and _git('status', '--porcelain', '--untracked-files=no',
+                              cwd=path):
+        commit += '-dirty'
+    return commit
+
+
+def machine():
+    '''Describe the hardware and software which affect performance.'''
+    info = dict(machine=platform.machine(),
+                processor=platform.processor(),
+                system=platform.system(),
+                cpu_count=os.cpu_count() if hasattr(os, 'cpu_count') else None,
+                python=platform.python_version(),
+                numpy=np.__version__)
+
+    try:
+        with open('/proc/cpuinfo') as fdesc:
+            for line in fdesc:
+                if line.startswith('model name'):
+                    info['cpu'] = line.split(':', 1)[1].strip()
+                    break
+    except (IOError, OSError):
+        pass
+
+    return info
+
+
+def fingerprint(info=None):
+    '''A short, stable identifier of `machine()`.'''
+    if info is None:
+        info = machine()
+    blob = json.dumps(info, sort_keys=True).encode('utf-8')
+    return hashlib.sha1(blob).hexdigest()[:12]
+
+
+def load_suite(path):
+    '''Import a benchmark suite module from a file.'''
+    try:
+        import importlib.util
+        spec = importlib.util.spec_from_file_location('suite', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except ImportError:
+        import imp
+        module = imp.load_source('suite', path)
+    return module
+
+
+def results_path(results_dir, fprint, rev):
+    return os.path.join(results_dir, fprint, '{}.json'.format(rev))
+
+
+def run(suite_path, results_dir, suite_args=()):
+    '''Run the benchmark suite, and store its results.
+
+    Parameters
+    ----------
+    suite_path : str
+        Path to ``benchmarks/suite.py``
+
+    results_dir : str
+        Results are written to ``<results_dir>/<fingerprint>/<revision>.json``
+
+    suite_args : list of str
+        Command-line arguments for the suite, e.g. ``['--quick']``
+
+    Returns
+    -------
+    path : str
+        The path of the stored results
+    '''
+    suite = load_suite(suite_path)
+    args = suite.configure(suite.get_parser().parse_args(list(suite_args)))
+
+    info = machine()
+    rev = revision(os.path.dirname(os.path.abspath(suite_path)))
+    record = dict(revision=rev, fingerprint=fingerprint(info), machine=info,
+                  environment=suite.environment(), params=vars(args),
+                  results=suite.run_suite(args))
+
+    path = results_path(results_dir, record['fingerprint'], rev)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+
+    with open(path, 'w') as fdesc:
+        json.dump(record, fdesc, indent=2)
+
+    return path
+
+
+def compare(base, new, threshold=0.1):
+    '''Compare two sets of benchmark results.
+
+    Parameters
+    ----------
+    base, new : dict
+        Results, as stored by `run`
+
+    threshold : float > 0
+        The relative change in median throughput below which differences
+        are ignored.
+
+    Returns
+    -------
+    rows : list of dict
+        For each benchmark in either set: its `id`, the `base` and `new`
+        median items per second, their `ratio`, and a `status` of
+        ``'slower'``, ``'faster'``, ``'same'``, ``'added'`` or
+        ``'removed'``.
+    '''
+    rows = []
+    base_results, new_results = base['results'], new['results']
+    for key in sorted(set(base_results) | set(new_results)):
+        row = dict(id=key, base=None, new=None, ratio=None)
+        if key not in new_results:
+            row.update(status='removed',
+                       base=base_results[key]['items_per_second'])
+        elif key not in base_results:
+            row.update(status='added',
+                       new=new_results[key]['items_per_second'])
+        else:
+            old, cur = base_results[key], new_results[key]
+            row['base'] = old['items_per_second']
+            row['new'] = cur['items_per_second']
+            row['ratio'] = row['new'] / row['base']
+
+            # Require the repeats to be separated, as well as the medians
+            if (row['ratio'] < 1. / (1 + threshold) and
+                    max(cur['rates']) < min(old['rates'])):
+                row['status'] = 'slower'
+            elif (row['ratio'] > 1 + threshold and
+                    min(cur['rates']) > max(old['rates'])):
+                row['status'] = 'faster'
+            else:
+                row['status'] = 'same'
+        rows.append(row)
+    return rows
+
+
+def _resolve(name, results_dir, fprint):
+    '''Load results from a file, or from a stored git revision.'''
+    if not os.path.isfile(name):
+        if results_dir is None:
+            results_dir = os.path.join(toplevel(), 'benchmarks', 'results')
+        name = results_path(results_dir, fprint, revision(rev=name))
+    with open(name) as fdesc:
+        return json.load(fdesc)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='python -m pescador.bench',
+                                     description=__doc__.split('\n')[0])
+    parser.add_argument('--results-dir', default=None,
+                        help='Where results are stored '
+                             '(default: benchmarks/results in the checkout)')
+    commands = parser.add_subparsers(dest='command')
+
+    run_parser = commands.add_parser(
+        'run', help='Run the suite; other arguments are passed to it')
+    run_parser.add_argument('--suite', default=None,
+                            help='Path to the suite '
+                                 '(default: benchmarks/suite.py)')
+
+    compare_parser = commands.add_parser(
+        'compare', help='Compare two results, by path or git revision')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='Relative change to ignore '
+                                     '(default: 0.1)')
+    return parser
+
+
+def main(argv=None):
+    '''Run the command line interface.
+
+    Returns
+    -------
+    status : int
+        1 if `compare` finds a significant slowdown, otherwise 0.
+    '''
+    parser = get_parser()
+    args, rest = parser.parse_known_args(argv)
+
+    if args.command is None:
+        parser.error('a command is required')
+    if rest and args.command != 'run':
+        parser.error('unrecognized arguments: {}'.format(' '.join(rest)))
+
+    results_dir = args.results_dir
+
+    if args.command == 'run':
+        if results_dir is None:
+            results_dir = os.path.join(toplevel(), 'benchmarks', 'results')
+        suite_path = args.suite or os.path.join(toplevel(), 'benchmarks',
+                                                'suite.py')
+        print('Results saved to {}'.format(run(suite_path, results_dir,
+                                               rest)))
+        return 0
+
+    fprint = fingerprint()
+    base = _resolve(args.base, results_dir, fprint)
+    new = _resolve(args.new, results_dir, fprint)
+
+    if base.get('fingerprint') != new.get('fingerprint'):
+        print('Warning: comparing results from different machines '
+              '({} and {})'.format(base.get('fingerprint'),
+                                   new.get('fingerprint')))
+
+    print('{} -> {}'.format(base.get('revision'), new.get('revision')))
+    rows = compare(base, new, threshold=args.threshold)
+    for row in rows:
+        ratio = '' if row['ratio'] is None else '{:8.3f}x'.format(
+            row['ratio'])
+        print('{:<8s} {:>9s}  {}'.format(row['status'], ratio, row['id']))
+
+    slower = [row for row in rows if row['status'] == 'slower']
+    if slower:
+        print('{} benchmark(s) significantly slower'.format(len(slower)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
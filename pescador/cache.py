@@ -0,0 +1,799 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+Caching
+-------
+
+Cache the items produced by a streamer, so that expensive generators
+(e.g., decoders) only need to run once.
+
+`CachedStreamer` keeps items in memory for the lifetime of the process,
+while `DiskCachedStreamer` persists them across runs.
+
+.. autosummary::
+    :toctree: generated/
+
+    CachedStreamer
+    StreamCache
+    SharedCache
+    DiskCachedStreamer
+    DiskCache
+    streamer_hash
+'''
+import atexit
+import collections
+import errno
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import types
+import uuid
+
+import joblib
+import numpy as np
+import six
+
+from . import core
+from . import io
+from . import util
+from .exceptions import PescadorError
+
+__all__ = ['CachedStreamer', 'StreamCache', 'SharedCache',
+           'DiskCachedStreamer', 'DiskCache', 'streamer_hash']
+
+# Sentinel for cache misses, since items may be None
+_MISSING = object()
+
+
+class StreamCache(object):
+    '''An in-memory, least-recently-used cache of streamer items.
+
+    A single `StreamCache` can be shared by many `CachedStreamer` objects,
+    in which case `max_bytes` bounds their total memory use.
+
+    Attributes
+    ----------
+    max_bytes : int > 0 or None
+        The maximum number of bytes to retain.
+
+    nbytes : int
+        The number of bytes currently held.
+
+    hits : int
+    misses : int
+        The number of successful and failed lookups.
+    '''
+    def __init__(self, max_bytes=None):
+        '''
+        Parameters
+        ----------
+        max_bytes : int > 0 or None
+            The maximum total size (see `pescador.util.item_nbytes`) of
+            cached items.
+            When exceeded, the least recently used items are evicted.
+            If None, the cache is unbounded.
+
+        Raises
+        ------
+        PescadorError
+            If `max_bytes` is not positive.
+        '''
+        if max_bytes is not None and max_bytes <= 0:
+            raise PescadorError('max_bytes={} must be a positive '
+                                'number'.format(max_bytes))
+
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        self._items = collections.OrderedDict()
+        self._lengths = dict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        '''Look up an item, and mark it as recently used.
+
+        Parameters
+        ----------
+        key : hashable
+
+        default : object
+            The value to return if `key` is not in the cache.
+
+        Returns
+        -------
+        item : object
+            The cached item, or `default` if it is not in the cache.
+        '''
+        with self._lock:
+            entry = self._items.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._items[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, item):
+        '''Add an item to the cache, evicting others as necessary.
+
+        Items larger than `max_bytes` are not stored.
+
+        Parameters
+        ----------
+        key : hashable
+        item : object
+        '''
+        nbytes = util.item_nbytes(item)
+
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+
+            if self.max_bytes is not None and nbytes > self.max_bytes:
+                return
+
+            self._items[key] = (item, nbytes)
+            self.nbytes += nbytes
+
+            while self.max_bytes is not None and self.nbytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.nbytes -= evicted
+
+    def get_length(self, stream_key):
+        '''Get the recorded number of items in a complete pass of a stream.
+
+        Returns
+        -------
+        n_items : int or None
+            None if no complete pass has been recorded.
+        '''
+        with self._lock:
+            return self._lengths.get(stream_key)
+
+    def set_length(self, stream_key, n_items):
+        '''Record the number of items in a complete pass of a stream.'''
+        with self._lock:
+            self._lengths[stream_key] = n_items
+
+    def clear(self):
+        '''Remove all items and recorded lengths.'''
+        with self._lock:
+            self._items.clear()
+            self._lengths.clear()
+            self.nbytes = 0
+
+
+class CachedStreamer(core.Streamer):
+    '''A streamer which records its first complete pass in memory,
+    and replays it on subsequent passes.
+
+    The wrapped streamer must produce the same items, in the same order,
+    on every pass.  Cached items are shared between passes, so they should
+    not be modified in place by the consumer.
+
+    If an item has been evicted from the cache, or a previous pass stopped
+    before reaching it, the wrapped streamer is restarted and advanced to
+    that item to compute it.
+
+    To share cached items between `ZMQStreamer` worker processes, use a
+    `SharedCache`.
+
+    Examples
+    --------
+    Decode a validation set once, and replay it every epoch
+
+    >>> cache = pescador.StreamCache(max_bytes=2**30)
+    >>> streams = [pescador.CachedStreamer(pescador.Streamer(decode, f),
+    ...                                    cache=cache)
+    ...            for f in validation_files]
+    >>> validation = pescador.ChainMux(streams, mode='cycle')
+    '''
+    def __init__(self, streamer, cache=None):
+        '''
+        Parameters
+        ----------
+        streamer : pescador.Streamer, iterable, or generator function
+            The streamer to cache.
+            If not a `Streamer`, it is wrapped in one.
+
+        cache : StreamCache, SharedCache, or None
+            The cache to store items in.
+            If None, a new unbounded `StreamCache` is used.
+        '''
+        if not isinstance(streamer, core.Streamer):
+            streamer = core.Streamer(streamer)
+
+        if cache is None:
+            cache = StreamCache()
+
+        self.source = streamer
+        self.cache = cache
+
+        # Identifies this streamer's items in a shared cache.
+        # This is retained by copies.
+        self.cache_key = uuid.uuid4().hex
+
+        super(CachedStreamer, self).__init__(self._generate)
+
+    def __deepcopy__(self, memo):
+        '''The cache is shared, rather than copied, by all copies.'''
+        memo[id(self.cache)] = self.cache
+        return super(CachedStreamer, self).__deepcopy__(memo)
+
+    @property
+    def cached(self):
+        '''True if a complete pass has been recorded.'''
+        return self.cache.get_length(self.cache_key) is not None
+
+    def _generate(self):
+        n_items = self.cache.get_length(self.cache_key)
+
+        # Yield cached items where possible, and otherwise compute them
+        # from the source.  Once the source is exhausted, the length of
+        # the stream is recorded so that later passes know where to stop.
+        source, position = None, 0
+        i = 0
+        while n_items is None or i < n_items:
+            item = self.cache.get((self.cache_key, i), _MISSING)
+
+            if item is _MISSING:
+                if source is None or position > i:
+                    source, position = self.source.iterate(), 0
+
+                try:
+                    while position <= i:
+                        item = six.advance_iterator(source)
+                        self.cache.put((self.cache_key, position), item)
+                        position += 1
+                except StopIteration:
+                    self.cache.set_length(self.cache_key, position)
+                    return
+
+            yield item
+            i += 1
+
+
+def _code_token(code):
+    '''A hashable summary of a code object which is stable across runs.'''
+    consts = tuple(_code_token(const) if isinstance(const, types.CodeType)
+                   else const
+                   for const in code.co_consts)
+    return (code.co_code, consts, code.co_names)
+
+
+def _value_token(value, name, seen):
+    '''A stable summary of a default or closure value of a function.'''
+    if isinstance(value, types.FunctionType):
+        return _function_token(value, seen)
+
+    try:
+        return joblib.hash(value)
+    except Exception as exc:
+        raise PescadorError('Cannot hash {} of the generator: {}'.format(
+            name, exc))
+
+
+def _function_token(function, seen=None):
+    '''A stable summary of a function: its qualified name, byte code,
+    default arguments, and the values it closes over.'''
+    name = '{}.{}'.format(function.__module__,
+                          getattr(function, '__qualname__',
+                                  function.__name__))
+
+    # Recursive closures refer to themselves
+    seen = set() if seen is None else seen
+    if id(function) in seen:
+        return name
+    seen.add(id(function))
+
+    defaults = tuple(_value_token(value, 'a default argument', seen)
+                     for value in six.get_function_defaults(function) or ())
+
+    kwdefaults = getattr(function, '__kwdefaults__', None) or dict()
+    kwdefaults = tuple((key, _value_token(kwdefaults[key],
+                                          'a default argument', seen))
+                       for key in sorted(kwdefaults))
+
+    closure = []
+    for cell in six.get_function_closure(function) or ():
+        try:
+            value = cell.cell_contents
+        except ValueError:
+            raise PescadorError('Cannot hash the closure of {}: a variable '
+                                'is not yet assigned'.format(name))
+        closure.append(_value_token(value, 'a closure variable', seen))
+
+    return (name, _code_token(six.get_function_code(function)),
+            defaults, kwdefaults, tuple(closure))
+
+
+def streamer_hash(streamer):
+    '''Compute a stable hash for the items produced by a streamer.
+
+    For a generator function, the hash covers the function's qualified name,
+    its byte code, its default arguments, the values of variables it closes
+    over, and the arguments it will be called with.
+    For an iterable, it covers the iterable itself.
+
+    The hash does not capture global state or functions called by the
+    generator, so if these change, the cache must be cleared manually.
+
+    Parameters
+    ----------
+    streamer : pescador.Streamer
+
+    Returns
+    -------
+    key : str
+        A hexadecimal digest
+
+    Raises
+    ------
+    PescadorError
+        If a default argument or closure variable of the generator
+        cannot be hashed.
+    '''
+    function = streamer.streamer
+
+    if isinstance(function, types.FunctionType):
+        token = _function_token(function)
+    else:
+        token = function
+
+    return joblib.hash((token, streamer.args, streamer.kwargs))
+
+
+class DiskCache(object):
+    '''A directory of cached streams, stored in the `pescador.io` shard
+    format.
+
+    Entries are evicted by age (time since last use) and by total size,
+    least recently used first.  Eviction runs whenever a new entry is
+    written.
+
+    All operations are safe with several processes (e.g., `ZMQStreamer`
+    workers) using the same directory: entries are written to temporary
+    files and atomically renamed into place.
+
+    Attributes
+    ----------
+    directory : str
+    max_bytes : int > 0 or None
+    max_age : float > 0 or None
+    '''
+    def __init__(self, directory, max_bytes=None, max_age=None):
+        '''
+        Parameters
+        ----------
+        directory : str
+            Path to the cache directory. It is created if necessary.
+
+        max_bytes : int > 0 or None
+            The maximum total size of the cache files.
+            If None, the cache is unbounded.
+
+        max_age : float > 0 or None
+            Entries unused for more than `max_age` seconds are evicted.
+            If None, entries do not expire.
+
+        Raises
+        ------
+        PescadorError
+            If `max_bytes` or `max_age` is not positive.
+        '''
+        if max_bytes is not None and max_bytes <= 0:
+            raise PescadorError('max_bytes={} must be a positive '
+                                'number'.format(max_bytes))
+
+        if max_age is not None and max_age <= 0:
+            raise PescadorError('max_age={} must be a positive '
+                                'number'.format(max_age))
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # Another process may have created it first
+                if not os.path.isdir(directory):
+                    raise
+
+    def path(self, key):
+        '''The path of the cache file for `key`'''
+        return os.path.join(self.directory, key + io.SHARD_EXTENSION)
+
+    def _entries(self):
+        '''List (last used, size, path) for every entry, oldest first.'''
+        entries = []
+        for path in glob.glob(self.path('*')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Evicted by someone else
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        return sorted(entries)
+
+    @property
+    def nbytes(self):
+        '''The total size of all entries'''
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        '''Remove expired entries, and then the least recently used entries
+        until the total size is at most `max_bytes`.'''
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+
+        for mtime, size, path in entries:
+            expired = (self.max_age is not None and
+                       now - mtime > self.max_age)
+            too_big = self.max_bytes is not None and total > self.max_bytes
+
+            if not (expired or too_big):
+                continue
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        '''Remove all entries.'''
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# Directories created by SharedCache in this process, removed at exit
+_SHARED_DIRECTORIES = dict()
+
+
+@atexit.register
+def _remove_shared_directories():
+    for directory, pid in list(_SHARED_DIRECTORIES.items()):
+        if pid == os.getpid():
+            shutil.rmtree(directory, ignore_errors=True)
+    _SHARED_DIRECTORIES.clear()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        # EPERM: the process exists, but belongs to another user
+        return exc.errno == errno.EPERM
+    return True
+
+
+def _remove_stale_directories(root):
+    '''Remove `SharedCache` directories left in `root` by processes which
+    were killed before they could clean up.'''
+    for directory in glob.glob(os.path.join(root, 'pescador-*-*')):
+        try:
+            pid = int(os.path.basename(directory).split('-')[1])
+        except ValueError:
+            continue
+        if not _pid_alive(pid):
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class SharedCache(DiskCache):
+    '''A cache of data items in shared memory, which can be read and
+    populated by several processes at once.
+
+    A `SharedCache` can be used in place of a `StreamCache` by
+    `CachedStreamer`.  Each item is stored as a file in a memory-backed
+    file system (``/dev/shm`` where available), so that all processes on a
+    host, such as the workers started by `ZMQStreamer` for every epoch, see
+    the same items.  Reads are lock-free memory maps, and writes are atomic
+    renames, so no locking is required.
+
+    Items must be dictionaries of numpy arrays, and are returned as
+    read-only views.
+
+    Eviction is least recently used, and runs in each process after it has
+    written about ``max_bytes / 16`` bytes, so the cache may briefly exceed
+    `max_bytes` by that much per process.
+
+    A temporary directory created by the cache is removed by `close`, when
+    the cache is garbage collected, or when the process exits normally.
+    If the process is killed (e.g., by ``SIGKILL`` or an unhandled
+    ``SIGTERM``), the directory is left behind, and since ``/dev/shm`` is
+    held in memory, it occupies RAM until it is removed.  Such directories
+    are removed when the next `SharedCache` is created in ``/dev/shm``,
+    and can be removed by hand: they are named ``pescador-<pid>-*``.
+
+    Examples
+    --------
+    Decode each item once per host, rather than once per epoch
+
+    >>> with pescador.SharedCache(max_bytes=2**32) as cache:
+    ...     streams = [pescador.CachedStreamer(
+    ...                    pescador.Streamer(decode, f), cache=cache)
+    ...                for f in files]
+    ...     mux = pescador.StochasticMux(streams, n_active=8, rate=16)
+    ...     for epoch in range(10):
+    ...         for data in pescador.ZMQStreamer(mux).iterate(max_iter=1000):
+    ...             train(data)
+
+    Attributes
+    ----------
+    hits : int
+    misses : int
+        The number of successful and failed lookups in this process.
+    '''
+    def __init__(self, max_bytes=None, directory=None):
+        '''
+        Parameters
+        ----------
+        max_bytes : int > 0 or None
+            The maximum total size of cached items.
+            If None, half of the space available in the file system of
+            `directory` when the cache is created.
+
+        directory : str or None
+            The directory to store items in.
+            If None, a new temporary directory is created in ``/dev/shm``
+            (or the system default temporary directory), which is removed by
+            `close`, or at exit.
+
+        Raises
+        ------
+        PescadorError
+            If `max_bytes` is not positive.
+        '''
+        self.owner_pid = None
+        if directory is None:
+            root = None
+            if os.path.isdir('/dev/shm'):
+                root = '/dev/shm'
+                _remove_stale_directories(root)
+            directory = tempfile.mkdtemp(
+                prefix='pescador-{}-'.format(os.getpid()), dir=root)
+            self.owner_pid = os.getpid()
+            _SHARED_DIRECTORIES[directory] = self.owner_pid
+
+        if max_bytes is None:
+            max_bytes = self._default_max_bytes(directory)
+
+        super(SharedCache, self).__init__(directory, max_bytes=max_bytes)
+
+        self.hits = 0
+        self.misses = 0
+        self.nbytes_since_evict_ = 0
+
+    @staticmethod
+    def _default_max_bytes(directory):
+        '''Half of the space available to `directory`.'''
+        try:
+            stat = os.statvfs(directory)
+        except (AttributeError, OSError):
+            # No statvfs on Windows
+            return 2**30
+        return max(1, stat.f_bavail * stat.f_frsize // 2)
+
+    def __deepcopy__(self, memo):
+        # Copies would otherwise remove the directory when closed
+        return self
+
+    def __getstate__(self):
+        # Only the creating process owns the directory
+        state = self.__dict__.copy()
+        state['owner_pid'] = None
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        '''Remove the cache directory, if it was created by this object
+        in this process.'''
+        if self.owner_pid is not None and self.owner_pid == os.getpid():
+            shutil.rmtree(self.directory, ignore_errors=True)
+            _SHARED_DIRECTORIES.pop(self.directory, None)
+            self.owner_pid = None
+
+    @staticmethod
+    def _name(key):
+        '''A file name for a hashable key, e.g., (source id, item index).'''
+        return hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+
+    def get(self, key, default=None):
+        '''Look up an item.
+
+        Parameters
+        ----------
+        key : hashable
+            A key with a stable `repr`, e.g., a tuple of strings and ints.
+
+        default : object
+            The value to return if `key` is not in the cache.
+
+        Returns
+        -------
+        item : dict of np.ndarray
+            The cached item, or `default` if it is not in the cache.
+        '''
+        path = self.path(self._name(key))
+        try:
+            buf = np.asarray(np.memmap(path, dtype=np.uint8, mode='r'))
+            # Mark as recently used
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return io._read_shard_index(buf).view(buf, 0)
+
+    def put(self, key, item):
+        '''Add an item to the cache.
+
+        Parameters
+        ----------
+        key : hashable
+        item : dict of np.ndarray
+
+        Raises
+        ------
+        DataError
+            If `item` is not a dictionary of numpy arrays.
+        '''
+        writer = io._ShardWriter(self.path(self._name(key)))
+        complete = False
+        try:
+            writer.write(item)
+            complete = True
+        finally:
+            if complete:
+                writer.close()
+            else:
+                writer.abort()
+
+        self.nbytes_since_evict_ += writer.offset
+        if self.nbytes_since_evict_ > self.max_bytes // 16:
+            self.evict()
+            self.nbytes_since_evict_ = 0
+
+    def _length_path(self, stream_key):
+        return os.path.join(self.directory,
+                            self._name(stream_key) + '.length')
+
+    def get_length(self, stream_key):
+        '''Get the recorded number of items in a complete pass of a stream.
+
+        Returns
+        -------
+        n_items : int or None
+            None if no complete pass has been recorded.
+        '''
+        try:
+            with open(self._length_path(stream_key), 'r') as fdesc:
+                return int(fdesc.read())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set_length(self, stream_key, n_items):
+        '''Record the number of items in a complete pass of a stream.'''
+        path = self._length_path(stream_key)
+        tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        with open(tmp_path, 'w') as fdesc:
+            fdesc.write(str(n_items))
+
+        if hasattr(os, 'replace'):
+            os.replace(tmp_path, path)
+        else:
+            os.rename(tmp_path, path)
+
+
+class DiskCachedStreamer(core.Streamer):
+    '''A streamer whose items are persisted to disk, and served from there
+    on later activations, including in later runs.
+
+    Entries are keyed by `streamer_hash`, so two streamers with the same
+    generator function, arguments, defaults and closure variables share
+    an entry.
+    Only complete passes are stored, and items must be dictionaries of
+    numpy arrays (see `pescador.io.write_shards`).
+    Cached items are yielded as read-only views of memory-mapped files.
+
+    Examples
+    --------
+    >>> cache = pescador.DiskCache('/tmp/features', max_bytes=2**34,
+    ...                            max_age=7 * 86400)
+    >>> streams = [pescador.DiskCachedStreamer(
+    ...                pescador.Streamer(extract_features, f), cache)
+    ...            for f in audio_files]
+    >>> mux = pescador.StochasticMux(streams, n_active=16, rate=None,
+    ...                              mode='single_active')
+    '''
+    def __init__(self, streamer, cache):
+        '''
+        Parameters
+        ----------
+        streamer : pescador.Streamer, iterable, or generator function
+            The streamer to cache.
+            If not a `Streamer`, it is wrapped in one.
+
+        cache : DiskCache or str
+            The cache, or a path to its directory.
+        '''
+        if not isinstance(streamer, core.Streamer):
+            streamer = core.Streamer(streamer)
+
+        if not isinstance(cache, DiskCache):
+            cache = DiskCache(cache)
+
+        self.source = streamer
+        self.cache = cache
+        self.cache_key = streamer_hash(streamer)
+
+        super(DiskCachedStreamer, self).__init__(self._generate)
+
+    @property
+    def cached(self):
+        '''True if a complete pass is stored on disk.'''
+        return os.path.exists(self.cache.path(self.cache_key))
+
+    def _generate(self):
+        path = self.cache.path(self.cache_key)
+
+        try:
+            # Mark the entry as recently used
+            os.utime(path, None)
+            reader = io.ShardStreamer(path).iterate()
+            # Map the file now, in case it is evicted before the first item
+            first = six.advance_iterator(reader)
+        except StopIteration:
+            # A cached, empty stream
+            return
+        except (IOError, OSError):
+            reader = None
+
+        if reader is not None:
+            yield first
+            for item in reader:
+                yield item
+            return
+
+        writer = io._ShardWriter(path)
+        complete = False
+        try:
+            for item in self.source.iterate():
+                writer.write(item)
+                yield item
+            complete = True
+
+        finally:
+            if complete:
+                writer.close()
+                self.cache.evict()
+            else:
+                writer.abort()
@@ -3,9 +3,98 @@
 import collections
 import copy
 import inspect
+import time
 import six
 
 from .exceptions import PescadorError
+from . import tracing
+
+# The most precise clock available
+_timer = getattr(time, 'perf_counter', time.time)
+
+
+class _StreamerStats(object):
+    '''Counters for an instrumented streamer.
+
+    The same object is shared by a streamer and all of its activated copies.
+    '''
+    def __init__(self):
+        self.activations = 0
+        self.activation_time = 0.0
+        self.items = 0
+        self.producer_time = 0.0
+        self.consumer_time = 0.0
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def wrap(self, stream):
+        '''Time the production and consumption of each item of a stream.'''
+        try:
+            while True:
+                start = _timer()
+                activation_time = self.activation_time
+                try:
+                    obj = six.advance_iterator(stream)
+                except StopIteration:
+                    return
+                produced = _timer()
+
+                # Activation is counted separately
+                self.producer_time += (produced - start -
+                                       (self.activation_time -
+                                        activation_time))
+                self.items += 1
+                yield obj
+                self.consumer_time += _timer() - produced
+
+        finally:
+            stream.close()
+
+    def as_dict(self):
+        active_time = self.producer_time + self.consumer_time
+        return dict(
+            activations=self.activations,
+            activation_time=self.activation_time,
+            mean_activation_time=(self.activation_time / self.activations
+                                  if self.activations else 0.0),
+            items=self.items,
+            producer_time=self.producer_time,
+            consumer_time=self.consumer_time,
+            items_per_second=(self.items / active_time
+                              if active_time else 0.0),
+            producer_items_per_second=(self.items / self.producer_time
+                                       if self.producer_time else 0.0))
+
+
+class _Hooks(object):
+    '''A registry of callbacks for a streamer.
+
+    The same object is shared by a streamer and all of its activated copies.
+    '''
+    events = ('activate', 'exhausted', 'replace', 'item')
+
+    def __init__(self):
+        self.callbacks = {event: [] for event in self.events}
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def fire(self, event, *args):
+        for callback, _ in self.callbacks[event]:
+            callback(*args)
+
+    def wrap(self, stream, streamer):
+        '''Call the item hooks while iterating a stream.'''
+        hooks = list(self.callbacks['item'])
+        try:
+            for n, obj in enumerate(stream, 1):
+                for callback, every in hooks:
+                    if n % every == 0:
+                        callback(streamer, n, obj)
+                yield obj
+        finally:
+            stream.close()
 
 
 class Streamer(object):
@@ -66,8 +155,22 @@ class Streamer(object):
     >>> for i in stream(cycle=True):
     ...     print(i)  # Displays 0, 1, 2, 3, 4, 0, 1, 2, ...
 
+
+    Measure where time is spent
+
+    >>> stream.instrument()
+    >>> for i in stream.cycle(max_iter=100):
+    ...     process(i)
+    >>> stream.stats()['producer_time']
+
     '''
 
+    # Statistics are collected only if `instrument` is called
+    stats_ = None
+
+    # Callbacks registered by `add_hook`
+    hooks_ = None
+
     def __init__(self, streamer, *args, **kwargs):
         '''Initializer
 
@@ -127,12 +230,30 @@ class Streamer(object):
         # If this is the base / original streamer,
         #  create a copy and return it
         if not self.is_activated_copy:
+            tracer = tracing._TRACER
+            if tracer is not None:
+                trace_start = tracing._now()
+
+            if self.stats_ is not None:
+                start = _timer()
+
             streamer_copy = copy.deepcopy(self)
             streamer_copy._activate()
 
             # Increment the count of active streams.
             self.active_count_ += 1
 
+            if self.stats_ is not None:
+                self.stats_.activations += 1
+                self.stats_.activation_time += _timer() - start
+
+            if self.hooks_ is not None:
+                self.hooks_.fire('activate', streamer_copy)
+
+            if tracer is not None:
+                tracer.record(tracing._describe(self), 'activate',
+                              trace_start, tracing._now())
+
         # However, if this is an "activated" streamer, then it is a copy,
         #  so just return self.
         else:
@@ -166,6 +287,151 @@ class Streamer(object):
         """
         return self.stream_ is not None
 
+    def instrument(self, enabled=True):
+        '''Enable or disable the collection of statistics.
+
+        Instrumentation times each activation of the streamer, each call
+        for the next item (the producer), and the time until the item after
+        that is requested (the consumer).  When disabled, iteration has no
+        added overhead.
+
+        Enabling instrumentation resets any existing statistics.
+
+        Parameters
+        ----------
+        enabled : bool
+            If True, collect statistics from now on.
+            If False, stop collecting statistics and discard them.
+
+        Returns
+        -------
+        self : Streamer
+            This streamer, for chaining.
+
+        See Also
+        --------
+        stats
+        '''
+        self.stats_ = _StreamerStats() if enabled else None
+        return self
+
+    def stats(self):
+        '''Get the statistics collected since `instrument` was called.
+
+        For a mux, producer time includes the time spent in its streamers,
+        which may be instrumented separately.
+
+        Returns
+        -------
+        stats : dict or None
+            None, if the streamer is not instrumented.  Otherwise:
+
+            - `activations`: the number of activations
+            - `activation_time`: total seconds spent activating
+            - `mean_activation_time`: seconds per activation
+            - `items`: the number of items produced
+            - `producer_time`: total seconds spent producing items,
+              excluding activation
+            - `consumer_time`: total seconds between producing an item and
+              the next request for an item
+            - `items_per_second`: items per second while iterating
+            - `producer_items_per_second`: items per second of producer time
+        '''
+        if self.stats_ is None:
+            return None
+        return self.stats_.as_dict()
+
+    def add_hook(self, event, callback, every=1):
+        '''Register a callback for an event.
+
+        Callbacks are shared with all activated copies of the streamer.
+        Events without callbacks add no overhead; in particular, iteration
+        is unaffected unless an `item` callback is registered.
+
+        Parameters
+        ----------
+        event : {'activate', 'exhausted', 'replace', 'item'}
+            - `activate`: the streamer is activated.
+              Called as ``callback(active_streamer)``, with the activated
+              copy of the streamer.
+            - `exhausted`: a stream of a mux is exhausted, before it is
+              replaced.  Called as ``callback(active_mux, idx)``, with the
+              index of the stream in ``active_mux.streams_``.
+            - `replace`: a stream of a mux has been replaced (or, if none
+              are left, disabled).  Called as ``callback(active_mux, idx)``.
+            - `item`: every `every` items.
+              Called as ``callback(streamer, n, item)``, where `n` counts
+              items from 1 in each iteration.
+
+        callback : callable
+            The function to call.
+            If the streamer is used by `ZMQStreamer`, callbacks must be
+            picklable, and run in the worker process.
+
+        every : int > 0
+            For `item` events, the number of items between calls.
+
+        Returns
+        -------
+        self : Streamer
+            This streamer, for chaining.
+
+        Raises
+        ------
+        PescadorError
+            If `event` or `every` are invalid.
+
+        See Also
+        --------
+        remove_hook
+
+        Examples
+        --------
+        >>> def report(streamer, n, item):
+        ...     print('{} items'.format(n))
+        >>> stream = pescador.Streamer(my_generator)
+        >>> stream.add_hook('item', report, every=1000)
+        '''
+        if event not in _Hooks.events:
+            raise PescadorError('Invalid event={}. Must be one of '
+                                '{}'.format(event, _Hooks.events))
+
+        if not isinstance(every, six.integer_types) or every < 1:
+            raise PescadorError('every={} must be a positive '
+                                'integer'.format(every))
+
+        if self.hooks_ is None:
+            self.hooks_ = _Hooks()
+        self.hooks_.callbacks[event].append((callback, every))
+        return self
+
+    def remove_hook(self, event, callback):
+        '''Remove all registrations of a callback for an event.
+
+        Parameters
+        ----------
+        event : str
+            See `add_hook`.
+
+        callback : callable
+            The function to remove.
+
+        Returns
+        -------
+        self : Streamer
+            This streamer, for chaining.
+        '''
+        if self.hooks_ is None or event not in self.hooks_.callbacks:
+            return self
+
+        self.hooks_.callbacks[event] = [
+            (cb, every) for cb, every in self.hooks_.callbacks[event]
+            if cb != callback]
+
+        if not any(six.itervalues(self.hooks_.callbacks)):
+            self.hooks_ = None
+        return self
+
     def _activate(self):
         """Activates the stream."""
         if six.callable(self.streamer):
@@ -194,12 +460,35 @@ class Streamer(object):
         cycle : force an infinite stream.
 
         '''
+        stream = self._iterate(max_iter=max_iter)
+
+        if self.stats_ is not None:
+            stream = self.stats_.wrap(stream)
+
+        if self.hooks_ is not None and self.hooks_.callbacks['item']:
+            stream = self.hooks_.wrap(stream, self)
+
+        tracer = tracing._TRACER
+        if tracer is not None:
+            stream = tracer.wrap(stream, tracing._describe(self))
+
+        return stream
+
+    def _iterate(self, max_iter=None):
         # Use self as context manager / calls __enter__() => _activate()
         with self as active_streamer:
-            for n, obj in enumerate(active_streamer.stream_):
-                if max_iter is not None and n >= max_iter:
-                    break
-                yield obj
+            try:
+                for n, obj in enumerate(active_streamer.stream_):
+                    if max_iter is not None and n >= max_iter:
+                        break
+                    yield obj
+
+            finally:
+                # Close generators created by _activate(), so that any
+                # resources they hold are released as soon as we stop.
+                if (six.callable(active_streamer.streamer) and
+                        hasattr(active_streamer.stream_, 'close')):
+                    active_streamer.stream_.close()
 
     def cycle(self, max_iter=None):
         '''Iterate from the streamer infinitely.
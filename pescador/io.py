@@ -0,0 +1,668 @@
+#!/usr/bin/env python
+# -*- encoding: utf-8 -*-
+'''
+Data sources
+------------
+
+Streamers which read data directly from files on disk, and a simple
+sharded storage format for materializing any stream of data.
+
+.. autosummary::
+    :toctree: generated/
+
+    NPYStreamer
+    chunked_mux
+    ShardStreamer
+    write_shards
+    shard_streamers
+'''
+import glob
+import os
+import struct
+import uuid
+import numpy as np
+import six
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+from . import core
+from . import util
+from .exceptions import DataError, PescadorError
+from .mux import StochasticMux
+
+__all__ = ['NPYStreamer', 'chunked_mux',
+           'ShardStreamer', 'write_shards', 'shard_streamers']
+
+
+# Byte alignment of every array within a shard
+SHARD_ALIGNMENT = 64
+
+# Shard files end with the schema length and number of items, followed by
+# this magic string
+SHARD_MAGIC = b'PESCSHD2'
+SHARD_EXTENSION = '.shard'
+
+_SHARD_FOOTER = struct.Struct('<QQ8s')
+
+
+class NPYStreamer(core.Streamer):
+    '''Stream rows from memory-mapped ``.npy`` files.
+
+    Files are opened with ``mmap_mode='r'`` when the streamer is activated,
+    so only the rows actually read are paged into memory.
+
+    Examples
+    --------
+    Iterate over the rows of a single file
+
+    >>> stream = pescador.NPYStreamer('features.npy', key='X')
+    >>> for data in stream:
+    ...     print(data['X'].shape)  # One row of features.npy
+
+    Sample aligned rows from two files, and mux several sources
+
+    >>> streams = [pescador.NPYStreamer({'X': x_path, 'Y': y_path},
+    ...                                 mode='random')
+    ...            for x_path, y_path in zip(x_files, y_files)]
+    >>> mux = pescador.StochasticMux(streams, n_active=4, rate=64)
+    '''
+    def __init__(self, path, key='X', mode='sequential', block_size=1024,
+                 chunk_size=256, start=None, stop=None, random_state=None):
+        '''
+        Parameters
+        ----------
+        path : str or dict of str
+            Path to a ``.npy`` file, or a dictionary mapping keys to paths.
+            If a dictionary, all files must have the same number of rows,
+            and items are yielded as ``{key: row}`` for every key.
+            Rows are always arrays: rows of 1-d files, such as labels,
+            are 0-d arrays.
+
+        key : str
+            The key to use for `path`, if it is a single path.
+
+        mode : ["sequential", "shuffle", "random", "chunk"]
+            sequential
+                Yield each row once, in order.
+
+            shuffle
+                Yield each row once, in random order.
+                All rows are read at once, in a single contiguous read,
+                so this is intended for bounded row ranges
+                (see `start` and `stop`).
+
+            random
+                Yield rows sampled uniformly with replacement, indefinitely.
+                Row indices are drawn `block_size` at a time, and each
+                block is read from disk in order of file offset.
+
+            chunk
+                Yield rows from contiguous runs of `chunk_size` rows
+                starting at random offsets, indefinitely.
+                Rows within each chunk are shuffled.
+
+        block_size : int > 0
+            Number of row indices to draw and read at once in `random` mode.
+
+        chunk_size : int > 0
+            Number of contiguous rows to read at once in `chunk` mode.
+
+        start : int or None
+        stop : int or None
+            Restrict the stream to rows ``start:stop``, as in a slice.
+
+        random_state : None, int, np.random.RandomState, or
+            np.random.Generator
+            See `pescador.util.get_rng`.
+            The generator is shared by all activations (and copies) of the
+            streamer, so each pass draws different rows.
+
+        Raises
+        ------
+        PescadorError
+            If `mode`, `block_size`, or `chunk_size` are invalid.
+        '''
+        if isinstance(path, six.string_types):
+            path = {key: path}
+
+        if mode not in ['sequential', 'shuffle', 'random', 'chunk']:
+            raise PescadorError('Invalid NPYStreamer mode={}'.format(mode))
+
+        if block_size < 1:
+            raise PescadorError('block_size={} must be a positive '
+                                'integer'.format(block_size))
+
+        if chunk_size < 1:
+            raise PescadorError('chunk_size={} must be a positive '
+                                'integer'.format(chunk_size))
+
+        self.paths = dict(path)
+        self.mode = mode
+        self.block_size = block_size
+        self.chunk_size = chunk_size
+        self.start = start
+        self.stop = stop
+        self.random_state = random_state
+        self.rng_ = util._SharedRNG(random_state)
+
+        super(NPYStreamer, self).__init__(self._generate)
+
+    def reseed(self, random_state):
+        '''Replace the random number generator with one spawned from
+        `random_state`, e.g., in a worker process.
+
+        Parameters
+        ----------
+        random_state : None, int, np.random.SeedSequence, or
+            np.random.Generator
+            The parent seed; see `pescador.util.spawn_seeds`.
+        '''
+        self.rng_ = util._SharedRNG(util.spawn_seeds(random_state, 1)[0])
+
+    def _generate(self):
+        '''Open the files and yield rows according to `mode`.'''
+        # asarray gives plain ndarray views of the mapped files, so
+        # pages are still only read on access.
+        data = {key: np.asarray(np.load(path, mmap_mode='r'))[
+                    self.start:self.stop]
+                for key, path in six.iteritems(self.paths)}
+
+        # Validates that all files have the same number of rows
+        n_rows = util.batch_length(data)
+
+        if not n_rows:
+            return
+
+        rng = self.rng_.rng
+
+        # Ellipsis indexing makes rows of 1-d files 0-d arrays, rather
+        # than numpy scalars, which cannot be serialized or cached.
+        if self.mode == 'sequential':
+            for i in range(n_rows):
+                yield {key: data[key][i, ...] for key in data}
+
+        elif self.mode == 'shuffle':
+            block = {key: np.array(data[key]) for key in data}
+
+            for i in rng.permutation(n_rows):
+                yield {key: block[key][i, ...] for key in block}
+
+        elif self.mode == 'random':
+            while True:
+                idx = util._randint(rng, n_rows, size=self.block_size)
+
+                # Gather rows in file order, then restore the sampled order
+                order = np.argsort(idx, kind='mergesort')
+                block = {key: data[key][idx[order]] for key in data}
+
+                inverse = np.empty_like(order)
+                inverse[order] = np.arange(len(order))
+
+                for i in inverse:
+                    yield {key: block[key][i, ...] for key in block}
+
+        elif self.mode == 'chunk':
+            size = min(self.chunk_size, n_rows)
+            while True:
+                start = util._randint(rng, n_rows - size + 1)
+                block = {key: np.array(data[key][start:start + size])
+                         for key in data}
+
+                for i in rng.permutation(size):
+                    yield {key: block[key][i, ...] for key in block}
+
+
+def chunked_mux(path, chunk_size, n_active, key='X', mode='single_active',
+                random_state=None):
+    '''Sample rows from ``.npy`` files in shuffled, contiguous chunks.
+
+    The rows are partitioned into chunks of `chunk_size` contiguous rows,
+    and each chunk becomes an `NPYStreamer` (in `shuffle` mode), which reads
+    the whole chunk at once and yields its rows in random order.
+    Each visit to a chunk shuffles its rows anew.
+    A `StochasticMux` interleaves `n_active` of these chunks at a time.
+
+    This turns random access into a sequence of contiguous reads, which is
+    much faster on spinning disks and network file systems.
+    In exchange, items within a window of about
+    ``chunk_size * n_active`` rows are correlated: larger `n_active`
+    gives better mixing, at the cost of more memory.
+
+    Examples
+    --------
+    >>> mux = pescador.io.chunked_mux({'X': 'X.npy', 'Y': 'Y.npy'},
+    ...                               chunk_size=1024, n_active=16)
+    >>> batches = pescador.buffer_stream(mux, 32)
+
+    Parameters
+    ----------
+    path : str or dict of str
+        Path to a ``.npy`` file, or a dictionary mapping keys to paths.
+        See `NPYStreamer`.
+
+    chunk_size : int > 0
+        The number of contiguous rows in each chunk.
+
+    n_active : int > 0
+        The number of chunks to interleave at any time.
+
+    key : str
+        The key to use for `path`, if it is a single path.
+
+    mode : ["single_active", "exhaustive", "with_replacement"]
+        The `StochasticMux` mode.
+        `single_active` samples indefinitely, and `exhaustive` yields
+        every row exactly once.
+
+    random_state : None, int, np.random.SeedSequence, or
+        np.random.Generator
+        If provided, the mux and each chunk are given independent seeds
+        (see `pescador.util.spawn_seeds`).
+
+    Returns
+    -------
+    mux : pescador.StochasticMux
+
+    Raises
+    ------
+    PescadorError
+        If `chunk_size` is not a positive integer, or the files are empty.
+    '''
+    if isinstance(path, six.string_types):
+        path = {key: path}
+
+    if chunk_size < 1:
+        raise PescadorError('chunk_size={} must be a positive '
+                            'integer'.format(chunk_size))
+
+    # Only the headers are read here
+    n_rows = util.batch_length({k: np.load(p, mmap_mode='r')
+                                for k, p in six.iteritems(path)})
+    if not n_rows:
+        raise PescadorError('Cannot sample chunks from empty files')
+
+    starts = range(0, n_rows, chunk_size)
+
+    seeds = [None] * (1 + len(starts))
+    if random_state is not None:
+        seeds = util.spawn_seeds(random_state, len(seeds))
+
+    streamers = [NPYStreamer(path, mode='shuffle', start=start,
+                             stop=start + chunk_size, random_state=seed)
+                 for start, seed in zip(starts, seeds[1:])]
+
+    return StochasticMux(streamers, n_active, rate=None, mode=mode,
+                         random_state=seeds[0])
+
+
+def write_shards(stream, directory, items_per_shard, prefix='shard'):
+    '''Write a stream of data to a directory of shard files.
+
+    Each shard holds up to `items_per_shard` items.
+    Arrays are stored back to back, each starting at a multiple of
+    `SHARD_ALIGNMENT` bytes.  They are followed by an index: a table of the
+    byte offset and shape of every array, and the key, dtype and number of
+    dimensions of each field, which must be the same for every item.
+    Shards can be read back with `ShardStreamer` or `shard_streamers`.
+
+    Examples
+    --------
+    >>> paths = pescador.io.write_shards(expensive_streamer, '/data/shards',
+    ...                                  items_per_shard=4096)
+    >>> streams = pescador.io.shard_streamers('/data/shards', mode='shuffle')
+    >>> mux = pescador.StochasticMux(streams, n_active=8, rate=256)
+
+    Parameters
+    ----------
+    stream : iterable
+        A finite stream of data, e.g. {key: np.ndarray}
+
+    directory : str
+        Path to the output directory. It is created if it does not exist.
+
+    items_per_shard : int > 0
+        The maximum number of items to store in each shard.
+
+    prefix : str
+        Shard files are named ``{prefix}-{index:05d}.shard``
+
+    Returns
+    -------
+    paths : list of str
+        The paths of the shards that were written, in order.
+
+    Raises
+    ------
+    DataError
+        If the stream contains items that are not dictionaries of
+        non-object numpy arrays, or items within a shard differ in their
+        keys, dtypes or numbers of dimensions.
+
+    PescadorError
+        If `items_per_shard` is not a positive integer.
+    '''
+    if items_per_shard < 1:
+        raise PescadorError('items_per_shard={} must be a positive '
+                            'integer'.format(items_per_shard))
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    paths = []
+    writer = None
+
+    try:
+        for data in stream:
+            if writer is None:
+                path = os.path.join(directory, '{}-{:05d}{}'.format(
+                    prefix, len(paths), SHARD_EXTENSION))
+                writer = _ShardWriter(path)
+
+            writer.write(data)
+
+            if writer.n_items >= items_per_shard:
+                paths.append(writer.close())
+                writer = None
+
+        if writer is not None:
+            paths.append(writer.close())
+            writer = None
+
+    finally:
+        if writer is not None:
+            writer.abort()
+
+    return paths
+
+
+class _ShardWriter(object):
+    '''Write items to a single shard.
+
+    The shard is written to a uniquely named temporary file, which is
+    renamed to `path` on close, so that readers never observe partial
+    shards, and concurrent writers of the same shard do not interfere.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = '{}.{}.tmp'.format(path, uuid.uuid4().hex)
+        self.fdesc = open(self.tmp_path, 'wb')
+        self.offset = 0
+        self.schema = None
+        self.rows = []
+
+    @property
+    def n_items(self):
+        return len(self.rows)
+
+    def _pad(self):
+        padding = -self.offset % SHARD_ALIGNMENT
+        if padding:
+            self.fdesc.write(b'\0' * padding)
+            self.offset += padding
+
+    def write(self, data):
+        try:
+            keys = sorted(data.keys())
+        except AttributeError:
+            raise DataError('Malformed data stream: {}'.format(data))
+
+        arrays = [data[key] for key in keys]
+        for arr in arrays:
+            if not isinstance(arr, np.ndarray) or arr.dtype.hasobject:
+                raise DataError('Only non-object ndarray types can be '
+                                'written to shards')
+
+        schema = dict(keys=keys, dtypes=[arr.dtype.str for arr in arrays],
+                      ndims=[arr.ndim for arr in arrays])
+        if self.schema is None:
+            self.schema = schema
+        elif schema != self.schema:
+            raise DataError('All items in a shard must have the same keys, '
+                            'dtypes and numbers of dimensions: '
+                            '{} != {}'.format(schema, self.schema))
+
+        offsets, shapes = [], []
+        for arr in arrays:
+            self._pad()
+            offsets.append(self.offset)
+            shapes.extend(arr.shape)
+
+            buf = np.ascontiguousarray(arr).tobytes()
+            self.fdesc.write(buf)
+            self.offset += len(buf)
+
+        self.rows.append(offsets + shapes)
+
+    def close(self):
+        schema = self.schema or dict(keys=[], dtypes=[], ndims=[])
+        n_columns = len(schema['keys']) + sum(schema['ndims'])
+
+        self._pad()
+        table = np.asarray(self.rows, dtype='<i8').reshape((len(self.rows),
+                                                            n_columns))
+        self.fdesc.write(table.tobytes())
+
+        schema = json.dumps(schema).encode('ascii')
+        self.fdesc.write(schema)
+        self.fdesc.write(_SHARD_FOOTER.pack(len(schema), len(self.rows),
+                                            SHARD_MAGIC))
+        self.fdesc.close()
+
+        if hasattr(os, 'replace'):
+            # Atomic, even if the shard already exists
+            os.replace(self.tmp_path, self.path)
+        else:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(self.tmp_path, self.path)
+        return self.path
+
+    def abort(self):
+        self.fdesc.close()
+        os.remove(self.tmp_path)
+
+
+class _ShardIndex(object):
+    '''The byte offsets and shapes of the arrays in a shard.
+
+    Parameters
+    ----------
+    schema : dict
+        The `keys`, `dtypes` and `ndims` of the fields of every item
+
+    table : np.ndarray, shape=(n_items, n_fields + sum(ndims))
+        For each item, the byte offset of each field, followed by the
+        shapes of all fields.
+    '''
+    def __init__(self, schema, table):
+        self.table = table
+        self.fields = []
+
+        column = len(schema['keys'])
+        for i, (key, dtype, ndim) in enumerate(zip(schema['keys'],
+                                                   schema['dtypes'],
+                                                   schema['ndims'])):
+            self.fields.append((key, np.dtype(dtype), i, column,
+                                column + ndim))
+            column += ndim
+
+    def __len__(self):
+        return len(self.table)
+
+    def view(self, buf, i):
+        '''Construct item `i` from views into the shard buffer.'''
+        row = self.table[i].tolist()
+
+        data = dict()
+        for key, dtype, offset, first, last in self.fields:
+            shape = row[first:last]
+            start = row[offset]
+            end = start + dtype.itemsize * int(np.prod(shape))
+            data[key] = buf[start:end].view(dtype).reshape(shape)
+        return data
+
+
+def _read_shard_index(buf):
+    '''Read the index at the end of a shard.
+
+    The offset table is a view into `buf`, so this does not depend on the
+    number of items in the shard.
+
+    Parameters
+    ----------
+    buf : np.ndarray, dtype=uint8
+        The contents of the shard
+
+    Returns
+    -------
+    index : _ShardIndex
+
+    Raises
+    ------
+    DataError
+        If `buf` is not a valid shard.
+    '''
+    if len(buf) < _SHARD_FOOTER.size:
+        raise DataError('Invalid shard: too short')
+
+    length, n_items, magic = _SHARD_FOOTER.unpack(
+        buf[-_SHARD_FOOTER.size:].tobytes())
+    if magic != SHARD_MAGIC or length > len(buf) - _SHARD_FOOTER.size:
+        raise DataError('Invalid shard: bad footer')
+
+    end = len(buf) - _SHARD_FOOTER.size - length
+    schema = json.loads(buf[end:end + length].tobytes().decode('ascii'))
+
+    n_columns = len(schema['keys']) + sum(schema['ndims'])
+    start = end - 8 * n_items * n_columns
+    if start < 0:
+        raise DataError('Invalid shard: bad index')
+
+    table = buf[start:end].view('<i8').reshape((n_items, n_columns))
+    return _ShardIndex(schema, table)
+
+
+class ShardStreamer(core.Streamer):
+    '''Stream items from a shard written by `write_shards`.
+
+    The shard is memory-mapped when the streamer is activated, and arrays
+    are yielded as read-only views into the mapping, without copying.
+
+    Examples
+    --------
+    >>> stream = pescador.io.ShardStreamer('/data/shards/shard-00000.shard')
+    >>> for data in stream:
+    ...     print(data)
+    '''
+    def __init__(self, path, mode='sequential', random_state=None):
+        '''
+        Parameters
+        ----------
+        path : str
+            Path to the shard
+
+        mode : ["sequential", "shuffle", "random"]
+            sequential
+                Yield each item once, in the order written.
+
+            shuffle
+                Yield each item once, in random order.
+
+            random
+                Yield items sampled uniformly with replacement, indefinitely.
+
+        random_state : None, int, np.random.RandomState, or
+            np.random.Generator
+            See `pescador.util.get_rng`.
+            The generator is shared by all activations (and copies) of the
+            streamer, so each pass draws a different order.
+
+        Raises
+        ------
+        PescadorError
+            If `mode` is invalid.
+        '''
+        if mode not in ['sequential', 'shuffle', 'random']:
+            raise PescadorError('Invalid ShardStreamer mode={}'.format(mode))
+
+        self.path = path
+        self.mode = mode
+        self.random_state = random_state
+        self.rng_ = util._SharedRNG(random_state)
+
+        super(ShardStreamer, self).__init__(self._generate)
+
+    def reseed(self, random_state):
+        '''Replace the random number generator with one spawned from
+        `random_state`, e.g., in a worker process.
+
+        Parameters
+        ----------
+        random_state : None, int, np.random.SeedSequence, or
+            np.random.Generator
+            The parent seed; see `pescador.util.spawn_seeds`.
+        '''
+        self.rng_ = util._SharedRNG(util.spawn_seeds(random_state, 1)[0])
+
+    def _generate(self):
+        '''Map the shard and yield items according to `mode`.'''
+        buf = np.asarray(np.memmap(self.path, dtype=np.uint8, mode='r'))
+        index = _read_shard_index(buf)
+
+        if not len(index):
+            return
+
+        rng = self.rng_.rng
+
+        if self.mode == 'sequential':
+            for i in range(len(index)):
+                yield index.view(buf, i)
+
+        elif self.mode == 'shuffle':
+            for i in rng.permutation(len(index)):
+                yield index.view(buf, i)
+
+        elif self.mode == 'random':
+            while True:
+                for i in util._randint(rng, len(index), size=len(index)):
+                    yield index.view(buf, i)
+
+
+def shard_streamers(directory, pattern='*' + SHARD_EXTENSION,
+                    random_state=None, **kwargs):
+    '''Construct a `ShardStreamer` for each shard in a directory.
+
+    The result can be passed directly to any mux, e.g. `StochasticMux`.
+
+    Parameters
+    ----------
+    directory : str
+        Path to a directory written by `write_shards`
+
+    pattern : str
+        Glob pattern for shard files within `directory`
+
+    random_state : None, int, np.random.SeedSequence, or
+        np.random.Generator
+        If provided, each shard is given an independent seed
+        (see `pescador.util.spawn_seeds`).
+
+    kwargs
+        Additional keyword arguments for `ShardStreamer`
+
+    Returns
+    -------
+    streamers : list of ShardStreamer
+        One streamer per shard, sorted by file name.
+    '''
+    paths = sorted(glob.glob(os.path.join(directory, pattern)))
+
+    seeds = [None] * len(paths)
+    if random_state is not None:
+        seeds = util.spawn_seeds(random_state, len(paths))
+
+    return [ShardStreamer(path, random_state=seed, **kwargs)
+            for path, seed in zip(paths, seeds)]
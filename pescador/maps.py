@@ -11,14 +11,35 @@ the function in a Streamer again.
     buffer_stream
     tuples
     keras_tuples
+    parallel_map
+    map_batches
+    rebatch
+    unbatch
+    bucket_stream
+    budget_stream
+    pack_sequences
+    windows
+    random_windows
+    shuffle_buffer
 '''
+import functools
+import multiprocessing
+import multiprocessing.pool
+
 import numpy as np
 import six
+from six.moves import queue
 
 from .exceptions import DataError, PescadorError
+from . import memory
+from . import tracing
 from . import util
+from .mux import RNG_BLOCK_SIZE
 
-__all__ = ['buffer_stream', 'tuples', 'keras_tuples']
+__all__ = ['buffer_stream', 'tuples', 'keras_tuples', 'parallel_map',
+           'map_batches', 'rebatch', 'unbatch', 'bucket_stream',
+           'budget_stream', 'pack_sequences', 'windows', 'random_windows',
+           'shuffle_buffer']
 
 
 def __stack_data(data):
@@ -28,7 +49,21 @@ def __stack_data(data):
     return output
 
 
-def buffer_stream(stream, buffer_size, partial=False):
+def __split_data(batch):
+    '''Split a batch into items, as views of each row.'''
+    if not isinstance(batch, dict):
+        raise DataError("Malformed batch: {}".format(batch))
+
+    n = util.batch_length(batch)
+    if n is None:
+        return
+
+    for i in range(n):
+        # Ellipsis indexing makes 0-d views rather than scalar copies
+        yield {key: value[i, ...] for key, value in six.iteritems(batch)}
+
+
+def buffer_stream(stream, buffer_size, partial=False, max_bytes=None):
     '''Buffer "data" from an stream into one data object.
 
     Parameters
@@ -42,6 +77,13 @@ def buffer_stream(stream, buffer_size, partial=False):
     partial : bool, default=False
         If True, yield a final partial batch on under-run.
 
+    max_bytes : int > 0 or None
+        If provided, a batch is yielded early, with fewer than `buffer_size`
+        examples, as soon as the buffered examples hold at least this many
+        bytes (see `pescador.util.item_nbytes`).
+
+        The buffered bytes are reported by `pescador.memory_usage`.
+
     Yields
     ------
     batch
@@ -51,27 +93,58 @@ def buffer_stream(stream, buffer_size, partial=False):
     ------
     DataError
         If the stream contains items that are not data-like.
+
+    PescadorError
+        If `max_bytes` is not positive.
     '''
+    if max_bytes is not None and max_bytes <= 0:
+        raise PescadorError('max_bytes={} must be a positive '
+                            'number'.format(max_bytes))
 
     data = []
     n = 0
+    nbytes = 0
 
-    for x in stream:
-        data.append(x)
-        n += 1
+    def __usage():
+        held = list(data)
+        return dict(bytes=sum(util.item_nbytes(x) for x in held),
+                    items=len(held))
 
-        if n < buffer_size:
-            continue
-        try:
+    gauge = memory._register('buffer_stream', __usage, max_bytes=max_bytes)
+
+    try:
+        for x in stream:
+            data.append(x)
+            n += 1
+
+            if max_bytes is not None:
+                nbytes += util.item_nbytes(x)
+
+            if n < buffer_size and (max_bytes is None or nbytes < max_bytes):
+                continue
+            try:
+                tracer = tracing._TRACER
+                if tracer is None:
+                    batch = __stack_data(data)
+                else:
+                    start = tracing._now()
+                    batch = __stack_data(data)
+                    tracer.record('stack', 'batch', start, tracing._now())
+            except (TypeError, AttributeError):
+                raise DataError("Malformed data stream: {}".format(data))
+            finally:
+                # Release the items before the consumer takes the batch
+                del data[:]
+                n = 0
+                nbytes = 0
+
+            yield batch
+
+        if data and partial:
             yield __stack_data(data)
-        except (TypeError, AttributeError):
-            raise DataError("Malformed data stream: {}".format(data))
-        finally:
-            data = []
-            n = 0
 
-    if data and partial:
-        yield __stack_data(data)
+    finally:
+        memory._unregister(gauge)
 
 
 def tuples(stream, *keys):
@@ -167,3 +240,1154 @@ def keras_tuples(stream, inputs=None, outputs=None):
             yield (x, y)
         except TypeError:
             raise DataError("Malformed data stream: {}".format(data))
+
+
+def _apply_map(fn, index, item, seed):
+    '''Apply `fn` to one item in a worker.
+
+    Exceptions are returned rather than raised, so that they can be
+    re-raised in order by the consumer.
+    '''
+    try:
+        if seed is None:
+            return index, None, fn(item)
+        return index, None, fn(item, np.random.default_rng(seed))
+    except Exception as exc:
+        return index, exc, None
+
+
+def _map_failed(done, index, exc):
+    done.put((index, exc, None))
+
+
+def parallel_map(stream, fn, n_workers, backend='thread', ordered=True,
+                 max_in_flight=None, random_state=None):
+    '''Apply a function to each item of a stream in parallel.
+
+    Items are submitted to a pool of `n_workers` workers as they are
+    needed, so that at most `max_in_flight` items are being processed (or
+    are waiting to be yielded) at once.  The pool is created when
+    iteration starts, and shut down when it stops.
+
+    Parameters
+    ----------
+    stream : iterable
+        Stream of items.
+
+    fn : callable
+        The function to apply to each item.
+        If `random_state` is given, `fn` is called as ``fn(item, rng)``,
+        where `rng` is a `np.random.Generator` seeded for that item;
+        otherwise, as ``fn(item)``.
+        For the process backend, `fn` (and the items) must be picklable.
+
+    n_workers : int > 0
+        The number of threads or processes to run.
+
+    backend : {'thread', 'process'}
+        Whether to run `fn` in threads or in processes.
+        Threads are sufficient for functions which release the GIL, such
+        as most numpy operations and file I/O.
+
+    ordered : bool
+        If True, outputs are yielded in the order of the input stream.
+        If False, outputs are yielded as soon as they are ready.
+
+    max_in_flight : int > 0 or None
+        The maximum number of items submitted but not yet yielded.
+        If None, ``2 * n_workers`` is used.
+
+    random_state : None, int, np.random.SeedSequence or np.random.Generator
+        If given, item ``i`` of the stream is processed with a random
+        generator derived from `random_state` and ``i``, so that the
+        results do not depend on `n_workers`, `backend` or scheduling.
+
+    Yields
+    ------
+    output
+        The result of `fn` on each item.
+
+    Raises
+    ------
+    PescadorError
+        If the parameters are invalid.
+    Exception
+        Any exception raised by `fn` is re-raised to the consumer, in the
+        position of the item which caused it.
+
+    Examples
+    --------
+    >>> def augment(data, rng):
+    ...     return dict(X=data['X'] + rng.normal(size=data['X'].shape),
+    ...                 Y=data['Y'])
+    >>> stream = pescador.maps.parallel_map(streamer, augment, 4,
+    ...                                     random_state=0)
+    '''
+    if not isinstance(n_workers, six.integer_types) or n_workers < 1:
+        raise PescadorError('n_workers={} must be a positive '
+                            'integer'.format(n_workers))
+
+    if backend not in ('thread', 'process'):
+        raise PescadorError('Invalid backend={}'.format(backend))
+
+    if max_in_flight is None:
+        max_in_flight = 2 * n_workers
+    elif (not isinstance(max_in_flight, six.integer_types) or
+          max_in_flight < 1):
+        raise PescadorError('max_in_flight={} must be a positive '
+                            'integer'.format(max_in_flight))
+
+    seed = None
+    if random_state is not None:
+        seed = util.spawn_seeds(random_state, 1)[0]
+
+    if backend == 'thread':
+        pool = multiprocessing.pool.ThreadPool(n_workers)
+    else:
+        pool = multiprocessing.Pool(n_workers)
+
+    done = queue.Queue()
+    results = dict()
+    stream = iter(stream)
+    n_submitted, n_yielded = 0, 0
+    exhausted = False
+
+    try:
+        while True:
+            # Keep the pool busy, up to the in-flight limit
+            while not exhausted and n_submitted - n_yielded < max_in_flight:
+                try:
+                    item = six.advance_iterator(stream)
+                except StopIteration:
+                    exhausted = True
+                    break
+
+                item_seed = None
+                if seed is not None:
+                    item_seed = np.random.SeedSequence(
+                        seed.entropy,
+                        spawn_key=seed.spawn_key + (n_submitted,))
+
+                kwargs = dict(callback=done.put)
+                if six.PY3:
+                    # Errors outside of fn, e.g., pickling
+                    kwargs['error_callback'] = functools.partial(
+                        _map_failed, done, n_submitted)
+
+                pool.apply_async(_apply_map,
+                                 (fn, n_submitted, item, item_seed), **kwargs)
+                n_submitted += 1
+
+            if n_yielded == n_submitted:
+                break
+
+            if ordered:
+                while n_yielded not in results:
+                    index, exc, output = done.get()
+                    results[index] = (exc, output)
+                exc, output = results.pop(n_yielded)
+            else:
+                _, exc, output = done.get()
+
+            if exc is not None:
+                raise exc
+
+            n_yielded += 1
+            yield output
+
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def map_batches(stream, fn, batch_size, partial=True, unbatch=False):
+    '''Apply a function to stacked batches of a stream.
+
+    Vectorized transformations, such as normalization or type conversion,
+    are much cheaper to apply once to a batch than to each item.
+
+    Parameters
+    ----------
+    stream : iterable
+        Stream of data objects.
+
+    fn : callable
+        A function mapping a batch (a dictionary of stacked arrays, as
+        produced by `buffer_stream`) to a batch.
+
+    batch_size : int > 0
+        The number of items to stack for each call to `fn`.
+
+    partial : bool
+        If True (default), the final partial batch is also transformed, so
+        that no items are dropped.
+
+    unbatch : bool
+        If True, split each output batch back into items.
+        Items are views of the rows of the output batch, so no data is
+        copied.
+
+    Yields
+    ------
+    output : dict
+        The output of `fn` on each batch, or each item of those outputs
+        if `unbatch=True`.
+
+    Raises
+    ------
+    DataError
+        If the stream contains items that are not data-like, or
+        `unbatch=True` and `fn` does not return a dictionary.
+    PescadorError
+        If `unbatch=True` and the fields of an output batch have unequal
+        lengths.
+
+    See Also
+    --------
+    buffer_stream
+
+    Examples
+    --------
+    >>> def normalize(batch):
+    ...     batch['X'] = (batch['X'] - mean) / std
+    ...     return batch
+    >>> stream = pescador.maps.map_batches(streamer, normalize, 256,
+    ...                                    unbatch=True)
+    '''
+    for batch in buffer_stream(stream, batch_size, partial=partial):
+        output = fn(batch)
+        if not unbatch:
+            yield output
+            continue
+
+        for item in __split_data(output):
+            yield item
+
+
+def unbatch(stream):
+    '''Split a stream of batches into a stream of items.
+
+    Items are views of the rows of each batch, so no data is copied.
+
+    Parameters
+    ----------
+    stream : iterable
+        Stream of batches, e.g., from `buffer_stream`.
+
+    Yields
+    ------
+    item : dict
+        Each row of each batch.
+
+    Raises
+    ------
+    DataError
+        If the stream contains items that are not batches.
+    PescadorError
+        If the fields of a batch have unequal lengths.
+    '''
+    for batch in stream:
+        for item in __split_data(batch):
+            yield item
+
+
+def __concat_data(pieces):
+    if len(pieces) == 1:
+        return pieces[0]
+
+    try:
+        return {key: np.concatenate([piece[key] for piece in pieces])
+                for key in pieces[0]}
+    except KeyError:
+        raise DataError("Inconsistent batch fields: {}".format(pieces))
+
+
+def rebatch(stream, batch_size, partial=False):
+    '''Change the size of the batches in a stream.
+
+    Output batches which fall within a single input batch are views of
+    that batch; data is only copied for batches which span input batches.
+
+    Parameters
+    ----------
+    stream : iterable
+        Stream of batches, e.g., from `buffer_stream` or `ZMQStreamer`.
+
+    batch_size : int > 0
+        The number of items per output batch.
+
+    partial : bool, default=False
+        If True, yield a final partial batch on under-run.
+
+    Yields
+    ------
+    batch : dict
+        Batches of `batch_size` items.
+
+    Raises
+    ------
+    DataError
+        If the stream contains items that are not batches, or batches with
+        different fields.
+    PescadorError
+        If `batch_size` is not a positive integer, or the fields of a batch
+        have unequal lengths.
+    '''
+    if not isinstance(batch_size, six.integer_types) or batch_size < 1:
+        raise PescadorError('batch_size={} must be a positive '
+                            'integer'.format(batch_size))
+
+    pieces = []
+    n_pending = 0
+
+    for batch in stream:
+        if not isinstance(batch, dict):
+            raise DataError("Malformed batch: {}".format(batch))
+
+        n = util.batch_length(batch) or 0
+        offset = 0
+        while offset < n:
+            n_take = min(batch_size - n_pending, n - offset)
+            pieces.append({key: value[offset:offset + n_take]
+                           for key, value in six.iteritems(batch)})
+            n_pending += n_take
+            offset += n_take
+
+            if n_pending == batch_size:
+                yield __concat_data(pieces)
+                pieces = []
+                n_pending = 0
+
+    if pieces and partial:
+        yield __concat_data(pieces)
+
+
+def __item_length(item, length_key):
+    try:
+        return len(item[length_key])
+    except TypeError:
+        raise DataError("Malformed data stream: {}".format(item))
+
+
+def __pad_data(data, pad_keys, length_key, pad_value, lengths_key, mask_key):
+    '''Stack items, padding `pad_keys` along the first axis to the
+    longest item.'''
+    lengths = np.array([len(x[length_key]) for x in data])
+    max_len = lengths.max()
+
+    output = dict()
+    try:
+        for key in data[0].keys():
+            if key not in pad_keys:
+                output[key] = np.stack([x[key] for x in data])
+                continue
+
+            first = np.asarray(data[0][key])
+            value = np.full((len(data), max_len) + first.shape[1:],
+                            pad_value, dtype=first.dtype)
+            for i, x in enumerate(data):
+                value[i, :len(x[key])] = x[key]
+            output[key] = value
+    except (TypeError, AttributeError, ValueError, KeyError):
+        raise DataError("Malformed data stream: {}".format(data))
+
+    if lengths_key is not None:
+        output[lengths_key] = lengths
+    if mask_key is not None:
+        output[mask_key] = np.arange(max_len) < lengths[:, np.newaxis]
+    return output
+
+
+def bucket_stream(stream, batch_size, length_key, boundaries, pad_keys=None,
+                  pad_value=0, lengths_key='lengths', mask_key='mask',
+                  partial=False):
+    '''Batch variable-length items, grouped by length.
+
+    Items are assigned to buckets by the length (first dimension) of
+    ``item[length_key]``.  When a bucket holds `batch_size` items, they are
+    stacked into a batch, padding to the longest item in the batch rather
+    than to the longest item overall.
+
+    Parameters
+    ----------
+    stream : iterable
+        Stream of data objects.
+
+    batch_size : int > 0
+        The number of items per batch.
+
+    length_key : str
+        The field which determines the length of each item.
+
+    boundaries : iterable of int
+        Increasing bucket boundaries.  Items with
+        ``boundaries[i-1] <= length < boundaries[i]`` go to bucket ``i``,
+        so there are ``len(boundaries) + 1`` buckets.
+
+    pad_keys : iterable of str or None
+        The fields to pad along their first dimension.
+        All padded fields of an item must have the same length.
+        If None, only `length_key` is padded.
+        Other fields are stacked, and must have equal shapes.
+
+    pad_value : scalar
+        The value to pad with.
+
+    lengths_key : str or None
+        The field in which to store the original length of each item.
+        If None, lengths are not stored.
+
+    mask_key : str or None
+        The field in which to store a boolean array of shape
+        ``(batch_size, max_length)``, which is True for entries which are
+        not padding.  If None, masks are not stored.
+
+    partial : bool, default=False
+        If True, yield the remaining partial batches on under-run,
+        in order of bucket.
+
+    Yields
+    ------
+    batch : dict
+        Batches of `batch_size` items.
+
+    Raises
+    ------
+    DataError
+        If the stream contains items that are not data-like, or items
+        whose fields cannot be padded or stacked.
+    PescadorError
+        If `batch_size` or `boundaries` are invalid.
+
+    See Also
+    --------
+    buffer_stream
+
+    Examples
+    --------
+    >>> stream = pescador.maps.bucket_stream(streamer, 32, 'audio',
+    ...                                      [16000, 32000, 64000])
+    >>> for batch in stream:
+    ...     model.train(batch['audio'], batch['mask'], batch['label'])
+    '''
+    if not isinstance(batch_size, six.integer_types) or batch_size < 1:
+        raise PescadorError('batch_size={} must be a positive '
+                            'integer'.format(batch_size))
+
+    boundaries = np.asarray(boundaries)
+    if boundaries.ndim != 1 or np.any(np.diff(boundaries) <= 0):
+        raise PescadorError('boundaries={} must be strictly '
+                            'increasing'.format(boundaries))
+
+    if pad_keys is None:
+        pad_keys = [length_key]
+    pad_keys = set(pad_keys)
+
+    buckets = [[] for _ in range(len(boundaries) + 1)]
+
+    for x in stream:
+        length = __item_length(x, length_key)
+        bucket = buckets[np.searchsorted(boundaries, length, side='right')]
+        bucket.append(x)
+
+        if len(bucket) < batch_size:
+            continue
+
+        yield __pad_data(bucket, pad_keys, length_key, pad_value,
+                         lengths_key, mask_key)
+        del bucket[:]
+
+    if partial:
+        for bucket in buckets:
+            if bucket:
+                yield __pad_data(bucket, pad_keys, length_key, pad_value,
+                                 lengths_key, mask_key)
+
+
+# The cost of a batch, given its number of items, the sum and maximum of
+# their lengths, and the maximum of their sizes in bytes
+__BUDGET_COSTS = {
+    'elements': lambda n, total, longest, nbytes: total,
+    'padded': lambda n, total, longest, nbytes: n * longest,
+    'bytes': lambda n, total, longest, nbytes: n * nbytes,
+}
+
+
+def __budget_groups(items, max_cost, cost, length_key):
+    '''Greedily group items, closing each group before its cost would
+    exceed `max_cost`.
+
+    Yields (group, full) pairs, where `full` is False only for the final
+    group.
+    '''
+    cost_fn = __BUDGET_COSTS[cost]
+    group = []
+    n, total, longest, nbytes = 0, 0, 0, 0
+
+    for x in items:
+        length = __item_length(x, length_key)
+        size = util.item_nbytes(x) if cost == 'bytes' else 0
+
+        if group and cost_fn(n + 1, total + length, max(longest, length),
+                             max(nbytes, size)) > max_cost:
+            yield group, True
+            group = []
+            n, total, longest, nbytes = 0, 0, 0, 0
+
+        group.append(x)
+        n, total = n + 1, total + length
+        longest, nbytes = max(longest, length), max(nbytes, size)
+
+    if group:
+        yield group, False
+
+
+def budget_stream(stream, max_cost, length_key, cost='padded', window=None,
+                  pad_keys=None, pad_value=0, lengths_key='lengths',
+                  mask_key='mask', partial=False, random_state=None):
+    '''Batch variable-length items, with as many items per batch as fit
+    in a budget.
+
+    Batches are padded as in `bucket_stream`.  Each batch is closed before
+    adding an item would take its cost over `max_cost`, so that batches of
+    short items hold more items than batches of long items.
+
+    Parameters
+    ----------
+    stream : iterable
+        Stream of data objects.
+
+    max_cost : number > 0
+        The budget for each batch.
+        An item whose cost alone exceeds the budget is batched on its own.
+
+    length_key : str
+        The field which determines the length of each item.
+
+    cost : {'padded', 'elements', 'bytes'}
+        How to measure the cost of a batch:
+
+        - `padded`: the number of items times the longest length, i.e.,
+          the padded size of `length_key`.
+        - `elements`: the total length of the items, e.g., the number of
+          tokens, ignoring padding.
+        - `bytes`: the number of items times the size in bytes of the
+          largest item, which bounds the memory of the padded batch.
+
+    window : int > 0 or None
+        If given, collect `window` items, sort them by length and batch
+        them together, so that items of similar length share a batch.
+        Batches from each window are yielded in random order, and the last
+        (possibly under-filled) batch is carried over to the next window.
+
+    pad_keys, pad_value, lengths_key, mask_key
+        As in `bucket_stream`.
+
+    partial : bool, default=False
+        If True, yield the remaining under-filled batch on under-run.
+
+    random_state : None, int, np.random.RandomState or np.random.Generator
+        The random state for ordering batches within a window.
+
+    Yields
+    ------
+    batch : dict
+        Padded batches.
+
+    Raises
+    ------
+    DataError
+        If the stream contains items that are not data-like, or items
+        whose fields cannot be padded or stacked.
+    PescadorError
+        If the parameters are invalid.
+
+    See Also
+    --------
+    bucket_stream
+
+    Examples
+    --------
+    Batches of at most 4096 tokens, including padding, from sorted windows
+    of 1000 items
+
+    >>> stream = pescador.maps.budget_stream(streamer, 4096, 'tokens',
+    ...                                      window=1000)
+    '''
+    if max_cost <= 0:
+        raise PescadorError('max_cost={} must be positive'.format(max_cost))
+
+    if cost not in __BUDGET_COSTS:
+        raise PescadorError('Invalid cost={}'.format(cost))
+
+    if window is not None and (not isinstance(window, six.integer_types) or
+                               window < 1):
+        raise PescadorError('window={} must be a positive '
+                            'integer'.format(window))
+
+    if pad_keys is None:
+        pad_keys = [length_key]
+    pad_keys = set(pad_keys)
+
+    def __batch(group):
+        return __pad_data(group, pad_keys, length_key, pad_value,
+                          lengths_key, mask_key)
+
+    if window is None:
+        for group, full in __budget_groups(stream, max_cost, cost,
+                                           length_key):
+            if full or partial:
+                yield __batch(group)
+        return
+
+    rng = util.get_rng(random_state)
+    buf = []
+    n_carry = 0
+
+    for x in stream:
+        buf.append(x)
+        if len(buf) < n_carry + window:
+            continue
+
+        buf.sort(key=lambda item: __item_length(item, length_key))
+        groups = [group for group, _ in
+                  __budget_groups(buf, max_cost, cost, length_key)]
+        buf = groups.pop()
+        n_carry = len(buf)
+
+        for i in rng.permutation(len(groups)):
+            yield __batch(groups[i])
+
+    buf.sort(key=lambda item: __item_length(item, length_key))
+    groups = [group for group, _ in
+              __budget_groups(buf, max_cost, cost, length_key)]
+    if groups and not partial:
+        groups.pop()
+
+    for i in rng.permutation(len(groups)):
+        yield __batch(groups[i])
+
+
+def __pack_row(segments, key, max_len, pack_keys, pad_value, segment_key,
+               position_key):
+    '''Concatenate items into one row of length `max_len`.'''
+    segment_ids = np.zeros(max_len, dtype=np.int32)
+    positions = np.zeros(max_len, dtype=np.int32)
+
+    offset = 0
+    for i, x in enumerate(segments):
+        n = len(x[key])
+        segment_ids[offset:offset + n] = i + 1
+        positions[offset:offset + n] = np.arange(n)
+        offset += n
+
+    output = {segment_key: segment_ids, position_key: positions}
+    try:
+        for k in pack_keys:
+            first = np.asarray(segments[0][k])
+            row = np.full((max_len,) + first.shape[1:], pad_value,
+                          dtype=first.dtype)
+            offset = 0
+            for x in segments:
+                n = len(x[key])
+                row[offset:offset + n] = x[k]
+                offset += n
+            output[k] = row
+    except (TypeError, ValueError, KeyError):
+        raise DataError("Malformed data stream: {}".format(segments))
+
+    return output
+
+
+def __first_fit_decreasing(items, lengths, max_len):
+    '''Pack items into as few rows as possible, longest first.'''
+    rows = []
+    remaining = np.zeros(len(items), dtype=int)
+
+    for i in np.argsort(-np.asarray(lengths), kind='mergesort'):
+        fits = np.flatnonzero(remaining[:len(rows)] >= lengths[i])
+        if len(fits):
+            row = fits[0]
+        else:
+            row = len(rows)
+            rows.append([])
+            remaining[row] = max_len
+        rows[row].append(items[i])
+        remaining[row] -= lengths[i]
+
+    return rows
+
+
+def pack_sequences(stream, key, max_len, method='greedy', window=1000,
+                   pack_keys=None, pad_value=0, segment_key='segment_ids',
+                   position_key='positions', truncate=False):
+    '''Pack variable-length items into rows of a fixed length.
+
+    Several short items are concatenated (along the first dimension) into
+    each row, so that little space is wasted on padding.  Each row records
+    which item each position came from, and the position within that item.
+    Rows all have the same shape, so they can be batched by
+    `buffer_stream`.
+
+    Parameters
+    ----------
+    stream : iterable
+        Stream of data objects.
+
+    key : str
+        The field which determines the length of each item.
+
+    max_len : int > 0
+        The length of each row.
+
+    method : {'greedy', 'ffd'}
+        - `greedy`: add items to the current row in stream order,
+          starting a new row when the next item does not fit.
+        - `ffd`: collect `window` items and pack them first-fit
+          decreasing: longest first, each into the first row with space.
+          This packs more tightly, at the cost of reordering items.
+
+    window : int > 0
+        The number of items to pack at once with `method='ffd'`.
+
+    pack_keys : iterable of str or None
+        The fields to pack, which must all have the same length as `key`.
+        If None, only `key` is packed.  Other fields are discarded.
+
+    pad_value : scalar
+        The value for positions not filled by any item.
+
+    segment_key : str
+        The field in which to store the segment id of each position:
+        ``1, 2, ...`` for the items in the row, and 0 for padding.
+
+    position_key : str
+        The field in which to store the position of each entry within its
+        item, or 0 for padding.
+
+    truncate : bool
+        If True, items longer than `max_len` are truncated.
+        If False, they raise a `DataError`.
+
+    Yields
+    ------
+    row : dict
+        Rows, with fields of shape ``(max_len, ...)``.
+
+    Raises
+    ------
+    DataError
+        If the stream contains items that are not data-like, or items
+        longer than `max_len` and `truncate=False`.
+    PescadorError
+        If the parameters are invalid.
+
+    See Also
+    --------
+    budget_stream
+
+    Examples
+    --------
+    >>> rows = pescador.maps.pack_sequences(streamer, 'tokens', 512,
+    ...                                     method='ffd')
+    >>> batches = pescador.maps.buffer_stream(rows, 32)
+    '''
+    if not isinstance(max_len, six.integer_types) or max_len < 1:
+        raise PescadorError('max_len={} must be a positive '
+                            'integer'.format(max_len))
+
+    if method not in ('greedy', 'ffd'):
+        raise PescadorError('Invalid method={}'.format(method))
+
+    if not isinstance(window, six.integer_types) or window < 1:
+        raise PescadorError('window={} must be a positive '
+                            'integer'.format(window))
+
+    if pack_keys is None:
+        pack_keys = [key]
+    pack_keys = list(pack_keys)
+
+    def __row(segments):
+        return __pack_row(segments, key, max_len, pack_keys, pad_value,
+                          segment_key, position_key)
+
+    items, lengths = [], []
+    n_pending = 0
+
+    for x in stream:
+        n = __item_length(x, key)
+        if n > max_len:
+            if not truncate:
+                raise DataError('Item of length {} does not fit in '
+                                'max_len={}'.format(n, max_len))
+            x = {k: (v[:max_len] if k in pack_keys else v)
+                 for k, v in six.iteritems(x)}
+            n = max_len
+
+        if method == 'greedy':
+            if n_pending + n > max_len:
+                yield __row(items)
+                items, n_pending = [], 0
+            items.append(x)
+            n_pending += n
+            continue
+
+        items.append(x)
+        lengths.append(n)
+        if len(items) < window:
+            continue
+
+        for row in __first_fit_decreasing(items, lengths, max_len):
+            yield __row(row)
+        items, lengths = [], []
+
+    if not items:
+        return
+
+    if method == 'greedy':
+        yield __row(items)
+    else:
+        for row in __first_fit_decreasing(items, lengths, max_len):
+            yield __row(row)
+
+
+def __frame(x, width, hop, axis):
+    '''Frame an array along `axis` into a read-only strided view of shape
+    ``(n_frames,) + x.shape``, with ``x.shape[axis]`` replaced by
+    `width`.'''
+    x = np.asarray(x)
+    length = x.shape[axis]
+    n_frames = max(0, 1 + (length - width) // hop)
+
+    shape = list(x.shape)
+    shape[axis] = width
+    return np.lib.stride_tricks.as_strided(
+        x, shape=(n_frames,) + tuple(shape),
+        strides=(hop * x.strides[axis],) + x.strides, writeable=False)
+
+
+def __window_items(x, frames, starts, aligned_keys):
+    for start in starts:
+        output = dict(x)
+        for k in aligned_keys:
+            output[k] = frames[k][start]
+        yield output
+
+
+def __check_window_args(width, hop, aligned_keys, key):
+    if not isinstance(width, six.integer_types) or width < 1:
+        raise PescadorError('width={} must be a positive '
+                            'integer'.format(width))
+
+    if not isinstance(hop, six.integer_types) or hop < 1:
+        raise PescadorError('hop={} must be a positive integer'.format(hop))
+
+    if aligned_keys is None:
+        return [key]
+    return [key] + [k for k in aligned_keys if k != key]
+
+
+def __frame_item(x, aligned_keys, width, hop, axis):
+    try:
+        frames = {k: __frame(x[k], width, hop, axis) for k in aligned_keys}
+    except (TypeError, IndexError):
+        raise DataError("Malformed data stream: {}".format(x))
+
+    if len({np.shape(x[k])[axis] for k in aligned_keys}) > 1:
+        raise DataError('Aligned fields {} have unequal lengths on '
+                        'axis {}'.format(aligned_keys, axis))
+    return frames, len(frames[aligned_keys[0]])
+
+
+def windows(stream, key, width, hop=None, axis=0, aligned_keys=None):
+    '''Slice fixed-width windows out of the items of a stream.
+
+    Windows are read-only views of the original arrays, so no data is
+    copied until windows are batched.
+
+    Parameters
+    ----------
+    stream : iterable
+        Stream of data objects.
+
+    key : str
+        The field to slice windows from.
+
+    width : int > 0
+        The width of each window.
+
+    hop : int > 0 or None
+        The offset between the starts of consecutive windows.
+        If None, `width` is used, so windows do not overlap.
+
+    axis : int
+        The axis to slice along.
+
+    aligned_keys : iterable of str or None
+        Other fields to slice in the same way as `key`, such as per-frame
+        labels.  These must have the same length along `axis`.
+        All other fields are passed along unchanged.
+
+    Yields
+    ------
+    window : dict
+        Each window of each item, in order.
+        Items shorter than `width` yield no windows.
+
+    Raises
+    ------
+    DataError
+        If the stream contains items that are not data-like, or aligned
+        fields of unequal length.
+    PescadorError
+        If the parameters are invalid.
+
+    See Also
+    --------
+    random_windows
+
+    Examples
+    --------
+    Half-overlapping patches of 128 frames from spectrograms of shape
+    ``(n_bins, n_frames)``
+
+    >>> patches = pescador.maps.windows(streamer, 'spec', 128, hop=64,
+    ...                                 axis=-1)
+    '''
+    if hop is None:
+        hop = width
+    aligned_keys = __check_window_args(width, hop, aligned_keys, key)
+
+    for x in stream:
+        frames, n_frames = __frame_item(x, aligned_keys, width, hop, axis)
+        for output in __window_items(x, frames, range(n_frames),
+                                     aligned_keys):
+            yield output
+
+
+def random_windows(stream, key, width, n_windows=1, axis=0,
+                   aligned_keys=None, random_state=None):
+    '''Slice fixed-width windows at random positions out of the items of a
+    stream.
+
+    This is the common pattern of sampling patches from long signals.
+    As with `windows`, patches are read-only views of the original arrays.
+
+    Parameters
+    ----------
+    stream : iterable
+        Stream of data objects.
+
+    key : str
+        The field to slice windows from.
+
+    width : int > 0
+        The width of each window.
+
+    n_windows : int > 0
+        The number of windows to draw from each item.
+
+    axis : int
+        The axis to slice along.
+
+    aligned_keys : iterable of str or None
+        Other fields to slice in the same way as `key`.
+        All other fields are passed along unchanged.
+
+    random_state : None, int, np.random.RandomState or np.random.Generator
+        The random state for window positions.
+
+    Yields
+    ------
+    window : dict
+        `n_windows` windows from each item.
+        Items shorter than `width` yield no windows.
+
+    Raises
+    ------
+    DataError
+        If the stream contains items that are not data-like, or aligned
+        fields of unequal length.
+    PescadorError
+        If the parameters are invalid.
+
+    See Also
+    --------
+    windows
+
+    Examples
+    --------
+    >>> def patches(path):
+    ...     yield dict(spec=np.load(path, mmap_mode='r'))
+    >>> stream = pescador.Streamer(pescador.maps.random_windows,
+    ...                            pescador.Streamer(patches, path).cycle(),
+    ...                            'spec', 128, n_windows=16, axis=-1)
+    '''
+    aligned_keys = __check_window_args(width, 1, aligned_keys, key)
+
+    if not isinstance(n_windows, six.integer_types) or n_windows < 1:
+        raise PescadorError('n_windows={} must be a positive '
+                            'integer'.format(n_windows))
+
+    rng = util.get_rng(random_state)
+
+    for x in stream:
+        frames, n_frames = __frame_item(x, aligned_keys, width, 1, axis)
+        if not n_frames:
+            continue
+
+        starts = util._randint(rng, n_frames, size=n_windows)
+        for output in __window_items(x, frames, starts, aligned_keys):
+            yield output
+
+
+class _RowBuffer(object):
+    '''Preallocated storage for `size` items, as one array per field.'''
+    def __init__(self, item, size):
+        try:
+            self.data = {key: np.empty((size,) + np.shape(value),
+                                       dtype=np.asarray(value).dtype)
+                         for key, value in six.iteritems(item)}
+        except AttributeError:
+            raise DataError("Malformed data stream: {}".format(item))
+
+    def put(self, i, item):
+        if len(item) != len(self.data):
+            raise DataError('Item fields {} do not match '
+                            '{}'.format(sorted(item), sorted(self.data)))
+        try:
+            for key, value in six.iteritems(self.data):
+                value[i] = item[key]
+        except (KeyError, ValueError):
+            raise DataError('Item does not match the buffer: {}'.format(item))
+
+    def get(self, index):
+        '''Copy out a row, or gather a batch of rows.'''
+        if np.ndim(index):
+            return {key: value[index] for key, value in
+                    six.iteritems(self.data)}
+        return {key: value[index, ...].copy() for key, value in
+                six.iteritems(self.data)}
+
+
+def shuffle_buffer(stream, size, batch_size=None, partial=False,
+                   random_state=None):
+    '''Locally shuffle a stream through a fixed-size buffer.
+
+    The buffer is allocated once, as one array per field, from the first
+    item.  Once it is full, each incoming item replaces a random item in
+    the buffer, which is emitted.  When the stream is exhausted, the
+    remaining items are emitted in random order.
+
+    This is useful for sequential sources, such as `ChainMux` or
+    `io.ShardStreamer`, where items which are close in the stream are
+    correlated.
+
+    Parameters
+    ----------
+    stream : iterable
+        Stream of data objects.  All items must have the same fields, with
+        the same shapes.
+
+    size : int > 0
+        The number of items to hold in the buffer.
+
+    batch_size : int > 0 or None
+        If given, emit batches of `batch_size` randomly selected items,
+        gathered from the buffer in one operation, instead of single items.
+        Must be at most `size`.
+
+    partial : bool, default=False
+        If True and `batch_size` is given, yield a final partial batch on
+        under-run.
+
+    random_state : None, int, np.random.RandomState or np.random.Generator
+        The random state for shuffling.
+
+    Yields
+    ------
+    output : dict
+        Items, or batches of items if `batch_size` is given.
+        Outputs are copies, and do not change as the buffer is reused.
+
+    Raises
+    ------
+    DataError
+        If the stream contains items that are not data-like, or items
+        whose fields do not match the first item.
+    PescadorError
+        If the parameters are invalid.
+
+    Examples
+    --------
+    >>> chain = pescador.ChainMux(pescador.io.shard_streamers(directory))
+    >>> batches = pescador.maps.shuffle_buffer(chain, 10000, batch_size=64)
+    '''
+    if not isinstance(size, six.integer_types) or size < 1:
+        raise PescadorError('size={} must be a positive integer'.format(size))
+
+    if batch_size is not None and (
+            not isinstance(batch_size, six.integer_types) or
+            not 0 < batch_size <= size):
+        raise PescadorError('batch_size={} must be a positive integer no '
+                            'larger than size={}'.format(batch_size, size))
+
+    rng = util.get_rng(random_state)
+    buf = None
+    n_filled = 0
+    free = []
+    draws, n_drawn = [], 0
+
+    if batch_size is not None:
+        rows = list(range(size))
+        offsets = np.arange(batch_size)
+
+    for item in stream:
+        if buf is None:
+            buf = _RowBuffer(item, size)
+
+        if n_filled < size:
+            buf.put(n_filled, item)
+            n_filled += 1
+            continue
+
+        if batch_size is None:
+            # Emit a random row, and replace it
+            if n_drawn == len(draws):
+                draws, n_drawn = util._randint(rng, size,
+                                               size=RNG_BLOCK_SIZE), 0
+            i = draws[n_drawn]
+            n_drawn += 1
+            yield buf.get(i)
+            buf.put(i, item)
+            continue
+
+        if not free:
+            # A partial Fisher-Yates shuffle chooses the batch in
+            # O(batch_size), rather than permuting the whole buffer
+            swaps = util._randint(rng, size - offsets) + offsets
+            for j, k in enumerate(swaps.tolist()):
+                rows[j], rows[k] = rows[k], rows[j]
+            index = np.array(rows[:batch_size])
+            yield buf.get(index)
+            free = rows[:batch_size]
+        buf.put(free.pop(), item)
+
+    if buf is None:
+        return
+
+    # Drain the buffer, skipping rows which have already been emitted
+    remaining = np.setdiff1d(np.arange(n_filled), free)
+    order = remaining[rng.permutation(len(remaining))]
+
+    if batch_size is None:
+        for i in order:
+            yield buf.get(i)
+        return
+
+    n_batches = len(order) // batch_size
+    if partial and len(order) % batch_size:
+        n_batches += 1
+
+    for i in range(n_batches):
+        yield buf.get(order[i * batch_size:(i + 1) * batch_size])
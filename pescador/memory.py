@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+'''
+Memory accounting
+-----------------
+
+Report the memory held by pipeline stages which are currently iterating.
+
+Each active stage reports what it holds at the time `memory_usage` is
+called:
+
+- `buffer_stream`: the bytes and number of items buffered for the next
+  batch
+- `ZMQStreamer`, if it has a `max_bytes` limit: the bytes and number of
+  items sent by the worker, but not yet received by the consumer
+- muxes: the number of open streams
+
+Item sizes are estimated by `pescador.util.item_nbytes`.
+Both `buffer_stream` and `ZMQStreamer` accept a `max_bytes` limit, which
+applies backpressure instead of letting their memory grow.
+
+.. autosummary::
+    :toctree: generated/
+
+    memory_usage
+'''
+import threading
+import weakref
+
+__all__ = ['memory_usage']
+
+# Gauges of the stages which are currently iterating
+_GAUGES = weakref.WeakSet()
+_LOCK = threading.Lock()
+
+
+class _Gauge(object):
+    '''A stage's report of the memory it holds.
+
+    Parameters
+    ----------
+    stage : str
+        The name of the stage
+
+    probe : callable
+        Returns a dict with any of `bytes`, `items` and `streams`.
+
+    max_bytes : int or None
+        The stage's byte limit, if any
+    '''
+    def __init__(self, stage, probe, max_bytes=None):
+        self.stage = stage
+        self.probe = probe
+        self.max_bytes = max_bytes
+
+    def read(self):
+        usage = dict(stage=self.stage, bytes=None, items=None, streams=None,
+                     max_bytes=self.max_bytes)
+        usage.update(self.probe())
+        return usage
+
+
+def _register(stage, probe, max_bytes=None):
+    '''Register a gauge for an active stage.
+
+    Stages should `_unregister` the gauge when they stop iterating.
+    Gauges of stages which are garbage collected are dropped automatically.
+    '''
+    gauge = _Gauge(stage, probe, max_bytes=max_bytes)
+    with _LOCK:
+        _GAUGES.add(gauge)
+    return gauge
+
+
+def _unregister(gauge):
+    with _LOCK:
+        _GAUGES.discard(gauge)
+
+
+def memory_usage():
+    '''Report the memory held by each active pipeline stage.
+
+    Returns
+    -------
+    usage : list of dict
+        One entry per active stage, ordered by stage name, with keys:
+
+        - `stage`: the name of the stage
+        - `bytes`: bytes currently held, or None if not tracked
+        - `items`: items currently held, or None if not tracked
+        - `streams`: open streams, for muxes, or None
+        - `max_bytes`: the stage's byte limit, or None
+
+    Examples
+    --------
+    >>> for batch in pescador.maps.buffer_stream(zmq_stream, 64):
+    ...     for stage in pescador.memory_usage():
+    ...         print(stage['stage'], stage['bytes'], stage['streams'])
+    '''
+    with _LOCK:
+        gauges = list(_GAUGES)
+
+    return sorted((gauge.read() for gauge in gauges),
+                  key=lambda usage: usage['stage'])
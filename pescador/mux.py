@@ -61,14 +61,24 @@ This module defines the following Mux types:
     Mux
 '''
 from warnings import warn
+import collections
 import copy
+import itertools
+import sys
+import threading
 import six
 import numpy as np
 
 from . import core
+from . import memory
+from . import util
 from .exceptions import PescadorError
 
 
+# Number of variates drawn at once from a np.random.Generator
+RNG_BLOCK_SIZE = 1024
+
+
 class Mux(core.Streamer):
     '''Stochastic multiplexor for Streamers
 
@@ -258,7 +268,7 @@ class Mux(core.Streamer):
 
         self.weight_norm_ = np.sum(self.stream_weights_)
 
-    def iterate(self, max_iter=None):
+    def _iterate(self, max_iter=None):
         # Calls Streamer's __enter__, which calls _activate()
         with self as active_mux:
 
@@ -386,27 +396,31 @@ class BaseMux(core.Streamer):
         streamers : iterable of streamers
             The collection of streamer-type objects
 
-        random_state : None, int, or np.random.RandomState
+        random_state : None, int, np.random.RandomState,
+            np.random.Generator, or np.random.SeedSequence
             If int, random_state is the seed used by the random number
             generator;
 
-            If RandomState instance, random_state is the random number
-            generator;
+            If RandomState or Generator instance, random_state is the random
+            number generator;
+
+            If SeedSequence instance, a new Generator is constructed from it;
 
             If None, the random number generator is the RandomState instance
             used by np.random.
+
+            Generators are sampled in blocks, which is substantially faster
+            than the legacy RandomState interface.
+            See `pescador.util.spawn_seeds` for constructing independent
+            seeds for several muxes.
         """
         self.streamers = streamers
 
         # If random_state is none, use the 'global' random_state.
-        if random_state is None:
-            self.rng = np.random
-        elif isinstance(random_state, int):
-            self.rng = np.random.RandomState(seed=random_state)
-        elif isinstance(random_state, np.random.RandomState):
-            self.rng = random_state
-        else:
-            raise PescadorError('Invalid random_state={}'.format(random_state))
+        self.rng = util.get_rng(random_state)
+
+        # Blocks of pre-drawn random variates; only used with Generators.
+        self._reset_rng_blocks()
 
         # Clear state and reset activate params.
         self._reset()
@@ -476,7 +490,7 @@ class BaseMux(core.Streamer):
         """Reset the Mux state."""
         pass
 
-    def iterate(self, max_iter=None):
+    def _iterate(self, max_iter=None):
         """Yields items from the mux, and handles stream exhaustion and
         replacement.
         """
@@ -488,32 +502,61 @@ class BaseMux(core.Streamer):
             # Main sampling loop
             n = 0
 
-            while n < max_iter and active_mux._streamers_available():
-                # Pick a stream from the active set
-                idx = active_mux._next_sample_index()
+            gauge = memory._register(type(self).__name__,
+                                     active_mux._memory_usage)
 
-                # Can we sample from it?
-                try:
-                    # Then yield the sample
-                    yield six.advance_iterator(active_mux.streams_[idx])
+            try:
+                while n < max_iter and active_mux._streamers_available():
+                    # Pick a stream from the active set
+                    idx = active_mux._next_sample_index()
 
-                    # Increment the sample counter
+                    # Can we sample from it?
+                    try:
+                        sample = six.advance_iterator(active_mux.streams_[idx])
+
+                    except StopIteration:
+                        # Oops, this stream is exhausted.
+                        if active_mux.hooks_ is not None:
+                            active_mux.hooks_.fire('exhausted', active_mux,
+                                                   idx)
+
+                        # Call child-class exhausted-stream behavior
+                        active_mux._on_stream_exhausted(idx)
+
+                        # Setup a new stream for this index
+                        active_mux._replace_stream(idx)
+
+                        if active_mux.hooks_ is not None:
+                            active_mux.hooks_.fire('replace', active_mux,
+                                                   idx)
+                        continue
+
+                    # Increment the sample counter before yielding, so that
+                    # the count is correct if the consumer stops here
                     n += 1
                     active_mux.stream_counts_[idx] += 1
+                    yield sample
 
-                except StopIteration:
-                    # Oops, this stream is exhausted.
-
-                    # Call child-class exhausted-stream behavior
-                    active_mux._on_stream_exhausted(idx)
+            finally:
+                memory._unregister(gauge)
+                active_mux._on_iterate_end()
 
-                    # Setup a new stream for this index
-                    active_mux._replace_stream(idx)
+    def _memory_usage(self):
+        """Report the number of open streams to `pescador.memory_usage`."""
+        streams = self.streams_ or []
+        return dict(streams=sum(stream is not None for stream in streams))
 
     def _streamers_available(self):
         "Override this to modify the behavior of the main iter loop condition."
         return True
 
+    def _on_iterate_end(self):
+        """Override this to provide a Mux with additional behavior when
+        iteration stops, whether by exhaustion, `max_iter`, or the consumer
+        closing the generator.
+        """
+        pass
+
     def _on_stream_exhausted(self, idx):
         """Override this to provide a Mux with additional behavior
         when a stream is exhausted. This gets called *after* streams
@@ -561,6 +604,124 @@ class BaseMux(core.Streamer):
         raise NotImplementedError("_next_sample_index() must be implemented in"
                                   " a child class.")
 
+    def reseed(self, random_state):
+        """Replace the random number generator of this mux, and of any
+        streamers in `streamers` which can be reseeded (e.g., muxes and
+        `pescador.io` streamers), with independent generators spawned from
+        `random_state`.
+
+        This is used to give each worker process its own reproducible
+        random stream.
+
+        Parameters
+        ----------
+        random_state : None, int, np.random.SeedSequence, or
+            np.random.Generator
+            The parent seed; see `pescador.util.spawn_seeds`.
+        """
+        # Generators of streamers cannot be inspected without consuming them
+        children = []
+        if isinstance(self.streamers, (list, tuple)):
+            children = [s for s in self.streamers if hasattr(s, 'reseed')]
+
+        seeds = util.spawn_seeds(random_state, 1 + len(children))
+
+        self.rng = util.get_rng(seeds[0])
+        self._reset_rng_blocks()
+
+        for child, seed in zip(children, seeds[1:]):
+            child.reseed(seed)
+
+    def _reset_rng_blocks(self):
+        """Discard any pre-drawn random variates."""
+        self.uniform_block_ = np.empty(0)
+        self.uniform_pos_ = 0
+        self.poisson_block_ = np.empty(0, dtype=int)
+        self.poisson_pos_ = 0
+        self.poisson_lam_ = None
+
+    def _uniform(self):
+        """Draw a single uniform variate on [0, 1) from a block of
+        pre-drawn variates."""
+        if self.uniform_pos_ >= len(self.uniform_block_):
+            self.uniform_block_ = self.rng.random(RNG_BLOCK_SIZE)
+            self.uniform_pos_ = 0
+
+        value = self.uniform_block_[self.uniform_pos_]
+        self.uniform_pos_ += 1
+        return value
+
+    def _choice(self, weights, norm=1.0):
+        """Draw an index into `weights`, with probability `weights / norm`.
+
+        Parameters
+        ----------
+        weights : np.ndarray
+            Non-negative weights
+
+        norm : float > 0
+            The sum of `weights`
+
+        Returns
+        -------
+        idx : int, [0:len(weights) - 1]
+        """
+        if not util.is_generator(self.rng):
+            return self.rng.choice(len(weights), p=(weights / norm))
+
+        # Inverse CDF sampling; zero-weight entries can never be selected
+        # because `side='right'` skips over flat regions of the cdf.
+        cdf = np.cumsum(weights)
+        idx = len(cdf)
+        while idx >= len(cdf):
+            idx = np.searchsorted(cdf, self._uniform() * cdf[-1],
+                                  side='right')
+        return int(idx)
+
+    def _poisson(self, lam):
+        """Draw a single Poisson variate with rate `lam`."""
+        if not util.is_generator(self.rng):
+            return self.rng.poisson(lam=lam)
+
+        if self.poisson_lam_ != lam or self.poisson_pos_ >= len(
+                self.poisson_block_):
+            self.poisson_block_ = self.rng.poisson(lam=lam,
+                                                   size=RNG_BLOCK_SIZE)
+            self.poisson_pos_ = 0
+            self.poisson_lam_ = lam
+
+        value = self.poisson_block_[self.poisson_pos_]
+        self.poisson_pos_ += 1
+        return value
+
+
+class _SourceTelemetry(object):
+    '''Cumulative per-source counters for a mux.
+
+    The same object is shared by a mux and all of its activated copies.
+    '''
+    def __init__(self, n_streams):
+        self.samples = np.zeros(n_streams, dtype=np.int64)
+        self.activations = np.zeros(n_streams, dtype=np.int64)
+        self.prunes = np.zeros(n_streams, dtype=np.int64)
+        self.activation_time = np.zeros(n_streams)
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def start(self, idx, stream):
+        '''Time the activation of a stream, up to its first item.'''
+        start = core._timer()
+        try:
+            first = six.advance_iterator(stream)
+            stream = itertools.chain([first], stream)
+        except StopIteration:
+            stream = iter(())
+        finally:
+            self.activations[idx] += 1
+            self.activation_time[idx] += core._timer() - start
+        return stream
+
 
 class StochasticMux(BaseMux):
     '''Stochastic Mux
@@ -579,7 +740,20 @@ class StochasticMux(BaseMux):
     'accacbcba'
     >>> print("".join(mux(max_iter=30)))
     'abaccbbabccbbbccaccbacbccbbbbc'
+
+    Find starved or slow sources
+
+    >>> mux.instrument()
+    >>> for item in mux(max_iter=10000):
+    ...     process(item)
+    >>> report = mux.compare_distribution()
+    >>> starved = np.flatnonzero(report['ratio'] < 0.5)
+    >>> slowest = np.argsort(mux.source_stats()['mean_activation_time'])
     '''
+
+    # Per-source counters are collected only if `instrument` is called
+    telemetry_ = None
+
     def __init__(self, streamers, n_active, rate,
                  weights=None,
                  mode="with_replacement",
@@ -631,7 +805,8 @@ class StochasticMux(BaseMux):
         prune_empty_streams : bool
             Disable streamers that produce no data. See `BaseMux`
 
-        random_state : None, int, or np.random.RandomState
+        random_state : None, int, np.random.RandomState,
+            np.random.Generator, or np.random.SeedSequence
             See `BaseMux`
         """
         self.mode = mode
@@ -707,14 +882,116 @@ class StochasticMux(BaseMux):
         self.stream_weights_ = None
         self.weight_norm_ = None
 
+    def instrument(self, enabled=True):
+        '''Enable or disable the collection of statistics.
+
+        In addition to the statistics collected by `Streamer.instrument`,
+        this collects cumulative per-source counters, which are read by
+        `source_stats` and `compare_distribution`.
+
+        When enabled, the first item of each stream is drawn as soon as the
+        stream is activated, to measure its activation time.
+
+        Parameters
+        ----------
+        enabled : bool
+            If True, collect statistics from now on.
+            If False, stop collecting statistics and discard them.
+
+        Returns
+        -------
+        self : StochasticMux
+        '''
+        super(StochasticMux, self).instrument(enabled)
+        self.telemetry_ = None
+        if enabled:
+            self.telemetry_ = _SourceTelemetry(self.n_streams)
+        return self
+
+    def source_stats(self):
+        '''Get cumulative per-source counters.
+
+        Samples from a stream are counted when the stream is exhausted, or
+        when iteration stops.
+
+        Returns
+        -------
+        stats : dict of np.ndarray or None
+            None, if the mux is not instrumented.  Otherwise, arrays of
+            length `n_streams`:
+
+            - `samples`: the number of samples drawn from each source
+            - `activations`: the number of times each source was activated
+            - `prunes`: the number of times each source was disabled for
+              producing no data
+            - `activation_time`: total seconds spent activating each source,
+              up to its first item
+            - `mean_activation_time`: seconds per activation
+        '''
+        if self.telemetry_ is None:
+            return None
+
+        telemetry = self.telemetry_
+        return dict(samples=telemetry.samples.copy(),
+                    activations=telemetry.activations.copy(),
+                    prunes=telemetry.prunes.copy(),
+                    activation_time=telemetry.activation_time.copy(),
+                    mean_activation_time=(
+                        telemetry.activation_time /
+                        np.maximum(telemetry.activations, 1)))
+
+    def compare_distribution(self):
+        '''Compare the empirical distribution of samples over sources with
+        `weights`.
+
+        Returns
+        -------
+        report : dict or None
+            None, if the mux is not instrumented.  Otherwise:
+
+            - `empirical`: the fraction of samples drawn from each source
+            - `expected`: the normalized `weights`
+            - `ratio`: `empirical / expected`, where `expected > 0`, and 0
+              elsewhere.  Values well below 1 indicate starved sources.
+            - `total_variation`: the total variation distance between
+              `empirical` and `expected`, in [0, 1]
+            - `n_samples`: the total number of samples counted
+        '''
+        if self.telemetry_ is None:
+            return None
+
+        samples = self.telemetry_.samples
+        n_samples = samples.sum()
+        empirical = samples / float(max(n_samples, 1))
+
+        ratio = np.zeros(self.n_streams)
+        positive = self.weights > 0
+        ratio[positive] = empirical[positive] / self.weights[positive]
+
+        return dict(empirical=empirical, expected=self.weights.copy(),
+                    ratio=ratio,
+                    total_variation=0.5 * np.abs(empirical -
+                                                 self.weights).sum(),
+                    n_samples=int(n_samples))
+
+    def _flush_counts(self, idx):
+        '''Add the samples drawn by an active stream to the telemetry.'''
+        if self.telemetry_ is not None:
+            self.telemetry_.samples[self.stream_idxs_[idx]] += (
+                self.stream_counts_[idx])
+            self.stream_counts_[idx] = 0
+
+    def _on_iterate_end(self):
+        if self.telemetry_ is not None and self.streams_ is not None:
+            for idx in range(self.n_active):
+                self._flush_counts(idx)
+
     def _streamers_available(self):
         return self.weight_norm_ > 0.0 and self.valid_streams_.any()
 
     def _next_sample_index(self):
         """StochasticMux chooses its next sample stream randomly"""
-        return self.rng.choice(self.n_active,
-                               p=(self.stream_weights_ /
-                                  self.weight_norm_))
+        return self._choice(self.stream_weights_, self.weight_norm_)
 
     def _on_stream_exhausted(self, idx):
         # If we're disabling empty seeds, see if this stream
@@ -724,6 +1001,11 @@ class StochasticMux(BaseMux):
             self.distribution_[self.stream_idxs_[idx]] = 0.0
             self.valid_streams_[self.stream_idxs_[idx]] = False
 
+            if self.telemetry_ is not None:
+                self.telemetry_.prunes[self.stream_idxs_[idx]] += 1
+
+        self._flush_counts(idx)
+
         # This is the same as
         #  if self.revive and not self.with_replacement in the original Mux
         if self.mode == "single_active":
@@ -751,12 +1033,15 @@ class StochasticMux(BaseMux):
         # Get the number of samples for this streamer.
         n_samples_to_stream = None
         if self.rate is not None:
-            n_samples_to_stream = 1 + self.rng.poisson(lam=self.rate)
+            n_samples_to_stream = 1 + self._poisson(self.rate)
 
         # instantiate a new streamer
         streamer = self.streamers[idx].iterate(max_iter=n_samples_to_stream)
         weight = self.weights[idx]
 
+        if self.telemetry_ is not None:
+            streamer = self.telemetry_.start(idx, streamer)
+
         # If we're sampling without replacement, zero this one out
         # This effectively disables this stream as soon as it is chosen,
         # preventing it from being chosen again (unless it is revived)
@@ -779,8 +1064,7 @@ class StochasticMux(BaseMux):
             The stream index to replace
         '''
         # Choose the stream index from the candidate pool
-        self.stream_idxs_[idx] = self.rng.choice(
-            self.n_streams, p=self.distribution_)
+        self.stream_idxs_[idx] = self._choice(self.distribution_)
 
         # Activate the Streamer, and get the weights
         self.streams_[idx], self.stream_weights_[idx] = self._activate_stream(
@@ -853,7 +1137,8 @@ class ShuffledMux(BaseMux):
 
             Must have the same length as ``streamers``.
 
-        random_state : None, int, or np.random.RandomState
+        random_state : None, int, np.random.RandomState,
+            np.random.Generator, or np.random.SeedSequence
             If int, random_state is the seed used by the random number
             generator;
 
@@ -918,9 +1203,7 @@ class ShuffledMux(BaseMux):
         """ShuffledMux chooses its next sample stream randomly,
         conditioned on the stream weights.
         """
-        return self.rng.choice(self.n_streams,
-                               p=(self.stream_weights_ /
-                                  self.weight_norm_))
+        return self._choice(self.stream_weights_, self.weight_norm_)
 
     def _on_stream_exhausted(self, idx):
         # See if this stream produced any data; if it didn't, turn it off
@@ -1001,7 +1284,8 @@ class RoundRobinMux(BaseMux):
                 Restart streamer once streams are exhausted, and permute
                 the order of the streams.
 
-        random_state : None, int, or `np.random.RandomState`
+        random_state : None, int, np.random.RandomState,
+            np.random.Generator, or np.random.SeedSequence
             If int, random_state is the seed used by the random number
             generator;
 
@@ -1160,8 +1444,16 @@ class ChainMux(BaseMux):
     >>> mux = pescador.ChainMux(gen_streamers(3, 5))
     >>> "".join(mux)
     "aaaaabbbbbccccc"
+
+
+    Open the next two streamers in the background while the current
+    one is being consumed.
+
+    >>> mux = pescador.ChainMux(gen_streamers(3, 5), lookahead=2)
+    >>> "".join(mux)
+    "aaaaabbbbbccccc"
     """
-    def __init__(self, streamers, mode="exhaustive",
+    def __init__(self, streamers, mode="exhaustive", lookahead=0,
                  random_state=None):
         """
         Parameters
@@ -1177,7 +1469,17 @@ class ChainMux(BaseMux):
                 `ChainMux will restart from the beginning after each
                 streamer has been run to exhaustion.
 
-        random_state : None, int, or np.random.RandomState
+        lookahead : int >= 0
+            The number of upcoming streamers to activate in background
+            threads while the current streamer is consumed.
+            Each of these has its first item buffered, so that switching
+            to the next streamer does not stall on (e.g.) opening a file.
+
+            If 0, each streamer is activated only once the previous one
+            has been exhausted.
+
+        random_state : None, int, np.random.RandomState,
+            np.random.Generator, or np.random.SeedSequence
             If int, random_state is the seed used by the random number
             generator;
 
@@ -1196,7 +1498,12 @@ class ChainMux(BaseMux):
         if mode not in ["exhaustive", "cycle"]:
             raise PescadorError("Invalid ChainMux mode '{}'".format(mode))
 
+        if not isinstance(lookahead, int) or lookahead < 0:
+            raise PescadorError("Invalid ChainMux lookahead={}".format(
+                lookahead))
+
         self.mode = mode
+        self.lookahead = lookahead
 
     def _activate(self):
         # Use a streamer to iterate over the input streamers.
@@ -1208,9 +1515,11 @@ class ChainMux(BaseMux):
         # getting the first stream.
         self.stream_generator_ = self.chain_streamer_.iterate()
 
-        # Chainmux only ever has one active streamer.
+        # Chainmux only ever has one active streamer, but may be
+        # activating `lookahead` more in the background.
         self.streams_ = [None]
         self.stream_counts_ = np.zeros(1, dtype=int)
+        self.pending_ = collections.deque()
 
         # Initialize the active stream.
         # Setup a new streamer at this index.
@@ -1221,12 +1530,13 @@ class ChainMux(BaseMux):
         self.chain_generator_ = None
         self.streams_ = None
         self.stream_counts_ = None
+        self.pending_ = None
 
     def _streamers_available(self):
         """As we are treating `streamers` as a generator, we can only know
-        if it is available if the streamer exited or not.
+        if it is available once we have failed to get the next stream.
         """
-        return self.chain_streamer_.active
+        return self.streams_[0] is not None
 
     def _next_sample_index(self):
         """There is only one streamer to choose from; always 0"""
@@ -1244,20 +1554,22 @@ class ChainMux(BaseMux):
         """
         self._new_stream()
 
-    def _new_stream(self):
-        '''Grab the next stream from the input streamers, and start it.
+    def _next_streamer(self):
+        '''Advance to the next streamer in the chain.
+
+        Returns
+        -------
+        streamer : pescador.Streamer or None
+            The next streamer, or None if the chain is complete.
 
         Raises
         ------
         StopIteration
-            When the input list or generator of streamers is complete,
-            will raise a StopIteration. If `mode == cycle`, it
-            will instead restart iterating from the beginning of the sequence.
+            If `mode == cycle` and the chain contains no streamers.
         '''
         try:
             # Advance the stream_generator_ to get the next available stream.
-            # If successful, this will make self.chain_streamer_.active True
-            next_stream = six.advance_iterator(self.stream_generator_)
+            return six.advance_iterator(self.stream_generator_)
 
         except StopIteration:
             # If running with cycle, restart the chain_streamer_ after
@@ -1268,20 +1580,87 @@ class ChainMux(BaseMux):
                 # Try again to get the next stream;
                 # if it fails this time, just let it raise the StopIteration;
                 # this means the streams are probably dead or empty.
-                next_stream = six.advance_iterator(self.stream_generator_)
+                return six.advance_iterator(self.stream_generator_)
 
-            # If running in exhaustive mode
-            else:
-                # self.chain_streamer_ should no longer be active, so
-                # the outer loop should fall out without running.
-                next_stream = None
+            # If running in exhaustive mode, the chain is done.
+            return None
+
+    def _new_stream(self):
+        '''Grab the next stream from the input streamers, and start it.
+
+        If `lookahead > 0`, the next stream is taken from the queue of
+        streams being activated in the background, and the queue is
+        refilled in chain order.
+
+        Raises
+        ------
+        StopIteration
+            If `mode == cycle` and the chain contains no streamers.
+        '''
+        if self.lookahead:
+            # Keep `lookahead` streams warming up behind the one we take.
+            while len(self.pending_) <= self.lookahead:
+                next_stream = self._next_streamer()
+                if next_stream is None:
+                    break
+                self.pending_.append(_PrefetchedStream(next_stream))
+
+            next_stream = self.pending_.popleft() if self.pending_ else None
+
+        else:
+            next_stream = self._next_streamer()
 
         if next_stream is not None:
-            # Start that stream, and return it.
-            streamer = next_stream.iterate()
+            # Start that stream, and make it the active stream.
+            self.streams_[0] = next_stream.iterate()
+        else:
+            # Nothing left: the outer loop should fall out.
+            self.streams_[0] = None
+
+        # Reset the sample count to zero
+        self.stream_counts_[0] = 0
+
+
+class _PrefetchedStream(object):
+    '''Activate a streamer in a background thread, and buffer its
+    first item.
+
+    Parameters
+    ----------
+    streamer : pescador.Streamer
+        The streamer to activate
+    '''
+    def __init__(self, streamer):
+        self.stream = None
+        self.first = None
+        self.empty = False
+        self.error = None
+
+        self.thread = threading.Thread(target=self._activate,
+                                       args=(streamer,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _activate(self, streamer):
+        try:
+            self.stream = streamer.iterate()
+            self.first = six.advance_iterator(self.stream)
+        except StopIteration:
+            self.empty = True
+        except Exception:
+            # Hand the exception to the consuming thread
+            self.error = sys.exc_info()
+
+    def iterate(self):
+        '''Wait for activation to finish, then yield from the stream.'''
+        self.thread.join()
+
+        if self.error is not None:
+            six.reraise(*self.error)
 
-            # Activate the Streamer
-            self.streams_[0] = streamer
+        if self.empty:
+            return
 
-            # Reset the sample count to zero
-            self.stream_counts_[0] = 0
+        yield self.first
+        for item in self.stream:
+            yield item
@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+'''
+Tracing
+-------
+
+Record a timeline of pipeline activity, in the Chrome trace event format.
+Traces can be viewed with ``chrome://tracing`` or https://ui.perfetto.dev.
+
+While tracing is enabled, the following spans are recorded, by category:
+
+- `activate`: activation of a streamer or mux
+- `producer`: production of an item by a streamer, named after the
+  streamer
+- `consumer`: the time between a streamer producing an item and the
+  consumer requesting the next one
+- `batch`: batch assembly in `maps.buffer_stream`
+- `zmq`: transfer of items between `ZMQStreamer` workers and the
+  consumer (`zmq_send` and `zmq_recv`)
+
+Spans from `ZMQStreamer` worker processes are collected into the same
+trace.  To keep the overhead low, producer, consumer and ZMQ spans can
+be sampled, and events are buffered in memory and written in blocks.
+When tracing is disabled, none of this costs anything per item.
+
+.. autosummary::
+    :toctree: generated/
+
+    trace
+    start_trace
+    stop_trace
+    span
+'''
+import contextlib
+import glob
+import json
+import os
+import threading
+import time
+
+from .exceptions import PescadorError
+
+__all__ = ['trace', 'start_trace', 'stop_trace', 'span']
+
+# The active tracer, if any
+_TRACER = None
+
+
+def _now():
+    '''The current time in microseconds, comparable across processes.'''
+    return time.time() * 1e6
+
+
+class _Tracer(object):
+    '''Buffered trace events for one trace, in one process.'''
+    def __init__(self, path, sample_rate, buffer_size, process_name):
+        self.path = os.path.abspath(path)
+        self.period = max(1, int(round(1. / sample_rate)))
+        self.buffer_size = buffer_size
+        self.process_name = process_name
+        self.lock = threading.Lock()
+        self.events = []
+        self.pid = os.getpid()
+        self.wrote_metadata = False
+
+    def part_path(self):
+        return '{}.{}.part'.format(self.path, self.pid)
+
+    def after_fork(self, process_name):
+        '''Start a new buffer in a forked process.'''
+        self.events = []
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.process_name = process_name
+        self.wrote_metadata = False
+
+    def record(self, name, cat, start, end, args=None):
+        event = dict(name=name, cat=cat, ph='X', ts=start, dur=end - start,
+                     pid=self.pid, tid=threading.current_thread().ident)
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+        if len(self.events) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        '''Append buffered events to this process's part file.'''
+        with self.lock:
+            events, self.events = self.events, []
+            if not self.wrote_metadata:
+                events.append(self.metadata())
+                self.wrote_metadata = True
+
+            if not events:
+                return
+
+            with open(self.part_path(), 'a') as fdesc:
+                for event in events:
+                    fdesc.write(json.dumps(event))
+                    fdesc.write('\n')
+
+    def metadata(self):
+        return dict(name='process_name', ph='M', pid=self.pid,
+                    args=dict(name=self.process_name))
+
+    def merge(self):
+        '''Write all part files into the trace file, and remove them.'''
+        self.flush()
+
+        events = []
+        for part in sorted(glob.glob('{}.*.part'.format(self.path))):
+            with open(part, 'r') as fdesc:
+                events.extend(json.loads(line) for line in fdesc if line)
+            os.remove(part)
+
+        with open(self.path, 'w') as fdesc:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), fdesc)
+
+    def wrap(self, stream, name):
+        '''Record producer and consumer spans for a stream.'''
+        period = self.period
+        try:
+            n = 0
+            while True:
+                n += 1
+                if n % period:
+                    yield next(stream)
+                    continue
+
+                start = _now()
+                obj = next(stream)
+                produced = _now()
+                self.record(name, 'producer', start, produced)
+                yield obj
+                self.record(name, 'consumer', produced, _now())
+
+        except StopIteration:
+            return
+
+        finally:
+            stream.close()
+
+
+def _describe(streamer):
+    '''A readable name for a streamer.'''
+    name = type(streamer).__name__
+    inner = getattr(streamer, 'streamer', None)
+    if callable(inner) and hasattr(inner, '__name__'):
+        name = '{}({})'.format(name, inner.__name__)
+    return name
+
+
+def _after_fork(process_name='worker'):
+    '''Start a new buffer in a forked process, e.g., a worker.'''
+    if _TRACER is None:
+        return
+
+    if _TRACER.pid != os.getpid():
+        _TRACER.after_fork(process_name)
+    else:
+        _TRACER.process_name = process_name
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _flush():
+    '''Flush this process's events, e.g., before a worker exits.'''
+    if _TRACER is not None:
+        _TRACER.flush()
+
+
+def start_trace(path, sample_rate=1.0, buffer_size=65536):
+    '''Start recording a trace.
+
+    Parameters
+    ----------
+    path : str
+        The file to write the trace to, when `stop_trace` is called.
+
+    sample_rate : float in (0, 1]
+        The fraction of items for which to record producer, consumer and
+        ZMQ spans.  Activation and batch assembly spans are always recorded.
+
+    buffer_size : int > 0
+        The number of events to hold in memory, per process, before writing
+        them to disk.
+
+    Raises
+    ------
+    PescadorError
+        If a trace is already being recorded, or the parameters are invalid.
+
+    See Also
+    --------
+    trace
+    '''
+    global _TRACER
+
+    if _TRACER is not None:
+        raise PescadorError('A trace is already being recorded '
+                            'to {}'.format(_TRACER.path))
+
+    if not 0 < sample_rate <= 1:
+        raise PescadorError('sample_rate={} must be in '
+                            '(0, 1]'.format(sample_rate))
+
+    if buffer_size < 1:
+        raise PescadorError('buffer_size={} must be '
+                            'positive'.format(buffer_size))
+
+    _TRACER = _Tracer(path, sample_rate, buffer_size, 'main')
+
+
+def stop_trace():
+    '''Stop recording, and write the trace file.
+
+    Worker processes must have finished (e.g., by exhausting or closing
+    their `ZMQStreamer` iterators) for their events to be included.
+
+    Returns
+    -------
+    path : str or None
+        The path of the trace file, or None if no trace was being recorded.
+    '''
+    global _TRACER
+
+    tracer, _TRACER = _TRACER, None
+    if tracer is None:
+        return None
+
+    tracer.merge()
+    return tracer.path
+
+
+@contextlib.contextmanager
+def trace(path, sample_rate=1.0, buffer_size=65536):
+    '''Record a trace of pipeline activity within a context.
+
+    Parameters
+    ----------
+    path : str
+    sample_rate : float in (0, 1]
+    buffer_size : int > 0
+        See `start_trace`.
+
+    Examples
+    --------
+    >>> with pescador.trace('pipeline.json', sample_rate=0.1):
+    ...     for batch in pescador.maps.buffer_stream(zmq_stream, 32):
+    ...         with pescador.span('train'):
+    ...             model.train(batch)
+    '''
+    start_trace(path, sample_rate=sample_rate, buffer_size=buffer_size)
+    try:
+        yield
+    finally:
+        stop_trace()
+
+
+@contextlib.contextmanager
+def span(name, cat='user', **args):
+    '''Record a span of user code, e.g., a training step, if tracing.
+
+    Parameters
+    ----------
+    name : str
+        The name of the span.
+
+    cat : str
+        The category of the span.
+
+    args
+        Additional values to attach to the span.
+    '''
+    tracer = _TRACER
+    if tracer is None:
+        yield
+        return
+
+    start = _now()
+    try:
+        yield
+    finally:
+        tracer.record(name, cat, start, _now(), args)
@@ -1,9 +1,11 @@
 #!/usr/bin/env python
 # -*- encoding: utf-8 -*-
-'''Deprecation utilities'''
+'''Utility functions: deprecation, data inspection and random state'''
 
 from decorator import decorator
 import inspect
+import sys
+import numpy as np
 import six
 import warnings
 
@@ -148,3 +150,156 @@ def batch_length(batch):
             raise PescadorError('Unequal field lengths')
 
     return n
+
+
+def item_nbytes(item):
+    '''Estimate the memory held by an item.
+
+    Parameters
+    ----------
+    item : object
+        A data object, e.g. {key: np.ndarray}, an np.ndarray, or
+        any other python object.
+
+    Returns
+    -------
+    nbytes : int
+        The total `nbytes` of any arrays, or `sys.getsizeof` for
+        other objects.
+    '''
+    if isinstance(item, np.ndarray):
+        return item.nbytes
+
+    if isinstance(item, dict):
+        return sum(item_nbytes(value) for value in six.itervalues(item))
+
+    return sys.getsizeof(item)
+
+
+def get_rng(random_state):
+    '''Construct a random number generator from a `random_state` argument.
+
+    Parameters
+    ----------
+    random_state : None, int, np.random.RandomState, np.random.Generator,
+        or np.random.SeedSequence
+        If None, the global `np.random` module is used.
+
+        If int, a `np.random.RandomState` seeded by `random_state`.
+
+        If `RandomState` or `Generator`, it is used directly.
+
+        If `SeedSequence`, a new `Generator` is constructed from it.
+
+    Returns
+    -------
+    rng : np.random, np.random.RandomState, or np.random.Generator
+
+    Raises
+    ------
+    PescadorError
+        If `random_state` is not one of the supported types.
+    '''
+    if random_state is None:
+        return np.random
+    elif isinstance(random_state, int):
+        return np.random.RandomState(seed=random_state)
+    elif isinstance(random_state, np.random.RandomState):
+        return random_state
+    elif is_generator(random_state):
+        return random_state
+    elif (hasattr(np.random, 'SeedSequence') and
+          isinstance(random_state, np.random.SeedSequence)):
+        return np.random.default_rng(random_state)
+
+    raise PescadorError('Invalid random_state={}'.format(random_state))
+
+
+def is_generator(rng):
+    '''Test whether `rng` is a `np.random.Generator`.
+
+    Generators support the batched sampling methods used by the muxes;
+    the legacy `RandomState` (and `np.random` module) do not.
+
+    Parameters
+    ----------
+    rng : object
+
+    Returns
+    -------
+    bool
+        False if `np.random.Generator` is unavailable in this version of numpy.
+    '''
+    return (hasattr(np.random, 'Generator') and
+            isinstance(rng, np.random.Generator))
+
+
+def _randint(rng, high, size=None):
+    '''Draw integers uniformly from [0, high) with any supported rng.'''
+    if is_generator(rng):
+        return rng.integers(high, size=size)
+    return rng.randint(high, size=size)
+
+
+class _SharedRNG(object):
+    '''A random number generator shared by a streamer and all of its copies.
+
+    Streamers are copied each time they are activated.  Sharing the
+    generator lets every activation continue the random stream, instead of
+    replaying it from the initial `random_state`.
+
+    Parameters
+    ----------
+    random_state
+        See `get_rng`.
+    '''
+    def __init__(self, random_state):
+        self.rng = get_rng(random_state)
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def spawn_seeds(random_state, n):
+    '''Spawn `n` independent, reproducible child seeds.
+
+    This is useful for giving each worker process or data-parallel rank its
+    own random stream:
+
+    >>> seeds = pescador.util.spawn_seeds(20180129, world_size)
+    >>> mux = pescador.StochasticMux(streamers, 4, rate=16,
+    ...                              random_state=seeds[rank])
+
+    Parameters
+    ----------
+    random_state : None, int, np.random.SeedSequence, or np.random.Generator
+        The parent seed.
+        If None, fresh entropy is drawn from the operating system.
+        If a `Generator`, the parent seed is drawn from it, which
+        advances its state.
+
+    n : int >= 0
+        The number of child seeds to produce
+
+    Returns
+    -------
+    seeds : list of np.random.SeedSequence
+
+    Raises
+    ------
+    PescadorError
+        If `random_state` is not one of the supported types, or
+        `np.random.SeedSequence` is unavailable.
+    '''
+    if not hasattr(np.random, 'SeedSequence'):
+        raise PescadorError('spawn_seeds requires numpy >= 1.17')
+
+    if is_generator(random_state):
+        random_state = int(random_state.integers(2**63))
+
+    if random_state is None or isinstance(random_state, (int, np.integer)):
+        random_state = np.random.SeedSequence(random_state)
+    elif not isinstance(random_state, np.random.SeedSequence):
+        raise PescadorError('Invalid random_state={}'.format(random_state))
+
+    return random_state.spawn(n)
@@ -13,11 +13,14 @@ The `ZMQStreamer` object wraps ordinary streamers (or muxes) for background exec
 
 '''
 
+import collections
+import functools
 import multiprocessing as mp
 import zmq
 import numpy as np
 import six
 import sys
+import time
 import warnings
 
 try:
@@ -32,8 +35,11 @@ except ImportError:
     # joblib >= 0.10.0
     from joblib._parallel_backends import SafeFunction
 
-from .core import Streamer
-from .exceptions import DataError
+from .core import Streamer, _timer
+from .exceptions import DataError, PescadorError
+from . import memory
+from . import tracing
+from . import util
 
 
 __all__ = ['ZMQStreamer']
@@ -93,17 +99,98 @@ def zmq_recv_data(socket, flags=0, copy=True, track=False):
     return data
 
 
-def zmq_worker(port, streamer, terminate, copy=False, max_iter=None):
+# Indices into the shared array of worker counters
+_SENT, _SEND_BLOCKS, _SEND_BLOCK_TIME, _WORKER_TIME = range(4)
+
+# Indices into the shared array of queue totals
+_QUEUED_ITEMS, _QUEUED_BYTES, _DEQUEUED_ITEMS, _DEQUEUED_BYTES = range(4)
+
+# Seconds between checks of the queue size, while waiting for it to drain
+_DRAIN_INTERVAL = 1e-3
+
+
+def _wait_for_room(queue, nbytes, max_bytes, terminate):
+    '''Wait until an item of `nbytes` fits in the queue.
+
+    An item is always sent to an empty queue, even if it is larger than
+    `max_bytes`.
+
+    Returns
+    -------
+    blocked : bool
+        Whether the worker had to wait.
+    '''
+    blocked = False
+    while not terminate.is_set():
+        held = queue[_QUEUED_BYTES] - queue[_DEQUEUED_BYTES]
+        if held <= 0 or held + nbytes <= max_bytes:
+            break
+        blocked = True
+        time.sleep(_DRAIN_INTERVAL)
+    return blocked
+
+
+def _send_monitored(socket, data, copy, counters, start):
+    '''Send data, counting the sends which block on the high-water mark.'''
+    try:
+        zmq_send_data(socket, data, flags=zmq.NOBLOCK, copy=copy)
+    except zmq.Again:
+        counters[_SEND_BLOCKS] += 1
+        blocked = _timer()
+        zmq_send_data(socket, data, copy=copy)
+        counters[_SEND_BLOCK_TIME] += _timer() - blocked
+
+    counters[_SENT] += 1
+    counters[_WORKER_TIME] = _timer() - start
+
+
+def zmq_worker(port, streamer, terminate, copy=False, max_iter=None,
+               random_state=None, counters=None, queue=None, max_bytes=None):
+
+    if random_state is not None:
+        # Forked workers inherit the parent's global random state,
+        # so give this process its own.
+        np.random.seed(random_state.generate_state(1)[0])
+        if hasattr(streamer, 'reseed'):
+            streamer.reseed(random_state)
+
+    tracing._after_fork('zmq_worker')
+    tracer = tracing._TRACER
 
     context = zmq.Context()
     socket = context.socket(zmq.PAIR)
     # TODO: Open this up to support different hosts.
     socket.connect('tcp://localhost:{:d}'.format(port))
 
+    worker_start = _timer()
+
     try:
         # Build the stream
-        for data in streamer(max_iter=max_iter):
-            zmq_send_data(socket, data, copy=copy)
+        for n, data in enumerate(streamer(max_iter=max_iter)):
+            if queue is not None and max_bytes is not None:
+                nbytes = util.item_nbytes(data)
+
+                blocked = _timer()
+                if (_wait_for_room(queue, nbytes, max_bytes, terminate)
+                        and counters is not None):
+                    # Waiting for the consumer counts as a blocked send
+                    counters[_SEND_BLOCKS] += 1
+                    counters[_SEND_BLOCK_TIME] += _timer() - blocked
+
+                queue[_QUEUED_ITEMS] += 1
+                queue[_QUEUED_BYTES] += nbytes
+
+            if tracer is not None and n % tracer.period == 0:
+                start = tracing._now()
+
+            if counters is not None:
+                _send_monitored(socket, data, copy, counters, worker_start)
+            else:
+                zmq_send_data(socket, data, copy=copy)
+
+            if tracer is not None and n % tracer.period == 0:
+                tracer.record('zmq_send', 'zmq', start, tracing._now())
+
             if terminate.is_set():
                 break
 
@@ -111,6 +198,140 @@ def zmq_worker(port, streamer, terminate, copy=False, max_iter=None):
         # send an empty payload to kill
         zmq_send_data(socket, {})
         context.destroy()
+        tracing._flush()
+
+
+def _queue_usage(queue):
+    '''Report the items in a ZMQStreamer's queue to
+    `pescador.memory_usage`.'''
+    return dict(bytes=int(queue[_QUEUED_BYTES] - queue[_DEQUEUED_BYTES]),
+                items=int(queue[_QUEUED_ITEMS] - queue[_DEQUEUED_ITEMS]))
+
+
+class _StallMonitor(object):
+    '''Counters of blocking on either side of a ZMQStreamer's queue.
+
+    The same object is shared by a streamer and all of its copies.
+    '''
+    # The number of queue depth samples to keep
+    history_size = 1024
+
+    # Record the queue depth every this many items
+    depth_interval = 16
+
+    def __init__(self):
+        self.received = 0
+        self.recv_blocks = 0
+        self.recv_block_time = 0.0
+        self.consumer_time = 0.0
+
+        self.sent = 0
+        self.send_blocks = 0
+        self.send_block_time = 0.0
+        self.producer_time = 0.0
+
+        self.max_depth = 0
+        self.depth_sum = 0
+        self.depth_count = 0
+        self.depth_history = collections.deque(maxlen=self.history_size)
+
+        self.counters_ = None
+        self.start_ = None
+        self.n_received_ = 0
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def begin(self):
+        '''Start monitoring an iteration, and return the shared worker
+        counters.'''
+        self.counters_ = mp.Array('d', 4, lock=False)
+        self.start_ = _timer()
+        self.n_received_ = 0
+        return self.counters_
+
+    def end(self):
+        '''Fold the counters of a finished iteration into the totals.'''
+        if self.counters_ is None:
+            return
+
+        counters = self.counters_
+        self.sent += int(counters[_SENT])
+        self.send_blocks += int(counters[_SEND_BLOCKS])
+        self.send_block_time += counters[_SEND_BLOCK_TIME]
+        self.producer_time += counters[_WORKER_TIME]
+        self.consumer_time += _timer() - self.start_
+        self.counters_ = None
+
+    def recv(self, socket):
+        '''Receive data, counting the receives which block.'''
+        if socket.poll(0, zmq.POLLIN):
+            data = zmq_recv_data(socket)
+        else:
+            self.recv_blocks += 1
+            blocked = _timer()
+            data = zmq_recv_data(socket)
+            self.recv_block_time += _timer() - blocked
+
+        self.received += 1
+        self.n_received_ += 1
+
+        if self.n_received_ % self.depth_interval == 0:
+            # Messages sent but not yet received
+            depth = max(0, int(self.counters_[_SENT]) - self.n_received_)
+            self.max_depth = max(self.max_depth, depth)
+            self.depth_sum += depth
+            self.depth_count += 1
+            self.depth_history.append((time.time(), depth))
+
+        return data
+
+    def report(self, threshold):
+        sent, send_blocks = self.sent, self.send_blocks
+        send_block_time, producer_time = (self.send_block_time,
+                                          self.producer_time)
+        consumer_time = self.consumer_time
+
+        # Include an iteration in progress
+        if self.counters_ is not None:
+            sent += int(self.counters_[_SENT])
+            send_blocks += int(self.counters_[_SEND_BLOCKS])
+            send_block_time += self.counters_[_SEND_BLOCK_TIME]
+            producer_time += self.counters_[_WORKER_TIME]
+            consumer_time += _timer() - self.start_
+
+        consumer_wait = (self.recv_block_time / consumer_time
+                         if consumer_time else 0.0)
+        producer_wait = (send_block_time / producer_time
+                         if producer_time else 0.0)
+
+        if consumer_wait >= threshold and consumer_wait >= producer_wait:
+            verdict = 'producer-bound'
+            summary = ('producer-bound: the consumer waited for data {:.0%} '
+                       'of the time; add workers or speed up the '
+                       'streamer'.format(consumer_wait))
+        elif producer_wait >= threshold:
+            verdict = 'consumer-bound'
+            summary = ('consumer-bound: the worker waited for the consumer '
+                       '{:.0%} of the time; speed up the '
+                       'consumer'.format(producer_wait))
+        else:
+            verdict = 'balanced'
+            summary = ('balanced: the consumer waited {:.0%} and the worker '
+                       '{:.0%} of the time'.format(consumer_wait,
+                                                   producer_wait))
+
+        return dict(verdict=verdict, summary=summary,
+                    received=self.received, recv_blocks=self.recv_blocks,
+                    recv_block_time=self.recv_block_time,
+                    consumer_time=consumer_time, consumer_wait=consumer_wait,
+                    sent=sent, send_blocks=send_blocks,
+                    send_block_time=send_block_time,
+                    producer_time=producer_time, producer_wait=producer_wait,
+                    max_depth=self.max_depth,
+                    mean_depth=(self.depth_sum / float(self.depth_count)
+                                if self.depth_count else 0.0),
+                    depth_history=list(self.depth_history))
 
 
 class ZMQStreamer(Streamer):
@@ -133,11 +354,32 @@ class ZMQStreamer(Streamer):
     >>> # Process as normal
     >>> for data in Z:
     ...     MY_FUNCTION(data)
+
+    Each pass over a `ZMQStreamer` runs in a new worker process, so items
+    cached in memory by the worker are lost between passes.  To decode
+    items once per host, wrap the sources in `CachedStreamer` with a
+    `SharedCache`:
+
+    >>> cache = pescador.SharedCache(max_bytes=2**30)
+    >>> S = pescador.CachedStreamer(pescador.Streamer(my_generator),
+    ...                             cache=cache)
+    >>> Z = pescador.ZMQStreamer(S)
+
+    To find out whether the worker or the consumer is the bottleneck,
+    instrument the streamer and check its stall report:
+
+    >>> Z = pescador.ZMQStreamer(S).instrument()
+    >>> for data in Z.iterate(max_iter=10000):
+    ...     MY_FUNCTION(data)
+    >>> print(Z.stall_report()['summary'])
     """
 
+    # Stalls are monitored only if `instrument` is called
+    stall_ = None
+
     def __init__(self, streamer,
                  min_port=49152, max_port=65535, max_tries=100,
-                 copy=False, timeout=5):
+                 copy=False, timeout=5, random_state=None, max_bytes=None):
         '''
         Parameters
         ----------
@@ -158,15 +400,103 @@ class ZMQStreamer(Streamer):
             Maximum time (in seconds) to wait before killing subprocesses.
             If `None`, then the streamer will wait indefinitely for
             subprocesses to terminate.
+
+        random_state : None, int, np.random.SeedSequence, or
+            np.random.Generator
+            If provided, each call to `iterate` spawns a new child seed
+            (see `pescador.util.spawn_seeds`) for the worker process.
+            The worker seeds the global `np.random` state and calls
+            `streamer.reseed` (e.g., for muxes) with it, so that
+            every epoch is independent but reproducible.
+
+            If None, the worker inherits the random state of this process.
+
+        max_bytes : int > 0 or None
+            If provided, the worker waits to send an item while the items
+            it has sent but the consumer has not yet received hold more
+            than this many bytes (see `pescador.util.item_nbytes`).
+
+            The queued bytes are then reported by `pescador.memory_usage`.
+            If None, items are not sized, and the queue is not reported.
+
+        Raises
+        ------
+        PescadorError
+            If `max_bytes` is not positive.
         '''
+        if max_bytes is not None and max_bytes <= 0:
+            raise PescadorError('max_bytes={} must be a positive '
+                                'number'.format(max_bytes))
+
         self.streamer = streamer
         self.min_port = min_port
         self.max_port = max_port
         self.max_tries = max_tries
         self.copy = copy
         self.timeout = timeout
+        self.max_bytes = max_bytes
+
+        self.seed_sequence = None
+        if random_state is not None:
+            self.seed_sequence = util.spawn_seeds(random_state, 1)[0]
+
+    def instrument(self, enabled=True):
+        '''Enable or disable the collection of statistics.
+
+        In addition to the statistics collected by `Streamer.instrument`,
+        this monitors how often each side of the queue blocks, which is
+        summarized by `stall_report`.
+
+        Parameters
+        ----------
+        enabled : bool
+            If True, collect statistics from now on.
+            If False, stop collecting statistics and discard them.
+
+        Returns
+        -------
+        self : ZMQStreamer
+        '''
+        super(ZMQStreamer, self).instrument(enabled)
+        self.stall_ = _StallMonitor() if enabled else None
+        return self
+
+    def stall_report(self, threshold=0.2):
+        '''Summarize blocking between the worker and the consumer.
 
-    def iterate(self, max_iter=None):
+        Parameters
+        ----------
+        threshold : float in [0, 1]
+            The fraction of time spent waiting above which a side is
+            considered stalled.
+
+        Returns
+        -------
+        report : dict or None
+            None, if the streamer is not instrumented.  Otherwise:
+
+            - `verdict`: `'producer-bound'` if the consumer mostly waits for
+              data, `'consumer-bound'` if the worker mostly waits for the
+              consumer to make room in the queue, or `'balanced'`
+            - `summary`: a one-line description of the verdict
+            - `received`, `recv_blocks`, `recv_block_time`: items received,
+              receives which had to wait, and seconds spent waiting
+            - `consumer_time`, `consumer_wait`: seconds spent iterating,
+              and the fraction spent waiting
+            - `sent`, `send_blocks`, `send_block_time`: items sent by
+              workers, sends which blocked on the high-water mark, and
+              seconds spent blocked
+            - `producer_time`, `producer_wait`: seconds of worker activity,
+              and the fraction spent blocked
+            - `max_depth`, `mean_depth`: statistics of the number of items
+              in the queue, sampled periodically
+            - `depth_history`: recent ``(timestamp, depth)`` samples
+        '''
+        if self.stall_ is None:
+            return None
+        return self.stall_.report(threshold)
+
+    def _iterate(self, max_iter=None):
         """
         Note: A ZMQStreamer does not activate its stream,
         but allows the zmq_worker to do that.
@@ -191,17 +521,57 @@ class ZMQStreamer(Streamer):
                                               max_tries=self.max_tries)
             terminate = mp.Event()
 
+            seed = None
+            if self.seed_sequence is not None:
+                seed = self.seed_sequence.spawn(1)[0]
+
+            monitor = self.stall_
+            counters = None
+            if monitor is not None:
+                counters = monitor.begin()
+
+            # Totals of items sent and received, for the byte limit.
+            # Sizing every item has a cost, so only do it if limited.
+            queue = gauge = None
+            if self.max_bytes is not None:
+                queue = mp.Array('d', 4, lock=False)
+                gauge = memory._register(
+                    'ZMQStreamer', functools.partial(_queue_usage, queue),
+                    max_bytes=self.max_bytes)
+
             worker = mp.Process(target=SafeFunction(zmq_worker),
                                 args=[port, self.streamer, terminate],
                                 kwargs=dict(copy=self.copy,
-                                            max_iter=max_iter))
+                                            max_iter=max_iter,
+                                            random_state=seed,
+                                            counters=counters,
+                                            queue=queue,
+                                            max_bytes=self.max_bytes))
 
             worker.daemon = True
             worker.start()
 
             # Yield from the queue as long as it's open
+            tracer = tracing._TRACER
+            n = 0
             while True:
-                yield zmq_recv_data(socket)
+                if tracer is not None and n % tracer.period == 0:
+                    start = tracing._now()
+
+                if monitor is not None:
+                    data = monitor.recv(socket)
+                else:
+                    data = zmq_recv_data(socket)
+
+                if tracer is not None and n % tracer.period == 0:
+                    tracer.record('zmq_recv', 'zmq', start, tracing._now())
+
+                if queue is not None:
+                    queue[_DEQUEUED_ITEMS] += 1
+                    queue[_DEQUEUED_BYTES] += util.item_nbytes(data)
+
+                n += 1
+                yield data
 
         except StopIteration:
             pass
@@ -216,3 +586,8 @@ class ZMQStreamer(Streamer):
             if worker.is_alive():
                 worker.terminate()
             context.destroy()
+            if gauge is not None:
+                memory._unregister(gauge)
+
+            if monitor is not None:
+                monitor.end()
@@ -0,0 +1,54 @@
+import pytest
+
+import json
+
+import pescador.bench
+
+
+def _results(**rates):
+    return dict(revision='abc', fingerprint='f00',
+                results={key: dict(items_per_second=sorted(r)[len(r) // 2],
+                                   rates=r)
+                         for key, r in rates.items()})
+
+
+def test_compare():
+    base = _results(a=[100, 101, 99], b=[100, 120, 80], c=[100, 100, 100],
+                    d=[100, 101, 102], gone=[1, 1, 1])
+    new = _results(a=[70, 71, 72], b=[70, 85, 60], c=[130, 131, 129],
+                   d=[95, 96, 97], added=[1, 1, 1])
+
+    rows = pescador.bench.compare(base, new, threshold=0.1)
+    rows = {row['id']: row for row in rows}
+    assert rows['a']['status'] == 'slower'
+    assert rows['a']['ratio'] == pytest.approx(71. / 100)
+
+    # Slower, but within the noise between repeats
+    assert rows['b']['status'] == 'same'
+    assert rows['c']['status'] == 'faster'
+
+    # Slower, but below the threshold
+    assert rows['d']['status'] == 'same'
+    assert rows['gone']['status'] == 'removed'
+    assert rows['added']['status'] == 'added'
+
+
+@pytest.mark.parametrize('new_rates, status',
+                         [([100, 99, 101], 0), ([50, 49, 51], 1)])
+def test_compare_cli(tmpdir, new_rates, status):
+    base = str(tmpdir.join('base.json'))
+    new = str(tmpdir.join('new.json'))
+    with open(base, 'w') as fdesc:
+        json.dump(_results(a=[100, 99, 101]), fdesc)
+    with open(new, 'w') as fdesc:
+        json.dump(_results(a=new_rates), fdesc)
+
+    assert pescador.bench.main(['compare', base, new]) == status
+
+
+def test_fingerprint():
+    info = pescador.bench.machine()
+    assert pescador.bench.fingerprint(info) == pescador.bench.fingerprint()
+
+    info['cpu_count'] = -1
+    assert pescador.bench.fingerprint(info) != pescador.bench.fingerprint()
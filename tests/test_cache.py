@@ -0,0 +1,519 @@
+import pytest
+
+import copy
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+import numpy as np
+
+import pescador
+import pescador.cache
+import test_utils as T
+
+
+class _Calls(list):
+    '''A list which survives the deep copies made by streamer activation.'''
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _counting_generator(n, calls, size=2):
+    '''Like T.finite_generator, but counts how many items are decoded.'''
+    for i in range(n):
+        calls.append(i)
+        yield {'X': np.tile(np.array([[i]]), (size, 1))}
+
+
+def test_cache_lru():
+    item = {'X': np.zeros(10, dtype=np.uint8)}
+    cache = pescador.StreamCache(max_bytes=30)
+
+    for i in range(3):
+        cache.put(i, item)
+    assert len(cache) == 3
+    assert cache.nbytes == 30
+
+    # Touch 0, so that 1 is evicted next
+    assert cache.get(0) is item
+    cache.put(3, item)
+    assert cache.nbytes == 30
+    assert cache.get(1) is None
+    assert cache.get(0) is item
+    assert cache.get(3) is item
+    assert cache.hits == 3
+    assert cache.misses == 1
+
+    # Too large to cache at all
+    cache.put(4, {'X': np.zeros(31, dtype=np.uint8)})
+    assert cache.get(4, 'missing') == 'missing'
+    assert cache.nbytes <= 30
+
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+@pytest.mark.parametrize('max_bytes', [0, -1])
+def test_cache_bad_size(max_bytes):
+    with pytest.raises(pescador.PescadorError):
+        pescador.StreamCache(max_bytes=max_bytes)
+
+
+def test_cached_streamer_replay():
+    calls = _Calls()
+    stream = pescador.Streamer(_counting_generator, 10, calls)
+    cached = pescador.CachedStreamer(stream)
+    reference = list(stream)
+    del calls[:]
+
+    assert not cached.cached
+    assert T._eq_list_of_dicts(reference, list(cached))
+    assert cached.cached
+    assert len(calls) == 10
+
+    # Subsequent passes are served from memory
+    for _ in range(3):
+        assert T._eq_list_of_dicts(reference, list(cached))
+    assert len(calls) == 10
+
+    # Cycling works across passes
+    assert T._eq_list_of_dicts(reference * 2, list(cached.cycle(max_iter=20)))
+    assert len(calls) == 10
+
+
+def test_cached_streamer_partial():
+    calls = _Calls()
+    cached = pescador.CachedStreamer(
+        pescador.Streamer(_counting_generator, 10, calls))
+
+    # An incomplete pass is not marked as cached
+    assert len(list(cached.iterate(max_iter=5))) == 5
+    assert not cached.cached
+
+    assert len(list(cached)) == 10
+    assert cached.cached
+
+
+def test_cached_streamer_eviction():
+    calls = _Calls()
+    stream = pescador.Streamer(_counting_generator, 10, calls)
+    reference = list(stream)
+    del calls[:]
+
+    # Room for 4 items out of 10
+    item_bytes = pescador.util.item_nbytes(reference[0])
+    cache = pescador.StreamCache(max_bytes=4 * item_bytes)
+    cached = pescador.CachedStreamer(stream, cache=cache)
+
+    assert T._eq_list_of_dicts(reference, list(cached))
+    assert cache.nbytes <= 4 * item_bytes
+
+    # Evicted items are recomputed
+    del calls[:]
+    assert T._eq_list_of_dicts(reference, list(cached))
+    assert 0 < len(calls) <= 10
+
+
+def test_cached_streamer_shared():
+    calls = _Calls()
+    cache = pescador.StreamCache()
+    streams = [pescador.CachedStreamer(
+                   pescador.Streamer(_counting_generator, 5, calls),
+                   cache=cache)
+               for _ in range(3)]
+
+    mux = pescador.ChainMux(streams, mode='cycle')
+    assert len(list(mux.iterate(max_iter=45))) == 45
+    assert len(calls) == 15
+    assert len(cache) == 15
+
+
+def test_cached_streamer_copy():
+    cached = pescador.CachedStreamer(pescador.Streamer(T.finite_generator, 5))
+    cached_copy = copy.deepcopy(cached)
+
+    assert cached_copy.cache is cached.cache
+    assert cached_copy.cache_key == cached.cache_key
+
+    list(cached)
+    assert cached_copy.cached
+
+
+def test_cached_streamer_iterable():
+    cached = pescador.CachedStreamer(['a', None, 'c'])
+    assert list(cached) == ['a', None, 'c']
+    assert list(cached) == ['a', None, 'c']
+
+
+def _disk_generator(n, calls=None, offset=0):
+    for i in range(n):
+        if calls is not None:
+            calls.append(i)
+        yield {'X': np.arange(i, dtype=np.float32) + offset,
+               'Y': np.array(i)}
+
+
+def test_streamer_hash():
+    def __gen(n):
+        yield n
+
+    def __other(n):
+        yield n + 1
+
+    key = pescador.cache.streamer_hash(pescador.Streamer(__gen, 3))
+    assert key == pescador.cache.streamer_hash(pescador.Streamer(__gen, 3))
+    assert key != pescador.cache.streamer_hash(pescador.Streamer(__gen, 4))
+    assert key != pescador.cache.streamer_hash(pescador.Streamer(__other, 3))
+    assert key != pescador.cache.streamer_hash(
+        pescador.Streamer(_disk_generator, 3))
+
+    # Keyword arguments and array arguments
+    k1 = pescador.cache.streamer_hash(
+        pescador.Streamer(_disk_generator, 3, offset=np.ones(4)))
+    k2 = pescador.cache.streamer_hash(
+        pescador.Streamer(_disk_generator, 3, offset=np.ones(4)))
+    k3 = pescador.cache.streamer_hash(
+        pescador.Streamer(_disk_generator, 3, offset=np.zeros(4)))
+    assert k1 == k2 != k3
+
+    # Iterables
+    assert (pescador.cache.streamer_hash(pescador.Streamer('abc')) !=
+            pescador.cache.streamer_hash(pescador.Streamer('abd')))
+
+
+def _make_generator(value, scale=1):
+    def __gen(n=1):
+        for _ in range(n):
+            yield {'X': np.array([value * scale])}
+    return __gen
+
+
+def test_streamer_hash_closure():
+    def __hash(function, *args):
+        return pescador.cache.streamer_hash(
+            pescador.Streamer(function, *args))
+
+    key = __hash(_make_generator(1))
+    assert key == __hash(_make_generator(1))
+    assert key != __hash(_make_generator(2))
+    assert key != __hash(_make_generator(1, scale=2))
+    assert key != __hash(_make_generator(1), 2)
+
+    # Defaults, and functions in closures
+    def __defaults(n=1):
+        yield n
+
+    def __defaults2(n=2):
+        yield n
+    __defaults2.__code__ = __defaults.__code__
+    assert __hash(__defaults) != __hash(__defaults2)
+
+    def __outer(function):
+        def __gen():
+            for x in function():
+                yield x
+        return __gen
+
+    assert (__hash(__outer(_make_generator(1))) !=
+            __hash(__outer(_make_generator(2))))
+
+    # Recursive closures
+    def __recursive(n):
+        if n:
+            yield n
+            for x in __recursive(n - 1):
+                yield x
+    assert __hash(__recursive, 3) == __hash(__recursive, 3)
+
+
+def test_streamer_hash_unhashable():
+    lock = multiprocessing.Lock()
+
+    def __gen():
+        with lock:
+            yield 1
+
+    with pytest.raises(pescador.PescadorError):
+        pescador.cache.streamer_hash(pescador.Streamer(__gen))
+
+
+def test_disk_cached_closures(tmpdir):
+    results = [list(pescador.DiskCachedStreamer(
+                   pescador.Streamer(_make_generator(value)), str(tmpdir)))
+               for value in [1, 2]]
+    assert results[0][0]['X'].tolist() == [1]
+    assert results[1][0]['X'].tolist() == [2]
+    assert len(tmpdir.listdir()) == 2
+
+
+def test_disk_cached_streamer(tmpdir):
+    calls = _Calls()
+    cache = pescador.DiskCache(str(tmpdir))
+    reference = list(_disk_generator(10))
+
+    stream = pescador.DiskCachedStreamer(
+        pescador.Streamer(_disk_generator, 10, calls), cache)
+    assert not stream.cached
+
+    # Early termination does not store anything
+    assert len(list(stream.iterate(max_iter=3))) == 3
+    assert not stream.cached
+    assert tmpdir.listdir() == []
+
+    del calls[:]
+    assert T._eq_list_of_dicts(reference, list(stream))
+    assert stream.cached
+    assert len(calls) == 10
+
+    # A new streamer with the same arguments uses the same entry
+    del calls[:]
+    stream2 = pescador.DiskCachedStreamer(
+        pescador.Streamer(_disk_generator, 10, _Calls()), str(tmpdir))
+    assert stream2.cached
+    for _ in range(2):
+        result = list(stream2)
+        assert T._eq_list_of_dicts(reference, result)
+        assert all(not x['X'].flags['WRITEABLE'] for x in result)
+    assert len(calls) == 0
+
+
+def test_disk_cached_empty(tmpdir):
+    stream = pescador.DiskCachedStreamer(
+        pescador.Streamer(_disk_generator, 0), str(tmpdir))
+    assert list(stream) == []
+    assert stream.cached
+    assert list(stream) == []
+
+
+def test_disk_cache_eviction(tmpdir):
+    cache = pescador.DiskCache(str(tmpdir))
+    streams = [pescador.DiskCachedStreamer(
+                   pescador.Streamer(_disk_generator, 10, offset=i), cache)
+               for i in range(4)]
+
+    for stream in streams:
+        list(stream)
+    assert all(s.cached for s in streams)
+    entry_bytes = cache.nbytes // 4
+
+    # Make the first entry the oldest, and use the second
+    past = time.time() - 100
+    os.utime(cache.path(streams[0].cache_key), (past, past))
+    list(streams[1])
+
+    cache.max_bytes = 3 * entry_bytes
+    cache.evict()
+    assert [s.cached for s in streams] == [False, True, True, True]
+
+    # Expire everything last used over 50 seconds ago
+    os.utime(cache.path(streams[2].cache_key), (past, past))
+    cache.max_bytes = None
+    cache.max_age = 50
+    cache.evict()
+    assert [s.cached for s in streams] == [False, True, False, True]
+
+    cache.clear()
+    assert cache.nbytes == 0
+
+
+@pytest.mark.parametrize('kwargs', [dict(max_bytes=0), dict(max_age=-1)])
+def test_disk_cache_bad_args(tmpdir, kwargs):
+    with pytest.raises(pescador.PescadorError):
+        pescador.DiskCache(str(tmpdir), **kwargs)
+
+
+def test_disk_cache_bad_data(tmpdir):
+    stream = pescador.DiskCachedStreamer(pescador.Streamer([1, 2, 3]),
+                                         str(tmpdir))
+    with pytest.raises(pescador.DataError):
+        list(stream)
+    assert tmpdir.listdir() == []
+
+
+def _fill_cache(directory):
+    stream = pescador.DiskCachedStreamer(
+        pescador.Streamer(_disk_generator, 50), directory)
+    return len(list(stream))
+
+
+def test_disk_cache_concurrent(tmpdir):
+    pool = multiprocessing.Pool(4)
+    try:
+        counts = pool.map(_fill_cache, [str(tmpdir)] * 8)
+    finally:
+        pool.close()
+        pool.join()
+
+    assert counts == [50] * 8
+    assert len(tmpdir.listdir()) == 1
+
+    reference = list(_disk_generator(50))
+    stream = pescador.DiskCachedStreamer(
+        pescador.Streamer(_disk_generator, 50), str(tmpdir))
+    assert T._eq_list_of_dicts(reference, list(stream))
+
+
+def test_disk_cache_zmq(tmpdir):
+    stream = pescador.DiskCachedStreamer(
+        pescador.Streamer(_disk_generator, 20), str(tmpdir))
+    reference = list(_disk_generator(20))
+
+    zmq_stream = pescador.ZMQStreamer(stream)
+    assert T._eq_list_of_dicts(reference, list(zmq_stream))
+    assert stream.cached
+    assert T._eq_list_of_dicts(reference, list(zmq_stream))
+
+
+def _logging_generator(n, log_path):
+    '''Like _disk_generator, but logs decodes to a file, so that they can
+    be counted across processes.'''
+    for i in range(n):
+        with open(log_path, 'a') as fdesc:
+            fdesc.write('{}\n'.format(i))
+        yield {'X': np.arange(i, dtype=np.float32), 'Y': np.array(i)}
+
+
+def _n_lines(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as fdesc:
+        return len(fdesc.readlines())
+
+
+def test_shared_cache():
+    item = {'X': np.arange(10, dtype=np.float32), 'Y': np.array(3)}
+
+    with pescador.SharedCache() as cache:
+        assert os.path.isdir(cache.directory)
+        assert cache.get(('a', 0), 'missing') == 'missing'
+
+        cache.put(('a', 0), item)
+        result = cache.get(('a', 0))
+        T._eq_batch(item, result)
+        assert not result['X'].flags['WRITEABLE']
+        assert cache.get(('a', 1)) is None
+        assert cache.get(('b', 0)) is None
+        assert (cache.hits, cache.misses) == (1, 3)
+
+        assert cache.get_length('a') is None
+        cache.set_length('a', 7)
+        assert cache.get_length('a') == 7
+
+        # Copies share the directory, but do not own it
+        assert copy.deepcopy(cache) is cache
+
+        with pytest.raises(pescador.DataError):
+            cache.put(('a', 2), [1, 2, 3])
+        assert cache.get(('a', 2)) is None
+        assert not [f for f in os.listdir(cache.directory)
+                    if f.endswith('.tmp')]
+
+    assert not os.path.exists(cache.directory)
+
+
+def test_shared_cache_eviction(tmpdir):
+    item = {'X': np.zeros(1000, dtype=np.uint8)}
+    cache = pescador.SharedCache(directory=str(tmpdir))
+    cache.put(0, item)
+    entry_bytes = cache.nbytes
+
+    cache = pescador.SharedCache(max_bytes=4 * entry_bytes,
+                                 directory=str(tmpdir))
+    for i in range(20):
+        cache.put(i, item)
+    assert cache.nbytes <= 5 * entry_bytes
+    assert cache.get(19) is not None
+    assert cache.get(0) is None
+
+    # User-provided directories are not removed
+    cache.close()
+    assert os.path.isdir(str(tmpdir))
+
+
+def test_shared_cache_default_budget(tmpdir):
+    cache = pescador.SharedCache(directory=str(tmpdir))
+    stat = os.statvfs(str(tmpdir))
+    assert 0 < cache.max_bytes <= stat.f_blocks * stat.f_frsize // 2
+
+    with pytest.raises(pescador.PescadorError):
+        pescador.SharedCache(max_bytes=0, directory=str(tmpdir))
+
+
+_SHARED_CACHE_SCRIPT = """
+import sys, time
+import pescador
+cache = pescador.SharedCache()
+print(cache.directory)
+sys.stdout.flush()
+if sys.argv[1] == 'wait':
+    time.sleep(60)
+"""
+
+
+def _shared_cache_process(mode):
+    return subprocess.Popen([sys.executable, '-c', _SHARED_CACHE_SCRIPT, mode],
+                            stdout=subprocess.PIPE,
+                            universal_newlines=True)
+
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm'),
+                    reason='requires /dev/shm')
+def test_shared_cache_cleanup():
+    # Directories are removed at exit, without close
+    proc = _shared_cache_process('exit')
+    directory = proc.stdout.readline().strip()
+    proc.communicate()
+    assert directory.startswith('/dev/shm/pescador-')
+    assert not os.path.exists(directory)
+
+    # Killed processes leave their directory, until the next cache
+    proc = _shared_cache_process('wait')
+    directory = proc.stdout.readline().strip()
+    proc.send_signal(signal.SIGTERM)
+    proc.communicate()
+    assert os.path.isdir(directory)
+
+    with pescador.SharedCache() as cache:
+        assert not os.path.exists(directory)
+        assert os.path.isdir(cache.directory)
+
+
+def test_cached_streamer_resume(tmpdir):
+    log = str(tmpdir.join('log'))
+    with pescador.SharedCache() as cache:
+        cached = pescador.CachedStreamer(
+            pescador.Streamer(_logging_generator, 10, log), cache=cache)
+
+        # Items from incomplete passes are reused
+        assert len(list(cached.iterate(max_iter=4))) == 4
+        n_decoded = _n_lines(log)
+        assert not cached.cached
+
+        result = list(cached)
+        assert T._eq_list_of_dicts(list(_disk_generator(10)), result)
+        assert cached.cached
+        assert _n_lines(log) == n_decoded + 10
+
+        assert T._eq_list_of_dicts(result, list(cached))
+        assert _n_lines(log) == n_decoded + 10
+
+
+def test_shared_cache_zmq(tmpdir):
+    log = str(tmpdir.join('log'))
+    reference = list(_disk_generator(5)) * 3
+
+    with pescador.SharedCache() as cache:
+        streams = [pescador.CachedStreamer(
+                       pescador.Streamer(_logging_generator, 5, log),
+                       cache=cache)
+                   for _ in range(3)]
+        zmq_stream = pescador.ZMQStreamer(pescador.ChainMux(streams))
+
+        # Each pass runs in a new worker, but decodes only once
+        for _ in range(3):
+            assert T._eq_list_of_dicts(reference, list(zmq_stream))
+        assert _n_lines(log) == 15
+        assert all(s.cached for s in streams)
@@ -2,6 +2,7 @@
 '''Test the streamer object for reusable iterators'''
 from __future__ import print_function
 import copy
+import time
 import pytest
 
 import warnings
@@ -272,3 +273,115 @@ def test_streamer_context_multiple_copies():
     result2 = list(gen2)
     assert len(result2) == 6
     assert streamer.active == 0
+
+
+def test_streamer_closes_generator():
+    class __Closed(list):
+        def __deepcopy__(self, memo):
+            return self
+
+    def __gen(log):
+        try:
+            for i in range(10):
+                yield i
+        finally:
+            log.append(True)
+
+    closed = __Closed()
+    streamer = pescador.Streamer(__gen, closed)
+    assert list(streamer.iterate(max_iter=3)) == [0, 1, 2]
+    assert closed == [True]
+
+    gen = streamer.iterate()
+    next(gen)
+    gen.close()
+    assert closed == [True, True]
+
+
+def test_streamer_stats():
+    def __slow_gen(n, delay):
+        time.sleep(delay)
+        for i in range(n):
+            time.sleep(delay)
+            yield i
+
+    streamer = pescador.Streamer(__slow_gen, 5, 0.01)
+    assert streamer.stats() is None
+    assert streamer.instrument() is streamer
+
+    for _ in streamer.iterate():
+        time.sleep(0.02)
+    for _ in range(2):
+        assert list(streamer) == [0, 1, 2, 3, 4]
+
+    stats = streamer.stats()
+    assert stats['activations'] == 3
+    assert stats['items'] == 15
+    assert stats['mean_activation_time'] >= 0
+    # Time to the first item is spent in the generator, not activation
+    assert stats['producer_time'] >= 0.01 * 18
+    assert stats['consumer_time'] >= 0.02 * 5
+    assert 0 < stats['items_per_second'] < stats['producer_items_per_second']
+
+    # Activated copies share statistics
+    with streamer as active:
+        assert active.stats_ is streamer.stats_
+
+    assert streamer.instrument().stats()['items'] == 0
+    assert streamer.instrument(False).stats() is None
+    assert list(streamer) == [0, 1, 2, 3, 4]
+
+
+def test_mux_stats():
+    streamers = [pescador.Streamer(T.finite_generator, 5) for _ in range(3)]
+    for s in streamers:
+        s.instrument()
+    mux = pescador.ChainMux(streamers).instrument()
+
+    assert len(list(mux.iterate(max_iter=12))) == 12
+    assert mux.stats()['items'] == 12
+    assert mux.stats()['activations'] == 1
+    assert [s.stats()['items'] for s in streamers] == [5, 5, 2]
+    assert all(s.stats()['activations'] == 1 for s in streamers)
+
+
+def test_streamer_hooks():
+    events = []
+
+    def __on_activate(active):
+        assert active.is_activated_copy
+        events.append('activate')
+
+    def __on_item(streamer, n, item):
+        events.append((n, item))
+
+    streamer = pescador.Streamer('abcde')
+    assert streamer.hooks_ is None
+
+    streamer.add_hook('activate', __on_activate)
+    streamer.add_hook('item', __on_item, every=2)
+    assert list(streamer) == list('abcde')
+    assert events == ['activate', (2, 'b'), (4, 'd')]
+
+    # Hooks are shared by copies
+    del events[:]
+    with streamer as active:
+        assert active.hooks_ is streamer.hooks_
+    assert events == ['activate']
+
+    del events[:]
+    streamer.remove_hook('item', __on_item)
+    assert list(streamer) == list('abcde')
+    assert events == ['activate']
+
+    streamer.remove_hook('activate', __on_activate)
+    assert streamer.hooks_ is None
+    assert list(streamer) == list('abcde')
+    assert events == ['activate']
+
+
+@pytest.mark.parametrize('event,every', [('foo', 1), ('item', 0),
+                                         ('item', 1.5)])
+def test_streamer_hooks_bad(event, every):
+    with pytest.raises(pescador.PescadorError):
+        pescador.Streamer('abc').add_hook(event, print, every=every)
@@ -0,0 +1,446 @@
+import pytest
+
+import copy
+import functools
+import numpy as np
+
+import pescador
+import pescador.io
+import test_utils as T
+
+
+@pytest.fixture
+def npy_files(tmpdir):
+    X = np.arange(100 * 3, dtype=np.float32).reshape((100, 3))
+    Y = np.arange(100)
+
+    x_path = str(tmpdir.join('X.npy'))
+    y_path = str(tmpdir.join('Y.npy'))
+    np.save(x_path, X)
+    np.save(y_path, Y)
+    return dict(X=x_path, Y=y_path), dict(X=X, Y=Y)
+
+
+def test_npy_sequential(npy_files):
+    paths, data = npy_files
+
+    stream = pescador.io.NPYStreamer(paths['X'], key='features')
+    rows = list(stream)
+    assert len(rows) == len(data['X'])
+    for i, row in enumerate(rows):
+        assert list(row.keys()) == ['features']
+        assert np.array_equal(row['features'], data['X'][i])
+
+    # Streams restart
+    assert len(list(stream)) == len(data['X'])
+
+
+@pytest.mark.parametrize('mode', ['sequential', 'random', 'chunk'])
+def test_npy_aligned(npy_files, mode):
+    paths, data = npy_files
+
+    stream = pescador.io.NPYStreamer(paths, mode=mode, block_size=16,
+                                     chunk_size=8)
+    for row in stream.iterate(max_iter=200):
+        assert set(row.keys()) == {'X', 'Y'}
+        assert np.array_equal(row['X'], data['X'][row['Y']])
+
+
+@pytest.mark.parametrize('mode', ['sequential', 'shuffle', 'random',
+                                  'chunk'])
+def test_npy_1d_rows(tmpdir, npy_files, mode):
+    paths, data = npy_files
+
+    stream = pescador.io.NPYStreamer(paths, mode=mode, chunk_size=8)
+    for row in stream.iterate(max_iter=100):
+        assert isinstance(row['Y'], np.ndarray)
+        assert row['Y'].shape == ()
+        assert isinstance(row['X'], np.ndarray)
+
+    # Rows can be serialized
+    zmq_stream = pescador.ZMQStreamer(stream)
+    rows = list(zmq_stream.iterate(max_iter=100))
+    assert len(rows) == 100
+    for row in rows:
+        assert row['Y'].shape == ()
+        assert np.array_equal(row['X'], data['X'][row['Y']])
+
+    # and cached
+    shards = pescador.io.write_shards(stream.iterate(max_iter=10),
+                                      str(tmpdir.join('shards')),
+                                      items_per_shard=10)
+    assert len(shards) == 1
+
+
+def test_chunked_mux_1d_rows(npy_files):
+    paths, data = npy_files
+    mux = pescador.io.chunked_mux(paths['Y'], 10, 2, key='Y',
+                                  random_state=0)
+    rows = list(pescador.ZMQStreamer(mux).iterate(max_iter=50))
+    assert len(rows) == 50
+    assert all(row['Y'].shape == () for row in rows)
+
+
+@pytest.mark.parametrize('random_state', [
+    10, np.random.RandomState(10), np.random.default_rng(10)])
+def test_npy_random(npy_files, random_state):
+    paths, data = npy_files
+
+    stream = pescador.io.NPYStreamer(paths, mode='random', block_size=7,
+                                     random_state=random_state)
+    sample1 = [int(row['Y']) for row in stream.iterate(max_iter=500)]
+    sample2 = [int(row['Y']) for row in stream.iterate(max_iter=500)]
+
+    assert len(sample1) == 500
+    # Each pass continues the random stream, rather than replaying it
+    assert sample1 != sample2
+    # Rows are not yielded in file order
+    assert sample1 != sorted(sample1)
+    assert len(set(sample1)) > 50
+
+
+@pytest.mark.parametrize('mode', ['shuffle', 'random', 'chunk'])
+def test_npy_seed_reproducible(npy_files, mode):
+    paths, data = npy_files
+
+    def __passes(stream):
+        return [[int(row['Y']) for row in stream.iterate(max_iter=100)]
+                for _ in range(3)]
+
+    streams = [pescador.io.NPYStreamer(paths, mode=mode, chunk_size=8,
+                                       random_state=7) for _ in range(2)]
+    passes = __passes(streams[0])
+    assert passes == __passes(streams[1])
+    assert passes[0] != passes[1]
+
+
+def test_npy_reseed(npy_files):
+    paths, data = npy_files
+
+    def __sample(stream):
+        return [int(row['Y']) for row in stream.iterate(max_iter=50)]
+
+    streams = [pescador.io.NPYStreamer(paths, mode='random', random_state=1)
+               for _ in range(3)]
+    reference = __sample(streams[0])
+
+    # Muxes reseed their sources, e.g., in ZMQStreamer workers
+    mux = pescador.ChainMux(streams[1:])
+    mux.reseed(5)
+    samples = [__sample(stream) for stream in streams[1:]]
+    assert samples[0] != reference
+    assert samples[0] != samples[1]
+
+
+def test_npy_mux_passes(npy_files):
+    paths, data = npy_files
+    streams = [pescador.io.NPYStreamer(paths, mode='random', random_state=i)
+               for i in range(2)]
+    mux = pescador.StochasticMux(streams, 2, rate=8, random_state=0)
+
+    sample = [int(row['Y']) for row in mux.iterate(max_iter=2000)]
+    assert len(set(sample)) == len(data['Y'])
+
+
+@pytest.mark.parametrize('chunk_size', [1, 8, 1000])
+def test_npy_chunk(npy_files, chunk_size):
+    paths, data = npy_files
+    size = min(chunk_size, len(data['Y']))
+
+    stream = pescador.io.NPYStreamer(paths, mode='chunk',
+                                     chunk_size=chunk_size, random_state=5)
+    sample = np.array([row['Y'] for row in stream.iterate(max_iter=5 * size)])
+
+    for chunk in sample.reshape((5, size)):
+        # Each chunk is a permutation of a contiguous range of rows
+        assert np.array_equal(np.sort(chunk),
+                              np.arange(chunk.min(), chunk.min() + size))
+
+
+def test_npy_unequal_length(tmpdir, npy_files):
+    paths, data = npy_files
+    short_path = str(tmpdir.join('short.npy'))
+    np.save(short_path, np.arange(10))
+
+    stream = pescador.io.NPYStreamer(dict(X=paths['X'], Y=short_path))
+    with pytest.raises(pescador.PescadorError):
+        list(stream)
+
+
+def test_npy_empty(tmpdir):
+    path = str(tmpdir.join('empty.npy'))
+    np.save(path, np.zeros((0, 3)))
+
+    for mode in ['sequential', 'random', 'chunk']:
+        assert list(pescador.io.NPYStreamer(path, mode=mode)) == []
+
+
+@pytest.mark.parametrize('kwargs', [dict(mode='foo'), dict(block_size=0),
+                                    dict(chunk_size=0)])
+def test_npy_bad_args(npy_files, kwargs):
+    paths, data = npy_files
+    with pytest.raises(pescador.PescadorError):
+        pescador.io.NPYStreamer(paths, **kwargs)
+
+
+def test_npy_deepcopy(npy_files):
+    paths, data = npy_files
+    stream = pescador.io.NPYStreamer(paths, mode='random', random_state=3)
+    stream_copy = copy.deepcopy(stream)
+    reference = pescador.io.NPYStreamer(paths, mode='random', random_state=3)
+
+    assert stream_copy.paths == stream.paths
+
+    # Copies share the random stream, so a pass over the copy continues
+    # from the pass over the original
+    assert T._eq_list_of_dicts(list(reference.iterate(max_iter=20)),
+                               list(stream.iterate(max_iter=20)))
+    assert T._eq_list_of_dicts(list(reference.iterate(max_iter=20)),
+                               list(stream_copy.iterate(max_iter=20)))
+
+
+@pytest.mark.parametrize('mux_class', [
+    functools.partial(pescador.StochasticMux, n_active=2, rate=8,
+                      random_state=1),
+    functools.partial(pescador.ShuffledMux, random_state=1),
+    pescador.RoundRobinMux,
+    pescador.ChainMux])
+def test_npy_mux(npy_files, mux_class):
+    paths, data = npy_files
+    streams = [pescador.io.NPYStreamer(paths),
+               pescador.io.NPYStreamer(paths, mode='random'),
+               pescador.io.NPYStreamer(paths, mode='chunk')]
+
+    mux = mux_class(streams)
+    for row in mux.iterate(max_iter=300):
+        assert np.array_equal(row['X'], data['X'][row['Y']])
+
+
+@pytest.mark.parametrize('mode', ['sequential', 'shuffle', 'random', 'chunk'])
+@pytest.mark.parametrize('start,stop', [(None, 10), (90, None), (20, 40)])
+def test_npy_range(npy_files, mode, start, stop):
+    paths, data = npy_files
+    expected = set(data['Y'][start:stop])
+
+    stream = pescador.io.NPYStreamer(paths, mode=mode, start=start,
+                                     stop=stop, chunk_size=4)
+    sample = [int(row['Y']) for row in stream.iterate(max_iter=100)]
+    assert set(sample) <= expected
+
+    if mode in ['sequential', 'shuffle']:
+        assert sorted(sample) == sorted(expected)
+
+
+def test_npy_shuffle(npy_files):
+    paths, data = npy_files
+    stream = pescador.io.NPYStreamer(paths, mode='shuffle', random_state=1)
+    sample = [int(row['Y']) for row in stream]
+    assert sorted(sample) == list(data['Y'])
+    assert sample != list(data['Y'])
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 100, 1000])
+@pytest.mark.parametrize('n_active', [1, 4])
+def test_chunked_mux_exhaustive(npy_files, chunk_size, n_active):
+    paths, data = npy_files
+    mux = pescador.io.chunked_mux(paths, chunk_size, n_active,
+                                  mode='exhaustive', random_state=11)
+    assert isinstance(mux, pescador.StochasticMux)
+    assert mux.n_streams == int(np.ceil(100. / chunk_size))
+
+    sample = []
+    for row in mux:
+        assert np.array_equal(row['X'], data['X'][row['Y']])
+        sample.append(int(row['Y']))
+
+    # Each row exactly once
+    assert sorted(sample) == list(data['Y'])
+
+    # Reproducible
+    mux2 = pescador.io.chunked_mux(paths, chunk_size, n_active,
+                                   mode='exhaustive', random_state=11)
+    assert sample == [int(row['Y']) for row in mux2]
+
+
+def test_chunked_mux_locality(npy_files):
+    paths, data = npy_files
+    mux = pescador.io.chunked_mux(paths['Y'], 10, 1, key='Y',
+                                  random_state=3)
+
+    # With one chunk in flight, consecutive blocks come from one chunk
+    sample = np.array([row['Y'] for row in mux.iterate(max_iter=100)])
+    for block in sample.reshape((10, 10)):
+        assert len(set(block // 10)) == 1
+
+
+def test_chunked_mux_revisit(tmpdir):
+    path = str(tmpdir.join('Y.npy'))
+    np.save(path, np.arange(16))
+    mux = pescador.io.chunked_mux(path, 8, 1, key='Y', random_state=0)
+
+    # With one chunk in flight, each block of 8 is one visit to a chunk
+    sample = np.array([row['Y'] for row in mux.iterate(max_iter=160)])
+    visits = [tuple(block) for block in sample.reshape((20, 8))
+              if block[0] >= 8]
+    assert len(visits) > 1
+    for visit in visits:
+        assert sorted(visit) == list(range(8, 16))
+
+    # Rows are shuffled differently on each visit
+    assert len(set(visits)) > 1
+
+
+def test_chunked_mux_bad(tmpdir, npy_files):
+    paths, data = npy_files
+    with pytest.raises(pescador.PescadorError):
+        pescador.io.chunked_mux(paths, 0, 1)
+
+    path = str(tmpdir.join('empty.npy'))
+    np.save(path, np.zeros((0, 3)))
+    with pytest.raises(pescador.PescadorError):
+        pescador.io.chunked_mux(path, 10, 1)
+
+
+def _shard_data(n):
+    for i in range(n):
+        yield dict(X=np.full((i % 3 + 1, 2), i, dtype=np.float32),
+                   Y=np.array(i), Z=np.arange(i, dtype='>i2'))
+
+
+@pytest.mark.parametrize('items_per_shard', [1, 7, 10, 100])
+def test_write_shards(tmpdir, items_per_shard):
+    directory = str(tmpdir.join('shards'))
+    reference = list(_shard_data(10))
+
+    paths = pescador.io.write_shards(reference, directory, items_per_shard)
+    assert len(paths) == int(np.ceil(10. / items_per_shard))
+    assert not tmpdir.join('shards').listdir('*.tmp')
+
+    streams = pescador.io.shard_streamers(directory)
+    assert [s.path for s in streams] == paths
+
+    estimate = list(pescador.ChainMux(streams))
+    assert len(estimate) == len(reference)
+    for ref, est in zip(reference, estimate):
+        assert set(ref.keys()) == set(est.keys())
+        for key in ref:
+            assert ref[key].dtype == est[key].dtype
+            assert ref[key].shape == est[key].shape
+            assert np.array_equal(ref[key], est[key])
+            # Arrays are aligned, read-only views into the shard
+            assert est[key].flags['ALIGNED']
+            assert not est[key].flags['WRITEABLE']
+
+
+def test_shard_modes(tmpdir):
+    directory = str(tmpdir)
+    pescador.io.write_shards(_shard_data(20), directory, 20)
+    shard, = pescador.io.shard_streamers(directory)
+
+    shuffled = pescador.io.ShardStreamer(shard.path, mode='shuffle',
+                                         random_state=3)
+    sample = [int(x['Y']) for x in shuffled]
+    assert sorted(sample) == list(range(20))
+    assert sample != list(range(20))
+
+    stream = pescador.io.ShardStreamer(shard.path, mode='random',
+                                       random_state=3)
+    sample = [int(x['Y']) for x in stream.iterate(max_iter=100)]
+    assert len(sample) == 100
+    assert set(sample) <= set(range(20))
+
+
+def test_shard_passes(tmpdir):
+    directory = str(tmpdir)
+    pescador.io.write_shards(_shard_data(40), directory, 10)
+
+    def __passes(streams):
+        return [[[int(x['Y']) for x in stream] for stream in streams]
+                for _ in range(2)]
+
+    passes = __passes(pescador.io.shard_streamers(directory, mode='shuffle',
+                                                  random_state=5))
+
+    # Each pass over a shard is permuted differently
+    assert passes[0] != passes[1]
+
+    # Each shard is permuted differently
+    orders = [np.argsort(order) for order in passes[0]]
+    assert any(not np.array_equal(orders[0], order) for order in orders[1:])
+
+    # Reproducible
+    assert passes == __passes(pescador.io.shard_streamers(
+        directory, mode='shuffle', random_state=5))
+
+
+def test_shard_index_view(tmpdir):
+    directory = str(tmpdir)
+    path, = pescador.io.write_shards(_shard_data(5), directory, 10)
+
+    buf = np.asarray(np.memmap(path, dtype=np.uint8, mode='r'))
+    index = pescador.io._read_shard_index(buf)
+    assert len(index) == 5
+
+    # The offset table is read in place, rather than parsed
+    assert index.table.base is not None
+    assert np.shares_memory(index.table, buf)
+
+
+def test_shard_empty(tmpdir):
+    path = str(tmpdir.join('empty.shard'))
+    pescador.io._ShardWriter(path).close()
+    assert list(pescador.io.ShardStreamer(path)) == []
+
+
+def test_write_shards_schema(tmpdir):
+    stream = [dict(X=np.zeros(3)), dict(X=np.zeros(3, dtype=np.int32))]
+    with pytest.raises(pescador.DataError):
+        pescador.io.write_shards(stream, str(tmpdir), 10)
+
+    stream = [dict(X=np.zeros(3)), dict(X=np.zeros(3), Y=np.zeros(1))]
+    with pytest.raises(pescador.DataError):
+        pescador.io.write_shards(stream, str(tmpdir), 10)
+
+    # Shards are written independently
+    stream = [dict(X=np.zeros(3)), dict(X=np.zeros((2, 2), dtype=np.int32))]
+    assert len(pescador.io.write_shards(stream, str(tmpdir), 1)) == 2
+
+
+def test_shard_streamers_mux(tmpdir):
+    directory = str(tmpdir)
+    pescador.io.write_shards(_shard_data(50), directory, 10)
+
+    streams = pescador.io.shard_streamers(directory, mode='shuffle')
+    assert len(streams) == 5
+
+    mux = pescador.StochasticMux(streams, n_active=2, rate=None,
+                                 mode='exhaustive', random_state=1)
+    sample = sorted(int(x['Y']) for x in mux)
+    assert sample == list(range(50))
+
+
+@pytest.mark.parametrize('stream', [[1, 2, 3], [dict(X=[1, 2])],
+                                    [dict(X=np.array([object()]))]])
+def test_write_shards_bad_data(tmpdir, stream):
+    with pytest.raises(pescador.DataError):
+        pescador.io.write_shards(stream, str(tmpdir), 10)
+
+    assert not tmpdir.listdir()
+
+
+def test_write_shards_bad_size(tmpdir):
+    with pytest.raises(pescador.PescadorError):
+        pescador.io.write_shards(_shard_data(5), str(tmpdir), 0)
+
+
+def test_shard_invalid(tmpdir):
+    path = tmpdir.join('bad.shard')
+    path.write(b'not a shard at all', mode='wb')
+
+    with pytest.raises(pescador.DataError):
+        list(pescador.io.ShardStreamer(str(path)))
+
+
+def test_shard_bad_mode(tmpdir):
+    with pytest.raises(pescador.PescadorError):
+        pescador.io.ShardStreamer(str(tmpdir.join('x.shard')), mode='foo')
@@ -1,5 +1,6 @@
 import pytest
 
+import time
 import numpy as np
 
 import pescador.maps
@@ -105,3 +106,607 @@ def test_keras_tuples(sample_data):
     with pytest.raises(KeyError):
         for x in pescador.maps.keras_tuples(sample_data, 'apple'):
             pass
+
+
+def _slow_square(data):
+    # Later items finish first
+    time.sleep(0.002 * (10 - int(data['foo'][0]) % 10))
+    return {'foo': data['foo'] ** 2}
+
+
+def _noisy(data, rng):
+    return {'foo': data['foo'] + rng.random()}
+
+
+def _fail_on_five(data):
+    if data['foo'][0] == 5:
+        raise ValueError('five')
+    return data
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+@pytest.mark.parametrize('n_workers', [1, 4])
+def test_parallel_map(sample_data, backend, n_workers):
+    stream = pescador.maps.parallel_map(sample_data, _slow_square, n_workers,
+                                        backend=backend)
+    outputs = [int(x['foo'][0]) for x in stream]
+    assert outputs == [n ** 2 for n in range(10)]
+
+    stream = pescador.maps.parallel_map(sample_data, _slow_square, n_workers,
+                                        backend=backend, ordered=False)
+    outputs = [int(x['foo'][0]) for x in stream]
+    assert sorted(outputs) == [n ** 2 for n in range(10)]
+
+
+def test_parallel_map_seeding(sample_data):
+    outputs = []
+    for backend, n_workers in [('thread', 1), ('thread', 3), ('process', 2)]:
+        stream = pescador.maps.parallel_map(sample_data, _noisy, n_workers,
+                                            backend=backend, random_state=7)
+        outputs.append([x['foo'][0] for x in stream])
+
+    assert outputs[0] == outputs[1] == outputs[2]
+    assert len(set(np.asarray(outputs[0]) % 1)) == 10
+
+    stream = pescador.maps.parallel_map(sample_data, _noisy, 2,
+                                        random_state=8)
+    assert [x['foo'][0] for x in stream] != outputs[0]
+
+
+def test_parallel_map_in_flight():
+    pulled = []
+
+    def __stream():
+        for n in range(100):
+            pulled.append(n)
+            yield {'foo': np.array([n])}
+
+    stream = pescador.maps.parallel_map(__stream(), _slow_square, 2,
+                                        max_in_flight=3)
+    for n, data in enumerate(stream):
+        assert len(pulled) <= n + 3
+
+    stream = pescador.maps.parallel_map(__stream(), _slow_square, 2)
+    assert len(list(zip(range(5), stream))) == 5
+    stream.close()
+
+
+@pytest.mark.parametrize('backend', ['thread', 'process'])
+def test_parallel_map_error(sample_data, backend):
+    stream = pescador.maps.parallel_map(sample_data, _fail_on_five, 2,
+                                        backend=backend)
+    outputs = []
+    with pytest.raises(ValueError):
+        for x in stream:
+            outputs.append(int(x['foo'][0]))
+    assert outputs == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize('kwargs', [dict(n_workers=0),
+                                    dict(n_workers=2, backend='gpu'),
+                                    dict(n_workers=2, max_in_flight=0)])
+def test_parallel_map_bad_args(sample_data, kwargs):
+    with pytest.raises(pescador.maps.PescadorError):
+        list(pescador.maps.parallel_map(sample_data, _slow_square, **kwargs))
+
+
+def test___split_data():
+    batch = {'X': np.arange(12).reshape((4, 3)), 'Y': np.arange(4)}
+    items = list(pescador.maps.__split_data(batch))
+    assert len(items) == 4
+    for i, item in enumerate(items):
+        assert np.array_equal(item['X'], batch['X'][i])
+        assert item['Y'].shape == ()
+        assert item['Y'] == i
+        # Rows are views, not copies
+        assert np.may_share_memory(item['X'], batch['X'])
+        assert np.may_share_memory(item['Y'], batch['Y'])
+
+    assert list(pescador.maps.__split_data({})) == []
+
+    with pytest.raises(pescador.maps.PescadorError):
+        list(pescador.maps.__split_data({'X': np.arange(3),
+                                         'Y': np.arange(4)}))
+
+
+_batch_sizes = []
+
+
+def _scale_batch(batch):
+    _batch_sizes.append(len(batch['foo']))
+    return {'foo': batch['foo'] * 10, 'bar': batch['bar']}
+
+
+@pytest.mark.parametrize('partial', [False, True])
+def test_map_batches(sample_data, partial):
+    del _batch_sizes[:]
+    stream = pescador.maps.map_batches(sample_data, _scale_batch, 4,
+                                       partial=partial)
+    batches = list(stream)
+    assert _batch_sizes == ([4, 4, 2] if partial else [4, 4])
+    for batch in batches:
+        T._eq_batch(batch, {'foo': batch['bar'] * 20,
+                            'bar': batch['bar']})
+
+    del _batch_sizes[:]
+    stream = pescador.maps.map_batches(sample_data, _scale_batch, 4,
+                                       partial=partial, unbatch=True)
+    items = list(stream)
+    assert len(items) == (10 if partial else 8)
+    for n, item in enumerate(items):
+        assert item['foo'].shape == sample_data[n]['foo'].shape
+        assert item['foo'] == 10 * n
+
+
+def test_map_batches_bad_output(sample_data):
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.map_batches(sample_data, lambda b: b['foo'], 4,
+                                       unbatch=True))
+
+
+def test_unbatch():
+    batches = [{'X': np.arange(6).reshape((3, 2)), 'Y': np.arange(3)},
+               {'X': np.zeros((0, 2)), 'Y': np.zeros(0)},
+               {'X': np.arange(6, 10).reshape((2, 2)), 'Y': np.arange(3, 5)}]
+    items = list(pescador.maps.unbatch(batches))
+    assert [int(x['Y']) for x in items] == list(range(5))
+    for item in items:
+        assert np.array_equal(item['X'], [2 * item['Y'], 2 * item['Y'] + 1])
+
+    assert np.may_share_memory(items[0]['X'], batches[0]['X'])
+
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.unbatch([1, 2]))
+
+
+@pytest.mark.parametrize('sizes', [[4, 4, 4], [3, 5, 1, 7], [1] * 12, [12],
+                                   [0, 6, 0, 6]])
+@pytest.mark.parametrize('batch_size', [1, 3, 5, 12, 20])
+@pytest.mark.parametrize('partial', [False, True])
+def test_rebatch(sizes, batch_size, partial):
+    bounds = np.cumsum([0] + sizes)
+    data = np.arange(2 * bounds[-1]).reshape((-1, 2))
+    batches = [{'X': data[start:stop], 'Y': np.arange(start, stop)}
+               for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    outputs = list(pescador.maps.rebatch(batches, batch_size,
+                                         partial=partial))
+    lengths = [pescador.util.batch_length(b) for b in outputs]
+    n_full = bounds[-1] // batch_size
+    assert lengths[:n_full] == [batch_size] * n_full
+    if partial and bounds[-1] % batch_size:
+        assert lengths[n_full:] == [bounds[-1] % batch_size]
+    else:
+        assert len(lengths) == n_full
+
+    merged = np.concatenate([b['Y'] for b in outputs] + [[]])
+    assert np.array_equal(merged, np.arange(len(merged)))
+    for batch in outputs:
+        assert np.array_equal(batch['X'], data[batch['Y']])
+
+
+def test_rebatch_views():
+    batch = {'X': np.arange(10)}
+    outputs = list(pescador.maps.rebatch([batch], 5))
+    assert len(outputs) == 2
+    assert all(np.may_share_memory(b['X'], batch['X']) for b in outputs)
+
+
+def test_rebatch_bad():
+    with pytest.raises(pescador.maps.PescadorError):
+        list(pescador.maps.rebatch([{'X': np.arange(3)}], 0))
+
+    with pytest.raises(pescador.maps.PescadorError):
+        list(pescador.maps.rebatch([{'X': np.arange(3),
+                                     'Y': np.arange(4)}], 2))
+
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.rebatch([[1, 2, 3]], 2))
+
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.rebatch([{'X': np.arange(3)},
+                                    {'Y': np.arange(3)}], 4))
+
+
+def _variable_data(lengths):
+    return [{'X': np.arange(n * 2, dtype=np.float32).reshape((n, 2)) + 1,
+             'Y': np.array(i),
+             'Z': np.arange(n)}
+            for i, n in enumerate(lengths)]
+
+
+@pytest.mark.parametrize('partial', [False, True])
+def test_bucket_stream(partial):
+    lengths = [1, 9, 2, 12, 5, 3, 30, 8, 4, 11, 25, 6]
+    data = _variable_data(lengths)
+
+    stream = pescador.maps.bucket_stream(data, 2, 'X', [5, 10],
+                                         pad_keys=['X', 'Z'],
+                                         partial=partial)
+    batches = list(stream)
+
+    seen = []
+    for batch in batches:
+        assert set(batch.keys()) == {'X', 'Y', 'Z', 'lengths', 'mask'}
+        assert np.array_equal(batch['lengths'],
+                              [lengths[i] for i in batch['Y']])
+        bucket = np.searchsorted([5, 10], batch['lengths'], side='right')
+        assert len(set(bucket)) == 1
+
+        # Padded to the longest item in this batch
+        max_len = batch['lengths'].max()
+        assert batch['X'].shape == (len(batch['Y']), max_len, 2)
+        assert batch['mask'].shape == (len(batch['Y']), max_len)
+        assert np.array_equal(batch['mask'].sum(axis=1), batch['lengths'])
+        for x, mask, i in zip(batch['X'], batch['mask'], batch['Y']):
+            assert np.array_equal(x[mask], data[i]['X'])
+            assert not np.any(x[~mask])
+
+        seen.extend(batch['Y'])
+
+    if partial:
+        assert sorted(seen) == list(range(len(data)))
+        assert [len(b['Y']) for b in batches] == [2] * 6
+    else:
+        assert len(seen) == 12
+
+
+def test_bucket_stream_pad_keys():
+    data = _variable_data([3, 4, 7])
+    stream = pescador.maps.bucket_stream(data, 3, 'X', [10],
+                                         pad_keys=['X', 'Z'], pad_value=-1,
+                                         lengths_key='n', mask_key=None)
+    batch, = list(stream)
+    assert set(batch.keys()) == {'X', 'Y', 'Z', 'n'}
+    assert batch['Z'].shape == (3, 7)
+    assert np.array_equal(batch['Z'][0], [0, 1, 2, -1, -1, -1, -1])
+    assert np.array_equal(batch['n'], [3, 4, 7])
+
+
+def test_bucket_stream_bad():
+    with pytest.raises(pescador.maps.PescadorError):
+        list(pescador.maps.bucket_stream(_variable_data([1]), 0, 'X', [5]))
+
+    with pytest.raises(pescador.maps.PescadorError):
+        list(pescador.maps.bucket_stream(_variable_data([1]), 1, 'X', [5, 5]))
+
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.bucket_stream([1, 2], 1, 'X', [5]))
+
+    # Unpadded fields of different shapes can't be stacked
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.bucket_stream(_variable_data([1, 2]), 2, 'X',
+                                         [5]))
+
+
+@pytest.mark.parametrize('cost', ['padded', 'elements', 'bytes'])
+@pytest.mark.parametrize('window', [None, 1, 5, 100])
+@pytest.mark.parametrize('partial', [False, True])
+def test_budget_stream(cost, window, partial):
+    lengths = np.random.RandomState(0).randint(1, 20, size=50)
+    data = _variable_data(lengths)
+    max_cost = 64
+    if cost == 'bytes':
+        max_cost = 4 * pescador.util.item_nbytes(data[0]) * 10
+
+    stream = pescador.maps.budget_stream(data, max_cost, 'X', cost=cost,
+                                         window=window, pad_keys=['X', 'Z'],
+                                         partial=partial, random_state=1)
+    batches = list(stream)
+
+    seen = []
+    for batch in batches:
+        n = len(batch['Y'])
+        assert np.array_equal(batch['lengths'], lengths[batch['Y']])
+        if cost == 'padded':
+            actual = batch['X'].shape[0] * batch['X'].shape[1]
+        elif cost == 'elements':
+            actual = batch['lengths'].sum()
+        else:
+            actual = n * max(pescador.util.item_nbytes(data[i])
+                             for i in batch['Y'])
+        assert n == 1 or actual <= max_cost
+
+        for x, mask, i in zip(batch['X'], batch['mask'], batch['Y']):
+            assert np.array_equal(x[mask], data[i]['X'])
+        seen.extend(batch['Y'])
+
+    assert len(seen) == len(set(seen))
+    if partial:
+        assert sorted(seen) == list(range(len(data)))
+    else:
+        assert len(seen) < len(data)
+
+
+def test_budget_stream_window():
+    lengths = np.random.RandomState(0).randint(1, 50, size=200)
+    data = _variable_data(lengths)
+
+    def __waste(window):
+        stream = pescador.maps.budget_stream(data, 200, 'X', window=window,
+                                             pad_keys=['X', 'Z'],
+                                             partial=True, random_state=0)
+        batches = list(stream)
+        padded = sum(b['mask'].size for b in batches)
+        return padded - lengths.sum(), len(batches)
+
+    # Sorting within a window packs more tightly
+    waste, n_batches = __waste(None)
+    waste_sorted, n_batches_sorted = __waste(200)
+    assert waste_sorted < waste / 2
+    assert n_batches_sorted < n_batches
+
+
+def test_budget_stream_oversized():
+    data = _variable_data([3, 50, 3])
+    batches = list(pescador.maps.budget_stream(data, 10, 'X',
+                                               pad_keys=['X', 'Z'],
+                                               partial=True))
+    assert [list(b['Y']) for b in batches] == [[0], [1], [2]]
+
+
+@pytest.mark.parametrize('kwargs', [dict(max_cost=0), dict(cost='tokens'),
+                                    dict(window=0)])
+def test_budget_stream_bad(kwargs):
+    params = dict(max_cost=10, length_key='X')
+    params.update(kwargs)
+    with pytest.raises(pescador.maps.PescadorError):
+        list(pescador.maps.budget_stream(_variable_data([1]), **params))
+
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.budget_stream([1, 2], 10, 'X'))
+
+
+def _labeled_data(lengths):
+    '''Like _variable_data, but the rows of each item are labeled by the
+    item's index.'''
+    return [{'X': np.full((n, 2), i + 1, dtype=np.float32),
+             'Z': np.arange(n) + 1}
+            for i, n in enumerate(lengths)]
+
+
+def _check_packed(rows, data, max_len, pack_keys=('X',)):
+    '''Check that rows reconstruct their items, and return the item ids.'''
+    seen = []
+    for row in rows:
+        assert row['segment_ids'].shape == (max_len,)
+        n_segments = row['segment_ids'].max()
+        for k in pack_keys:
+            assert row[k].shape[0] == max_len
+            assert not np.any(row[k][row['segment_ids'] == 0])
+
+        for s in range(1, n_segments + 1):
+            idx = np.flatnonzero(row['segment_ids'] == s)
+            # Segments are contiguous, and positions count from 0
+            assert np.array_equal(idx, np.arange(idx[0], idx[0] + len(idx)))
+            assert np.array_equal(row['positions'][idx], np.arange(len(idx)))
+
+            i = int(row['X'][idx[0], 0]) - 1
+            for k in pack_keys:
+                assert np.array_equal(row[k][idx], data[i][k])
+            seen.append(i)
+    return seen
+
+
+@pytest.mark.parametrize('method', ['greedy', 'ffd'])
+@pytest.mark.parametrize('window', [1, 7, 1000])
+def test_pack_sequences(method, window):
+    lengths = np.random.RandomState(0).randint(1, 16, size=60)
+    data = _labeled_data(lengths)
+
+    rows = list(pescador.maps.pack_sequences(data, 'X', 16, method=method,
+                                             window=window,
+                                             pack_keys=['X', 'Z']))
+    seen = _check_packed(rows, data, 16, pack_keys=['X', 'Z'])
+    assert sorted(seen) == list(range(len(data)))
+    assert set(rows[0].keys()) == {'X', 'Z', 'segment_ids', 'positions'}
+
+    if method == 'greedy':
+        # Stream order is preserved
+        assert seen == list(range(len(data)))
+
+    # Rows can be batched
+    batch, = list(pescador.maps.buffer_stream(rows, len(rows)))
+    assert batch['X'].shape == (len(rows), 16, 2)
+
+
+def test_pack_sequences_ffd():
+    lengths = np.random.RandomState(1).randint(1, 30, size=500)
+    data = _labeled_data(lengths)
+
+    n_greedy = len(list(pescador.maps.pack_sequences(data, 'X', 32)))
+    n_ffd = len(list(pescador.maps.pack_sequences(data, 'X', 32,
+                                                  method='ffd', window=500)))
+    assert n_ffd < n_greedy
+    # Within a few rows of the lower bound
+    assert n_ffd <= np.ceil(lengths.sum() / 32.) + 3
+
+
+def test_pack_sequences_truncate():
+    data = _labeled_data([3, 10, 2])
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.pack_sequences(data, 'X', 5))
+
+    rows = list(pescador.maps.pack_sequences(data, 'X', 5, truncate=True))
+    assert [list(r['segment_ids']) for r in rows] == [[1, 1, 1, 0, 0],
+                                                      [1, 1, 1, 1, 1],
+                                                      [1, 1, 0, 0, 0]]
+    assert np.array_equal(rows[1]['X'], data[1]['X'][:5])
+
+
+@pytest.mark.parametrize('kwargs', [dict(max_len=0), dict(method='best'),
+                                    dict(window=0)])
+def test_pack_sequences_bad(kwargs):
+    params = dict(key='X', max_len=10)
+    params.update(kwargs)
+    with pytest.raises(pescador.maps.PescadorError):
+        list(pescador.maps.pack_sequences(_labeled_data([1]), **params))
+
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.pack_sequences([1, 2], 'X', 10))
+
+
+@pytest.mark.parametrize('width,hop', [(1, 1), (4, 2), (4, 4), (5, 3),
+                                       (10, 1), (11, 1)])
+@pytest.mark.parametrize('axis', [0, -1])
+def test_windows(width, hop, axis):
+    X = np.arange(30).reshape((10, 3))
+    if axis == -1:
+        X = X.T.copy()
+    data = [{'X': X, 'Y': np.arange(10), 'label': np.array(7)}]
+
+    stream = pescador.maps.windows(data, 'X', width, hop=hop, axis=axis,
+                                   aligned_keys=['Y'])
+    outputs = list(stream)
+    assert len(outputs) == max(0, 1 + (10 - width) // hop)
+
+    for i, out in enumerate(outputs):
+        start = i * hop
+        expected = np.take(X, range(start, start + width), axis=axis)
+        assert np.array_equal(out['X'], expected)
+        assert np.array_equal(out['Y'], np.arange(start, start + width))
+        assert out['label'] is data[0]['label']
+        assert np.may_share_memory(out['X'], X)
+        assert not out['X'].flags['WRITEABLE']
+
+
+def test_windows_default_hop():
+    data = [{'X': np.arange(10)}, {'X': np.arange(2)}, {'X': np.arange(7)}]
+    outputs = [list(x['X']) for x in pescador.maps.windows(data, 'X', 3)]
+    assert outputs == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [0, 1, 2], [3, 4, 5]]
+
+
+@pytest.mark.parametrize('random_state', [0, np.random.RandomState(0),
+                                          np.random.default_rng(0)])
+def test_random_windows(random_state):
+    X = np.arange(100).reshape((2, 50))
+    data = [{'X': X, 'Y': np.arange(50)}, {'X': X[:, :3], 'Y': np.arange(3)}]
+
+    stream = pescador.maps.random_windows(data, 'X', 8, n_windows=20, axis=-1,
+                                          aligned_keys=['Y'],
+                                          random_state=random_state)
+    outputs = list(stream)
+    # The second item is too short
+    assert len(outputs) == 20
+
+    starts = set()
+    for out in outputs:
+        start = out['Y'][0]
+        assert np.array_equal(out['Y'], np.arange(start, start + 8))
+        assert np.array_equal(out['X'], X[:, start:start + 8])
+        assert np.may_share_memory(out['X'], X)
+        starts.add(start)
+    assert len(starts) > 1
+
+
+@pytest.mark.parametrize('kwargs', [dict(width=0), dict(hop=0)])
+def test_windows_bad_args(kwargs):
+    params = dict(key='X', width=2)
+    params.update(kwargs)
+    with pytest.raises(pescador.maps.PescadorError):
+        list(pescador.maps.windows([{'X': np.arange(4)}], **params))
+
+    with pytest.raises(pescador.maps.PescadorError):
+        list(pescador.maps.random_windows([{'X': np.arange(4)}], 'X', 2,
+                                          n_windows=0))
+
+
+def test_windows_bad_data():
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.windows([{'X': np.arange(4), 'Y': np.arange(5)}],
+                                   'X', 2, aligned_keys=['Y']))
+
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.windows([{'X': np.array(4)}], 'X', 2))
+
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.random_windows([[1, 2]], 'X', 2))
+
+
+def _shuffle_data(n):
+    return [{'X': np.full((2, 3), i, dtype=np.float32), 'Y': np.array(i)}
+            for i in range(n)]
+
+
+@pytest.mark.parametrize('n', [0, 5, 50])
+@pytest.mark.parametrize('size', [1, 10, 100])
+def test_shuffle_buffer(n, size):
+    data = _shuffle_data(n)
+    outputs = list(pescador.maps.shuffle_buffer(data, size, random_state=0))
+
+    sample = [int(x['Y']) for x in outputs]
+    assert sorted(sample) == list(range(n))
+    if n > 2 and size > 2:
+        assert sample != list(range(n))
+    for x in outputs:
+        assert np.array_equal(x['X'], data[int(x['Y'])]['X'])
+        assert x['Y'].shape == ()
+
+    # Outputs are not overwritten by later items
+    assert [int(x['Y']) for x in outputs] == sample
+
+
+@pytest.mark.parametrize('batch_size', [1, 3, 10])
+@pytest.mark.parametrize('partial', [False, True])
+def test_shuffle_buffer_batches(batch_size, partial):
+    data = _shuffle_data(47)
+    stream = pescador.maps.shuffle_buffer(data, 10, batch_size=batch_size,
+                                          partial=partial, random_state=1)
+    batches = list(stream)
+
+    sizes = [len(b['Y']) for b in batches]
+    assert all(s == batch_size for s in sizes[:-1])
+    sample = np.concatenate([b['Y'] for b in batches])
+    assert len(set(sample)) == len(sample)
+    if partial or 47 % batch_size == 0:
+        assert sorted(sample) == list(range(47))
+    else:
+        assert len(sample) == 47 - 47 % batch_size
+
+    for batch in batches:
+        assert batch['X'].shape == (len(batch['Y']), 2, 3)
+        assert np.all(batch['X'] == batch['Y'][:, np.newaxis, np.newaxis])
+
+
+@pytest.mark.parametrize('rng', [np.random.RandomState,
+                                 np.random.default_rng])
+def test_shuffle_buffer_batches_uniform(rng):
+    # Every buffered row is equally likely to be in the first batch
+    data = _shuffle_data(9)
+    counts = np.zeros(8)
+    for seed in range(400):
+        stream = pescador.maps.shuffle_buffer(data, 8, batch_size=2,
+                                              random_state=rng(seed))
+        batch = next(stream)
+        assert len(set(batch['Y'])) == 2
+        counts[batch['Y']] += 1
+
+    assert np.all(counts > 60) and np.all(counts < 140)
+
+
+def test_shuffle_buffer_locality():
+    # Items are displaced, but not far beyond the buffer size
+    data = _shuffle_data(1000)
+    sample = [int(x['Y']) for x in
+              pescador.maps.shuffle_buffer(data, 10, random_state=2)]
+    assert sorted(sample) == list(range(1000))
+    assert all(y <= i + 10 for i, y in enumerate(sample))
+
+
+def test_shuffle_buffer_bad():
+    with pytest.raises(pescador.maps.PescadorError):
+        list(pescador.maps.shuffle_buffer(_shuffle_data(3), 0))
+
+    with pytest.raises(pescador.maps.PescadorError):
+        list(pescador.maps.shuffle_buffer(_shuffle_data(3), 2, batch_size=3))
+
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.shuffle_buffer([1, 2, 3], 2))
+
+    data = _shuffle_data(3) + [{'X': np.zeros(4), 'Y': np.array(3)}]
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.shuffle_buffer(data, 2))
+
+    data = _shuffle_data(3) + [{'X': np.zeros((2, 3))}]
+    with pytest.raises(pescador.maps.DataError):
+        list(pescador.maps.shuffle_buffer(data, 2))
@@ -0,0 +1,126 @@
+import pytest
+
+import time
+
+import pescador
+import test_utils as T
+
+
+def _usage(stage):
+    return [u for u in pescador.memory_usage() if u['stage'] == stage]
+
+
+def test_memory_buffer_stream():
+    stream = pescador.Streamer(T.finite_generator, 10, size=3)
+
+    batches = pescador.maps.buffer_stream(stream, 4)
+    assert not _usage('buffer_stream')
+
+    # Buffered items are released before the consumer receives the batch
+    next(batches)
+    usage, = _usage('buffer_stream')
+    assert usage['items'] == 0
+    assert usage['bytes'] == 0
+    assert usage['max_bytes'] is None
+
+    batches.close()
+    assert not _usage('buffer_stream')
+
+
+def test_memory_buffer_stream_pending():
+    held = []
+
+    def __gen():
+        for x in T.finite_generator(10, size=3):
+            yield x
+            held.append(_usage('buffer_stream')[0])
+
+    list(pescador.maps.buffer_stream(__gen(), 5))
+
+    item_bytes = pescador.util.item_nbytes(next(T.finite_generator(1,
+                                                                   size=3)))
+    # Each read happens as the next item is requested
+    assert [u['items'] for u in held] == [1, 2, 3, 4, 0] * 2
+    assert [u['bytes'] for u in held] == [item_bytes * u['items']
+                                          for u in held]
+    assert not _usage('buffer_stream')
+
+
+def test_buffer_stream_max_bytes():
+    stream = pescador.Streamer(T.finite_generator, 20, size=3)
+    item_bytes = pescador.util.item_nbytes(next(T.finite_generator(1,
+                                                                   size=3)))
+
+    batches = list(pescador.maps.buffer_stream(stream, 8,
+                                               max_bytes=3 * item_bytes))
+    assert [len(b['X']) for b in batches] == [3] * 6
+
+    # The limit only shortens batches
+    batches = list(pescador.maps.buffer_stream(stream, 2,
+                                               max_bytes=3 * item_bytes))
+    assert [len(b['X']) for b in batches] == [2] * 10
+
+    with pytest.raises(pescador.PescadorError):
+        next(pescador.maps.buffer_stream(stream, 2, max_bytes=0))
+
+
+def test_memory_mux():
+    streamers = [pescador.Streamer(T.infinite_generator) for _ in range(5)]
+    mux = pescador.StochasticMux(streamers, 3, rate=None)
+
+    stream = mux.iterate()
+    next(stream)
+    usage, = _usage('StochasticMux')
+    assert usage['streams'] == 3
+    assert usage['bytes'] is None
+
+    stream.close()
+    assert not _usage('StochasticMux')
+
+
+def test_memory_zmq():
+    n = 50
+    stream = pescador.Streamer(T.finite_generator, n, size=3)
+    item_bytes = pescador.util.item_nbytes(next(T.finite_generator(1,
+                                                                   size=3)))
+
+    # Without a limit, items are not counted
+    it = pescador.ZMQStreamer(stream).iterate()
+    next(it)
+    assert not _usage('ZMQStreamer')
+    assert len(list(it)) == n - 1
+
+    zmq_stream = pescador.ZMQStreamer(stream, max_bytes=2**30)
+    it = zmq_stream.iterate()
+    next(it)
+    usage, = _usage('ZMQStreamer')
+    assert 0 <= usage['items'] < n
+    assert usage['bytes'] == usage['items'] * item_bytes
+
+    assert len(list(it)) == n - 1
+    assert not _usage('ZMQStreamer')
+
+
+def test_zmq_max_bytes():
+    n = 30
+    stream = pescador.Streamer(T.finite_generator, n, size=3)
+    item_bytes = pescador.util.item_nbytes(next(T.finite_generator(1,
+                                                                   size=3)))
+
+    zmq_stream = pescador.ZMQStreamer(stream, max_bytes=4 * item_bytes)
+    zmq_stream.instrument()
+
+    held = []
+    for data in zmq_stream:
+        held.append(_usage('ZMQStreamer')[0])
+        time.sleep(0.005)
+
+    assert len(held) == n
+    assert all(u['bytes'] <= 4 * item_bytes for u in held)
+    assert all(u['max_bytes'] == 4 * item_bytes for u in held)
+
+    report = zmq_stream.stall_report()
+    assert report['send_blocks'] > 0
+
+    with pytest.raises(pescador.PescadorError):
+        pescador.ZMQStreamer(stream, max_bytes=-1)
@@ -7,6 +7,7 @@ import copy
 import collections
 import functools
 import itertools
+import time
 import numpy as np
 import scipy.stats
 
@@ -226,6 +227,96 @@ class TestCopyMux:
             assert T._eq_list_of_dicts(sample1, sample2)
 
 
+@pytest.mark.parametrize('mux_class', [
+    functools.partial(pescador.mux.StochasticMux, n_active=3, rate=4,
+                      mode='with_replacement'),
+    functools.partial(pescador.mux.StochasticMux, n_active=3, rate=4,
+                      mode='single_active'),
+    pescador.mux.ShuffledMux,
+    functools.partial(pescador.mux.RoundRobinMux, mode='permuted_cycle'),
+],
+    ids=["StochasticMux-with_replacement",
+         "StochasticMux-single_active",
+         "ShuffledMux",
+         "RoundRobinMux-permuted_cycle"])
+class TestGeneratorMux:
+    def _streamers(self, n_streams=6):
+        return [pescador.Streamer(list(range(i * 10, i * 10 + 5)))
+                for i in range(n_streams)]
+
+    @pytest.mark.parametrize('make_state', [
+        lambda: np.random.default_rng(1234),
+        lambda: np.random.SeedSequence(1234)],
+        ids=["Generator", "SeedSequence"])
+    def test_generator_reproducible(self, mux_class, make_state):
+        mux1 = mux_class(self._streamers(), random_state=make_state())
+        mux2 = mux_class(self._streamers(), random_state=make_state())
+
+        assert pescador.util.is_generator(mux1.rng)
+
+        sample1 = list(mux1.iterate(2 * pescador.mux.RNG_BLOCK_SIZE))
+        sample2 = list(mux2.iterate(2 * pescador.mux.RNG_BLOCK_SIZE))
+        assert len(sample1) == 2 * pescador.mux.RNG_BLOCK_SIZE
+        assert sample1 == sample2
+
+    def test_generator_deepcopy(self, mux_class):
+        mux = mux_class(self._streamers(),
+                        random_state=np.random.default_rng(99))
+        copy_mux = copy.deepcopy(mux)
+        assert mux.rng is not copy_mux.rng
+
+        assert list(mux.iterate(30)) == list(copy_mux.iterate(30))
+
+    def test_reseed(self, mux_class):
+        mux1 = mux_class(self._streamers(), random_state=1)
+        mux2 = mux_class(self._streamers(), random_state=2)
+        mux1.reseed(5)
+        mux2.reseed(5)
+        assert pescador.util.is_generator(mux1.rng)
+
+        sample1 = list(mux1.iterate(100))
+        assert sample1 == list(mux2.iterate(100))
+
+        mux2.reseed(6)
+        assert sample1 != list(mux2.iterate(100))
+
+
+def test_reseed_mux_of_muxes():
+    def _build(seed):
+        muxes = [pescador.ShuffledMux([pescador.Streamer(T.infinite_generator,
+                                                         offset=i * 10 + j)
+                                       for j in range(3)],
+                                      random_state=seed)
+                 for i in range(3)]
+        return pescador.ShuffledMux(muxes, random_state=seed)
+
+    mux = _build(0)
+    mux.reseed(17)
+
+    # Children get independent generators
+    rngs = [mux.rng] + [m.rng for m in mux.streamers]
+    assert all(pescador.util.is_generator(r) for r in rngs)
+    assert len(set(id(r) for r in rngs)) == len(rngs)
+
+    mux2 = _build(100)
+    mux2.reseed(17)
+    assert T._eq_list_of_dicts(list(mux.iterate(100)),
+                               list(mux2.iterate(100)))
+
+
+@pytest.mark.parametrize('weights', [[0.5, 0.25, 0.25, 0.0],
+                                     [0.1, 0.2, 0.3, 0.4]])
+def test_generator_mux_weighted(weights):
+    streamers = [pescador.Streamer(_cycle, [i]) for i in range(4)]
+    mux = pescador.ShuffledMux(streamers, weights=weights,
+                               random_state=np.random.default_rng(2018))
+
+    n_samples = 20000
+    counts = np.bincount(list(mux.iterate(n_samples)), minlength=4)
+    assert counts[np.equal(weights, 0)].sum() == 0
+    assert np.allclose(counts / n_samples, weights, atol=0.02)
+
+
 class TestStochasticMux:
     @pytest.mark.parametrize(
         'mode', ['with_replacement', 'single_active', 'exhaustive',
@@ -271,6 +362,76 @@ class TestStochasticMux:
         assert len(result2) == 7
         assert mux.active == 0
 
+    @pytest.mark.parametrize('mode', ['with_replacement', 'single_active',
+                                      'exhaustive'])
+    def test_telemetry(self, mode):
+        def __empty():
+            return
+            yield
+
+        streamers = [pescador.Streamer(T.finite_generator, 10 * (i + 1))
+                     for i in range(4)]
+        streamers.append(pescador.Streamer(__empty))
+        weights = [1., 2., 3., 4., 1.]
+
+        mux = pescador.mux.StochasticMux(streamers, 2, rate=4, mode=mode,
+                                         weights=weights, random_state=3)
+        assert mux.source_stats() is None
+        assert mux.compare_distribution() is None
+        reference = list(copy.deepcopy(mux).iterate(max_iter=2000))
+
+        mux.instrument()
+        items = list(mux.iterate(max_iter=2000))
+        n_items = len(items)
+        # Eager activation does not change the samples
+        assert T._eq_list_of_dicts(reference, items)
+        assert mux.stats()['items'] == n_items
+
+        stats = mux.source_stats()
+        assert stats['samples'].sum() == n_items
+        assert stats['samples'][-1] == 0
+        assert stats['prunes'][-1] >= 1
+        assert stats['prunes'][:-1].sum() == 0
+        assert np.all(stats['activations'][:-1] > 0)
+        assert np.all(stats['activation_time'] >= 0)
+        assert np.all(stats['mean_activation_time'] <=
+                      stats['activation_time'] + 1e-12)
+
+        report = mux.compare_distribution()
+        assert report['n_samples'] == n_items
+        assert np.isclose(report['empirical'].sum(), 1)
+        assert np.allclose(report['expected'], np.array(weights) / 11.)
+        assert report['ratio'][-1] == 0
+        assert 0 <= report['total_variation'] <= 1
+
+        # Counters accumulate over iterations, and are shared by copies
+        list(mux.iterate(max_iter=10))
+        assert mux.source_stats()['samples'].sum() == n_items + 10
+        assert copy.deepcopy(mux).telemetry_ is mux.telemetry_
+
+        mux.instrument(False)
+        assert mux.source_stats() is None
+
+    def test_telemetry_distribution(self):
+        streamers = [pescador.Streamer(T.infinite_generator)
+                     for _ in range(3)]
+        # All sources are active at once, so samples follow the weights
+        mux = pescador.mux.StochasticMux(streamers, 3, rate=None,
+                                         weights=[1., 2., 7.],
+                                         mode='single_active',
+                                         random_state=0).instrument()
+
+        gen = mux.iterate()
+        for _ in range(5000):
+            next(gen)
+        # Closing the generator flushes the active streams
+        gen.close()
+
+        report = mux.compare_distribution()
+        assert report['n_samples'] == 5000
+        assert report['total_variation'] < 0.05
+        assert np.allclose(report['ratio'], 1, atol=0.1)
+
 
 @pytest.mark.parametrize('mux_class', [
     functools.partial(pescador.mux.Mux, with_replacement=True),
@@ -752,6 +913,34 @@ class TestRoundRobinMux:
         assert mux.active == 0
 
 
+@pytest.mark.parametrize('mux_class', [
+    functools.partial(pescador.mux.StochasticMux, n_active=2, rate=None,
+                      mode='exhaustive'),
+    pescador.mux.RoundRobinMux,
+    pescador.mux.ChainMux])
+def test_mux_hooks(mux_class):
+    events = []
+
+    def __on_exhausted(mux, idx):
+        events.append(('exhausted', mux.streams_[idx] is not None))
+
+    def __on_replace(mux, idx):
+        events.append(('replace', idx))
+
+    streamers = [pescador.Streamer('ab'), pescador.Streamer('cde'),
+                 pescador.Streamer('f')]
+    mux = mux_class(streamers)
+    mux.add_hook('activate', lambda m: events.append('activate'))
+    mux.add_hook('exhausted', __on_exhausted)
+    mux.add_hook('replace', __on_replace)
+
+    assert sorted(mux) == list('abcdef')
+    assert events[0] == 'activate'
+    n_exhausted = events.count(('exhausted', True))
+    assert n_exhausted >= 3
+    assert len([e for e in events if e[0] == 'replace']) == n_exhausted
+
+
 class TestChainMux:
     @pytest.mark.parametrize('mode', [
         "exhaustive", "cycle",
@@ -874,3 +1063,58 @@ class TestChainMux:
         assert "".join(result2) == "bbccc"
         assert len(result2) == 5
         assert mux.active == 0
+
+    @pytest.mark.parametrize('lookahead', [1, 2, 10])
+    @pytest.mark.parametrize('mode', ["exhaustive", "cycle"])
+    def test_chain_lookahead_order(self, lookahead, mode):
+        def stream_gen():
+            for item in ["aa", [], "bbb", [], [], "c", "dddd"]:
+                yield pescador.Streamer(item)
+
+        reference = pescador.mux.ChainMux(stream_gen, mode=mode)
+        mux = pescador.mux.ChainMux(stream_gen, mode=mode,
+                                    lookahead=lookahead)
+
+        n_samples = 30 if mode == "cycle" else None
+        expected = "".join(reference.iterate(max_iter=n_samples))
+        assert "".join(mux.iterate(max_iter=n_samples)) == expected
+        # A second pass behaves identically
+        assert "".join(mux.iterate(max_iter=n_samples)) == expected
+
+    def test_chain_lookahead_activates_early(self):
+        opened = []
+
+        def __open(name):
+            opened.append(name)
+            for char in name:
+                yield char
+
+        streamers = [pescador.Streamer(__open, name)
+                     for name in ["abc", "def", "ghi"]]
+        mux = pescador.mux.ChainMux(streamers, lookahead=1)
+
+        gen = mux.iterate()
+        assert next(gen) == "a"
+        # Give the background activation a chance to run
+        time.sleep(0.1)
+        assert opened == ["abc", "def"]
+
+        assert "".join(gen) == "bcdefghi"
+        assert opened == ["abc", "def", "ghi"]
+
+    def test_chain_lookahead_error(self):
+        def __fail():
+            raise ValueError('bad source')
+            yield
+
+        streamers = [pescador.Streamer("abc"), pescador.Streamer(__fail)]
+        mux = pescador.mux.ChainMux(streamers, lookahead=1)
+
+        with pytest.raises(ValueError):
+            list(mux.iterate())
+
+    @pytest.mark.parametrize('lookahead', [-1, 1.5, None])
+    def test_chain_bad_lookahead(self, lookahead):
+        with pytest.raises(pescador.PescadorError):
+            pescador.mux.ChainMux([pescador.Streamer("abc")],
+                                  lookahead=lookahead)
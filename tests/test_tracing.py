@@ -0,0 +1,112 @@
+import pytest
+
+import json
+import os
+import numpy as np
+
+import pescador
+import pescador.tracing
+import test_utils as T
+
+
+def _load(path):
+    with open(path) as fdesc:
+        trace = json.load(fdesc)
+    return trace['traceEvents']
+
+
+def test_trace(tmpdir):
+    path = str(tmpdir.join('trace.json'))
+
+    streamers = [pescador.Streamer(T.finite_generator, 5) for _ in range(2)]
+    mux = pescador.ChainMux(streamers)
+
+    with pescador.trace(path):
+        batches = list(pescador.maps.buffer_stream(mux, 2))
+        with pescador.span('train', step=1):
+            pass
+
+    assert len(batches) == 5
+    assert pescador.tracing._TRACER is None
+    assert not tmpdir.listdir('*.part')
+
+    events = _load(path)
+    spans = [e for e in events if e['ph'] == 'X']
+    cats = [e['cat'] for e in spans]
+    activated = [e['name'] for e in spans if e['cat'] == 'activate']
+    assert activated.count('ChainMux') == 1
+    assert activated.count('Streamer(finite_generator)') == 2
+    assert cats.count('batch') == 5
+    assert cats.count('user') == 1
+    assert 0 < cats.count('consumer') <= cats.count('producer')
+
+    names = set(e['name'] for e in spans if e['cat'] == 'producer')
+    assert {'ChainMux', 'Streamer(finite_generator)'} <= names
+
+    for event in spans:
+        assert event['dur'] >= 0
+        assert event['pid'] == os.getpid()
+
+    meta, = [e for e in events if e['ph'] == 'M']
+    assert meta['args']['name'] == 'main'
+
+    # Tracing is off again
+    assert list(pescador.Streamer(T.finite_generator, 3).iterate())
+    assert _load(path) == events
+
+
+def test_trace_sampled(tmpdir):
+    path = str(tmpdir.join('trace.json'))
+    stream = pescador.Streamer(T.finite_generator, 100)
+
+    with pescador.trace(path, sample_rate=0.1, buffer_size=3):
+        assert len(list(stream)) == 100
+
+    producer = [e for e in _load(path) if e.get('cat') == 'producer']
+    assert len(producer) == 10
+
+
+def test_trace_zmq(tmpdir):
+    path = str(tmpdir.join('trace.json'))
+    stream = pescador.ZMQStreamer(
+        pescador.Streamer(T.finite_generator, 20, size=3))
+
+    with pescador.trace(path):
+        data = list(stream)
+    assert len(data) == 20
+
+    events = _load(path)
+    processes = {e['pid']: e['args']['name'] for e in events
+                 if e['ph'] == 'M'}
+    assert sorted(processes.values()) == ['main', 'zmq_worker']
+    worker, = [pid for pid in processes if processes[pid] == 'zmq_worker']
+
+    names = [(e['pid'], e['name']) for e in events if e['ph'] == 'X']
+    assert names.count((worker, 'zmq_send')) == 20
+    assert names.count((os.getpid(), 'zmq_recv')) >= 20
+    assert (worker, 'Streamer(finite_generator)') in names
+    assert (os.getpid(), 'ZMQStreamer') in names
+
+
+def test_trace_bad(tmpdir):
+    path = str(tmpdir.join('trace.json'))
+    with pytest.raises(pescador.PescadorError):
+        pescador.tracing.start_trace(path, sample_rate=0)
+
+    with pytest.raises(pescador.PescadorError):
+        pescador.tracing.start_trace(path, buffer_size=0)
+
+    pescador.tracing.start_trace(path)
+    try:
+        with pytest.raises(pescador.PescadorError):
+            pescador.tracing.start_trace(path)
+    finally:
+        assert pescador.tracing.stop_trace() == path
+
+    assert pescador.tracing.stop_trace() is None
+
+
+def test_span_disabled():
+    with pescador.span('nothing'):
+        x = np.ones(3)
+    assert x.sum() == 3
@@ -166,3 +166,45 @@ def test_warning_rename_kw_fail():
 
         # And that it says the right thing (roughly)
         assert 'renamed' in str(out[0].message).lower()
+
+
+@pytest.mark.parametrize('random_state', [
+    None, 10, np.random.RandomState(10), np.random.default_rng(10),
+    np.random.SeedSequence(10),
+    pytest.mark.xfail('foo', raises=pescador.util.PescadorError)])
+def test_get_rng(random_state):
+    rng = pescador.util.get_rng(random_state)
+
+    if random_state is None:
+        assert rng is np.random
+    elif isinstance(random_state, (np.random.RandomState,
+                                   np.random.Generator)):
+        assert rng is random_state
+    elif isinstance(random_state, np.random.SeedSequence):
+        assert pescador.util.is_generator(rng)
+    else:
+        assert isinstance(rng, np.random.RandomState)
+
+
+@pytest.mark.parametrize('random_state', [
+    None, 10, np.random.SeedSequence(10),
+    pytest.mark.xfail(np.random.RandomState(10),
+                      raises=pescador.util.PescadorError)])
+def test_spawn_seeds(random_state):
+    seeds = pescador.util.spawn_seeds(random_state, 4)
+    assert len(seeds) == 4
+
+    states = [tuple(s.generate_state(4)) for s in seeds]
+    assert len(set(states)) == len(states)
+
+
+def test_spawn_seeds_reproducible():
+    s1 = pescador.util.spawn_seeds(20180129, 3)
+    s2 = pescador.util.spawn_seeds(20180129, 3)
+    for a, b in zip(s1, s2):
+        assert np.all(a.generate_state(4) == b.generate_state(4))
+
+    s3 = pescador.util.spawn_seeds(np.random.default_rng(5), 3)
+    s4 = pescador.util.spawn_seeds(np.random.default_rng(5), 3)
+    for a, b in zip(s3, s4):
+        assert np.all(a.generate_state(4) == b.generate_state(4))
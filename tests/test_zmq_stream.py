@@ -84,3 +84,65 @@ def test_zmq_buffer():
 
     outputs = [x for x in zmq_stream]
     assert len(outputs) == int(n_samples) / buff_size
+
+
+def test_zmq_random_state():
+    def __mux():
+        streamers = [pescador.Streamer(T.infinite_generator, offset=i * 10)
+                     for i in range(5)]
+        return pescador.StochasticMux(streamers, 2, rate=4)
+
+    z1 = pescador.ZMQStreamer(__mux(), random_state=11)
+    z2 = pescador.ZMQStreamer(__mux(), random_state=11)
+
+    epoch1 = list(z1.iterate(max_iter=50))
+    assert T._eq_list_of_dicts(epoch1, list(z2.iterate(max_iter=50)))
+
+    # Each epoch gets its own seed
+    epoch2 = list(z1.iterate(max_iter=50))
+    assert not T._eq_list_of_dicts(epoch1, epoch2)
+    assert T._eq_list_of_dicts(epoch2, list(z2.iterate(max_iter=50)))
+
+
+def test_zmq_stall_report():
+    stream = pescador.Streamer(T.finite_generator, 64, size=3)
+
+    zmq_stream = pescador.ZMQStreamer(stream)
+    assert zmq_stream.stall_report() is None
+
+    zmq_stream.instrument()
+    assert len(list(zmq_stream)) == 64
+    assert len(list(zmq_stream)) == 64
+
+    report = zmq_stream.stall_report()
+    assert report['received'] == 128
+    assert report['sent'] == 128
+    assert 0 <= report['recv_blocks'] <= report['received']
+    assert 0 <= report['send_blocks'] <= report['sent']
+    assert 0 <= report['consumer_wait'] <= 1
+    assert 0 <= report['producer_wait'] <= 1
+    assert len(report['depth_history']) == 8
+    assert 0 <= report['mean_depth'] <= report['max_depth'] <= 64
+    assert report['verdict'] in ('producer-bound', 'consumer-bound',
+                                 'balanced')
+    assert report['summary'].startswith(report['verdict'] + ':')
+    assert '\n' not in report['summary']
+
+    # Statistics from the base streamer are collected as well
+    assert zmq_stream.stats()['items'] == 128
+
+    zmq_stream.instrument(False)
+    assert zmq_stream.stall_report() is None
+
+
+def test_zmq_stall_producer_bound():
+    stream = pescador.Streamer(T.finite_generator, 20, size=3, lag=0.01)
+    zmq_stream = pescador.ZMQStreamer(stream).instrument()
+
+    assert len(list(zmq_stream)) == 20
+
+    report = zmq_stream.stall_report()
+    assert report['verdict'] == 'producer-bound'
+    assert report['recv_blocks'] > 10
+    assert report['send_blocks'] == 0
+    assert report['consumer_wait'] > report['producer_wait']